@@ -1,7 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.core.database import get_db
-from app.core.auth import get_current_user, create_access_token, verify_password, get_password_hash
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.database import get_async_db
+from app.core.auth import get_current_user, get_current_admin_user, create_access_token
+from app.core.password_pool import password_hasher, PasswordPoolBusy
+from app.core.auth_cache import auth_cache
 from app.services.steam_auth import SteamAuthService
 from app.models.user import User
 from app.schemas.user import (
@@ -16,7 +19,7 @@ router = APIRouter()
 
 
 @router.post("/steam/login", response_model=SteamAuthResponse)
-async def steam_login(steam_id: str, db: Session = Depends(get_db)):
+async def steam_login(steam_id: str, db: AsyncSession = Depends(get_async_db)):
     """Steam登录"""
     auth_result = await SteamAuthService.authenticate_user(steam_id)
 
@@ -24,7 +27,7 @@ async def steam_login(steam_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail=auth_result["message"])
 
     # 检查用户是否已存在
-    user = db.query(User).filter(User.steam_id == steam_id).first()
+    user = await db.scalar(select(User).where(User.steam_id == steam_id))
 
     if not user:
         # 检查是否是管理员Steam ID
@@ -39,14 +42,14 @@ async def steam_login(steam_id: str, db: Session = Depends(get_db)):
             is_admin=is_admin
         )
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
     else:
         # 如果用户已存在，检查是否需要更新管理员状态
         from app.core.config import settings
         if steam_id in settings.admin_steam_ids and not user.is_admin:
             user.is_admin = True
-            db.commit()
+            await db.commit()
 
     return SteamAuthResponse(**auth_result)
 
@@ -58,16 +61,30 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 
 
 @router.post("/login", response_model=AuthResponse)
-async def login(request: LoginRequest, db: Session = Depends(get_db)):
+async def login(request: LoginRequest, db: AsyncSession = Depends(get_async_db)):
     """账号密码登录"""
-    user = db.query(User).filter(User.email == request.email).first()
+    user = await db.scalar(select(User).where(User.email == request.email))
+    if not user:
+        raise HTTPException(status_code=400, detail="邮箱或密码错误")
 
-    if not user or not verify_password(request.password, user.password_hash):
+    # 计算哈希期间不占用数据库连接（close会分离user，已加载的属性仍可读取）
+    await db.close()
+    try:
+        valid, new_hash = await password_hasher.verify_and_update(request.password, user.password_hash)
+    except PasswordPoolBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    if not valid:
         raise HTTPException(status_code=400, detail="邮箱或密码错误")
 
     if not user.is_active:
         raise HTTPException(status_code=400, detail="账号已被禁用")
 
+    # 哈希cost低于当前配置时顺便升级
+    if new_hash:
+        await db.execute(update(User).where(User.id == user.id).values(password_hash=new_hash))
+        await db.commit()
+        user.password_hash = new_hash
+
     # 生成访问token
     access_token = create_access_token(data={"sub": str(user.id)})
 
@@ -80,15 +97,19 @@ async def login(request: LoginRequest, db: Session = Depends(get_db)):
 
 
 @router.post("/register", response_model=AuthResponse)
-async def register(request: RegisterRequest, db: Session = Depends(get_db)):
+async def register(request: RegisterRequest, db: AsyncSession = Depends(get_async_db)):
     """用户注册"""
     # 检查邮箱是否已存在
-    existing_user = db.query(User).filter(User.email == request.email).first()
+    existing_user = await db.scalar(select(User.id).where(User.email == request.email))
     if existing_user:
         raise HTTPException(status_code=400, detail="邮箱已被注册")
 
-    # 创建新用户
-    hashed_password = get_password_hash(request.password)
+    # 创建新用户（计算哈希期间不占用数据库连接）
+    await db.close()
+    try:
+        hashed_password = await password_hasher.hash(request.password)
+    except PasswordPoolBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     user = User(
         username=request.username,
         email=request.email,
@@ -96,8 +117,8 @@ async def register(request: RegisterRequest, db: Session = Depends(get_db)):
     )
 
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
 
     # 生成访问token
     access_token = create_access_token(data={"sub": str(user.id)})
@@ -114,3 +135,12 @@ async def register(request: RegisterRequest, db: Session = Depends(get_db)):
 async def logout():
     """登出（客户端处理token清除）"""
     return {"message": "已登出"}
+
+
+@router.get("/metrics")
+async def get_auth_metrics(current_user: User = Depends(get_current_admin_user)):
+    """认证缓存命中率、认证耗时和密码哈希进程池状态"""
+    return {
+        **auth_cache.get_metrics(),
+        "password_hasher": password_hasher.get_metrics()
+    }
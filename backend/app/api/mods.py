@@ -1,126 +1,262 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from sqlalchemy.orm import Session
-from typing import List
-from app.core.database import get_db
-from app.core.auth import get_current_user
-from app.services.download_service import DownloadService
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
+import httpx
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from typing import List, Dict, Optional
+from app.core.database import get_async_db
+from app.core.auth import get_current_user, get_current_admin_user
+from app.services.download_service import download_service
+from app.services.download_manager import download_manager
+from app.services.download_queue import download_queue
+from app.services.workshop_metadata import workshop_metadata
+from app.services.workshop_collections import resolve
+from app.services.workshop_sync import workshop_sync
+from app.services.task_store import IN_QUERY_BATCH
 from app.models.mod import WorkshopItem, DownloadTask
 from app.schemas.mod import (
     WorkshopItem as WorkshopItemSchema,
     WorkshopDownloadRequest,
     WorkshopDownloadResponse,
-    DownloadTask as DownloadTaskSchema
+    WorkshopSyncRequest,
+    WorkshopSyncResponse
 )
 
 router = APIRouter()
-download_service = DownloadService()
+
+
+async def _get_items_by_workshop_id(db: AsyncSession, workshop_ids: List[str]) -> Dict[str, WorkshopItem]:
+    """按workshop_id批量查询物品（分批以避免超出SQLite参数上限）"""
+    items = {}
+    for i in range(0, len(workshop_ids), IN_QUERY_BATCH):
+        batch = workshop_ids[i:i + IN_QUERY_BATCH]
+        for item in await db.scalars(select(WorkshopItem).where(WorkshopItem.workshop_id.in_(batch))):
+            items[item.workshop_id] = item
+    return items
+
+
+async def _get_workshop_ids(db: AsyncSession, installed_only: bool = False) -> List[str]:
+    """查询所有（或仅已安装）物品的workshop_id"""
+    query = select(WorkshopItem.workshop_id)
+    if installed_only:
+        query = query.where(WorkshopItem.is_installed == True)
+    return list(await db.scalars(query))
 
 
 @router.get("/workshop", response_model=List[WorkshopItemSchema])
 async def get_workshop_items(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取创意工坊物品列表"""
-    items = db.query(WorkshopItem).offset(skip).limit(limit).all()
-    return items
+    items = await db.scalars(select(WorkshopItem).offset(skip).limit(limit))
+    return items.all()
 
 
 @router.post("/workshop/download", response_model=WorkshopDownloadResponse)
 async def download_workshop_items(
     request: WorkshopDownloadRequest,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user = Depends(get_current_user)
 ):
-    """下载创意工坊物品"""
-    # 创建下载任务记录
-    tasks = []
-    for workshop_id in request.workshop_ids:
-        # 检查是否已存在
-        existing_item = db.query(WorkshopItem).filter(
-            WorkshopItem.workshop_id == workshop_id
-        ).first()
-
-        if not existing_item:
-            # 创建新的工作坊物品记录
-            item = WorkshopItem(
-                workshop_id=workshop_id,
-                title=f"Workshop Item {workshop_id}",
-                item_type="unknown"
-            )
-            db.add(item)
-            db.commit()
-            db.refresh(item)
-        else:
-            item = existing_item
+    """批量下载创意工坊物品
 
-        # 创建下载任务
-        task = DownloadTask(
-            workshop_item_id=item.id,
-            status="pending"
+    合集递归展开，物品的必需物品作为依赖先于物品下载；重复ID去重，
+    已安装或已在队列中的物品跳过。物品和任务记录在同一事务中批量插入，只提交一次。
+    """
+    try:
+        graph = await resolve(
+            workshop_metadata, request.collection_ids, request.workshop_ids, request.include_required
         )
-        db.add(task)
-        db.commit()
-        db.refresh(task)
-        tasks.append(task)
-
-    # 后台执行下载
-    background_tasks.add_task(
-        download_service.download_workshop_items,
-        request.workshop_ids
-    )
+    except (httpx.HTTPError, ValueError) as e:
+        if request.collection_ids:
+            raise HTTPException(status_code=502, detail=f"获取合集内容失败: {str(e)}")
+        # 只是无法解析必需物品时按原列表下载
+        graph = None
+    workshop_ids = graph.items if graph else list(dict.fromkeys(request.workshop_ids))
+
+    # 一次IN查询取出已存在的物品，缺失的用一条executemany插入后再查回ID
+    items = await _get_items_by_workshop_id(db, workshop_ids)
+    missing = [workshop_id for workshop_id in workshop_ids if workshop_id not in items]
+    if missing:
+        await db.execute(insert(WorkshopItem), [
+            {"workshop_id": workshop_id, "title": f"Workshop Item {workshop_id}", "item_type": "unknown"}
+            for workshop_id in missing
+        ])
+        items.update(await _get_items_by_workshop_id(db, missing))
+
+    # 按拓扑序创建任务，依赖已安装的物品不需要等待，依赖已在队列中的物品时等待那个任务
+    queued_tasks = download_manager.active_workshop_tasks()
+    task_ids: Dict[str, str] = {}
+    skipped = []
+    specs = []
+    for workshop_id in workshop_ids:
+        item = items[workshop_id]
+        if item.is_installed:
+            skipped.append({"workshop_id": workshop_id, "reason": "已安装"})
+        elif item.id in queued_tasks:
+            task_ids[workshop_id] = queued_tasks[item.id].task_id
+            skipped.append({"workshop_id": workshop_id, "reason": "已在下载队列中"})
+        else:
+            task_ids[workshop_id] = download_manager.new_task_id("workshop")
+            payload = {"workshop_id": workshop_id}
+            depends_on = [
+                task_ids[required_id] for required_id in (graph.requires.get(workshop_id, []) if graph else [])
+                if required_id in task_ids
+            ]
+            if depends_on:
+                payload["depends_on"] = depends_on
+            specs.append({
+                "task_id": task_ids[workshop_id],
+                "task_type": "workshop",
+                "description": f"下载创意工坊物品 {workshop_id}",
+                "workshop_item_id": item.id,
+                "priority": request.priority,
+                "user_id": current_user.id,
+                "payload": payload
+            })
+
+    # 任务记录与新物品一起提交，由全局下载队列按优先级和并发上限调度
+    created = await db.run_sync(lambda session: download_manager.create_tasks(specs, session))
+    download_queue.schedule()
+
+    # 新物品只有占位标题，后台补齐标题、大小等元数据
+    unresolved = [workshop_id for workshop_id in workshop_ids if items[workshop_id].time_updated is None]
+    if unresolved:
+        background_tasks.add_task(workshop_metadata.enrich, unresolved)
+
+    tasks = []
+    record_ids = [task.db_id for task in created]
+    for i in range(0, len(record_ids), IN_QUERY_BATCH):
+        tasks.extend(await db.scalars(
+            select(DownloadTask)
+            .options(joinedload(DownloadTask.workshop_item))
+            .where(DownloadTask.id.in_(record_ids[i:i + IN_QUERY_BATCH]))
+        ))
 
     return WorkshopDownloadResponse(
         success=True,
-        message=f"已开始下载 {len(request.workshop_ids)} 个物品",
-        tasks=tasks
+        message=f"已加入下载队列 {len(created)} 个物品" + (f"，跳过 {len(skipped)} 个" if skipped else ""),
+        tasks=tasks,
+        skipped=skipped,
+        collections=graph.collections if graph else [],
+        cycles=graph.cycles if graph else []
     )
 
 
+@router.post("/workshop/sync", response_model=WorkshopSyncResponse)
+async def sync_workshop_items(
+    request: WorkshopSyncRequest,
+    db: AsyncSession = Depends(get_async_db),
+    current_user = Depends(get_current_admin_user)
+):
+    """增量同步：只重新下载Steam上已更新的物品，dry_run时只返回差异"""
+    if request.workshop_ids:
+        items = await _get_items_by_workshop_id(db, list(dict.fromkeys(request.workshop_ids)))
+        unknown = [workshop_id for workshop_id in request.workshop_ids if workshop_id not in items]
+        workshop_ids = list(items)
+    else:
+        unknown = []
+        workshop_ids = await _get_workshop_ids(db, installed_only=True)
+
+    try:
+        diff = await workshop_sync.plan(workshop_ids, refresh=request.refresh)
+    except (httpx.HTTPError, ValueError) as e:
+        raise HTTPException(status_code=502, detail=f"获取创意工坊元数据失败: {str(e)}")
+
+    summary = "，".join(f"{category} {len(entries)}" for category, entries in diff.items() if entries)
+    if request.dry_run:
+        return WorkshopSyncResponse(
+            success=True, message=f"同步预览：{summary or '无物品'}", dry_run=True, diff=diff, unknown=unknown
+        )
+
+    result = await workshop_sync.apply(diff, db, user_id=current_user.id, priority=request.priority)
+    return WorkshopSyncResponse(
+        success=True,
+        message=f"已修复 {len(result['repaired'])} 个物品，加入下载队列 {len(result['task_ids'])} 个物品",
+        dry_run=False,
+        diff=diff,
+        unknown=unknown,
+        **result
+    )
+
+
+@router.post("/workshop/metadata/refresh")
+async def refresh_workshop_metadata(
+    workshop_ids: Optional[List[str]] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user = Depends(get_current_admin_user)
+):
+    """从Steam重新获取物品元数据（不传ID时刷新全部物品）"""
+    if not workshop_ids:
+        workshop_ids = await _get_workshop_ids(db)
+    stats = await workshop_metadata.enrich(workshop_ids, refresh=True)
+    return {
+        "message": f"已更新 {stats['updated']} 个物品，{stats['unchanged']} 个无变化，{stats['missing']} 个未找到",
+        **stats
+    }
+
+
+@router.post("/workshop/gc")
+async def gc_workshop_blobs(
+    db: AsyncSession = Depends(get_async_db),
+    current_user = Depends(get_current_admin_user)
+):
+    """清理不再被任何物品引用的文件"""
+    referenced_ids = await _get_workshop_ids(db)
+    result = await download_service.gc_blobs(referenced_ids)
+    return {
+        "message": f"已清理 {result['removed']} 个文件",
+        **result
+    }
+
+
 @router.get("/workshop/{workshop_id}", response_model=WorkshopItemSchema)
-async def get_workshop_item(workshop_id: str, db: Session = Depends(get_db)):
+async def get_workshop_item(workshop_id: str, db: AsyncSession = Depends(get_async_db)):
     """获取创意工坊物品详情"""
-    item = db.query(WorkshopItem).filter(WorkshopItem.workshop_id == workshop_id).first()
+    item = await db.scalar(select(WorkshopItem).where(WorkshopItem.workshop_id == workshop_id))
     if not item:
         raise HTTPException(status_code=404, detail="物品未找到")
     return item
 
 
-@router.get("/downloads", response_model=List[DownloadTaskSchema])
+@router.get("/downloads")
 async def get_download_tasks(
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db)
+    status: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200)
 ):
-    """获取下载任务列表"""
-    tasks = db.query(DownloadTask).offset(skip).limit(limit).all()
-    return tasks
+    """分页获取创意工坊下载任务（按创建时间倒序，翻页时传入上一页的next_cursor）"""
+    return download_manager.get_tasks(status=status, cursor=cursor, limit=limit, task_type="workshop")
 
 
-@router.get("/downloads/{task_id}", response_model=DownloadTaskSchema)
-async def get_download_task(task_id: int, db: Session = Depends(get_db)):
-    """获取下载任务详情"""
-    task = db.query(DownloadTask).filter(DownloadTask.id == task_id).first()
-    if not task:
+@router.get("/downloads/{task_id}")
+async def get_download_task(task_id: str):
+    """获取创意工坊下载任务详情（task_id为列表中返回的task_id）"""
+    task = await download_manager.fetch_task(task_id)
+    if not task or task.task_type != "workshop":
         raise HTTPException(status_code=404, detail="任务未找到")
-    return task
+    return task.to_dict()
 
 
 @router.delete("/workshop/{workshop_id}")
 async def uninstall_workshop_item(
     workshop_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user = Depends(get_current_user)
 ):
     """卸载创意工坊物品"""
-    item = db.query(WorkshopItem).filter(WorkshopItem.workshop_id == workshop_id).first()
+    item = await db.scalar(select(WorkshopItem).where(WorkshopItem.workshop_id == workshop_id))
     if not item:
         raise HTTPException(status_code=404, detail="物品未找到")
 
-    # 这里可以添加实际的卸载逻辑
+    # 按安装清单删除文件
+    removed_files = await download_service.uninstall_item(workshop_id)
     item.is_installed = False
-    db.commit()
+    item.install_path = None
+    item.installed_size = None
+    await db.commit()
 
-    return {"message": "物品已卸载"}
+    return {"message": "物品已卸载", "removed_files": removed_files}
@@ -1,12 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
-from app.core.database import get_db
-from app.core.auth import get_current_user
+import asyncio
+import random
+from fastapi import APIRouter, Depends, HTTPException, Header, Query
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from typing import List, Optional
+from app.core.database import get_async_db
+from app.core.auth import get_current_user, get_current_admin_user
 from app.models.room import Room, RoomPlayer
 from app.models.user import User
+from app.services.a2s import a2s_poller
+from app.services.room_lobby import room_lobby
 from app.schemas.room import (
     Room as RoomSchema,
+    RoomDetail,
+    RoomPage,
     RoomCreate,
     RoomUpdate,
     RoomJoinRequest,
@@ -16,43 +26,137 @@ from app.schemas.room import (
 
 router = APIRouter()
 
+# 加入/离开房间遇到写冲突时的重试次数和初始退避（秒）
+ROOM_WRITE_ATTEMPTS = 5
+ROOM_WRITE_RETRY_DELAY = 0.05
 
-@router.get("/", response_model=List[RoomSchema])
+# 房间详情需要的关系，用selectinload加载（每个关系一次查询）
+ROOM_DETAIL_OPTIONS = (selectinload(Room.server), selectinload(Room.creator))
+
+
+def with_live_state(room: Room, schema=RoomSchema):
+    """服务器在线时用A2S缓存中的实际人数和地图覆盖计数器"""
+    data = schema.model_validate(room)
+    live = a2s_poller.get(room.server_id) if room.server_id else None
+    if live is not None:
+        data.current_map = live["map"]
+        data.current_players = live["players"]
+    return data
+
+
+async def _with_retry(db: AsyncSession, operation):
+    """写冲突（SQLite写锁超时、PostgreSQL死锁/序列化失败）时回滚并退避重试"""
+    for attempt in range(ROOM_WRITE_ATTEMPTS):
+        try:
+            return await operation()
+        except OperationalError:
+            await db.rollback()
+            if attempt == ROOM_WRITE_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(ROOM_WRITE_RETRY_DELAY * 2 ** attempt * (0.5 + random.random()))
+
+
+async def _claim_slot(db: AsyncSession, room_id: int, user_id: int) -> Optional[str]:
+    """插入玩家记录并原子地占用一个名额，成功返回None，否则返回失败原因"""
+    try:
+        await db.execute(insert(RoomPlayer).values(room_id=room_id, user_id=user_id))
+    except IntegrityError:
+        await db.rollback()
+        return "您已经在房间中"
+
+    claimed = await db.execute(
+        update(Room)
+        .where(Room.id == room_id, Room.is_active == True, Room.current_players < Room.max_players)
+        .values(current_players=Room.current_players + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if claimed.rowcount != 1:
+        await db.rollback()
+        return "房间已满"
+    await db.commit()
+    return None
+
+
+async def _release_slot(db: AsyncSession, room_id: int, user_id: int) -> bool:
+    """删除玩家记录并归还名额，玩家不在房间中时返回False"""
+    removed = await db.execute(
+        delete(RoomPlayer).where(RoomPlayer.room_id == room_id, RoomPlayer.user_id == user_id)
+    )
+    if removed.rowcount != 1:
+        await db.rollback()
+        return False
+    await db.execute(
+        update(Room)
+        .where(Room.id == room_id, Room.current_players > 0)
+        .values(current_players=Room.current_players - 1)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return True
+
+
+@router.get("/", response_model=RoomPage)
 async def get_rooms(
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db)
+    game_mode: Optional[str] = None,
+    current_map: Optional[str] = None,
+    has_free_slots: Optional[bool] = None,
+    is_private: Optional[bool] = None,
+    cursor: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=200),
+    if_none_match: Optional[str] = Header(None)
 ):
-    """获取房间列表"""
-    rooms = db.query(Room).filter(Room.is_active == True).offset(skip).limit(limit).all()
-    return rooms
+    """分页获取开放中的房间（按ID升序，翻页时传入上一页的next_cursor；人数和地图来自A2S缓存）
+
+    由内存中的大厅索引按条件过滤，不查询数据库；大厅未变化时按ETag返回304。
+    """
+    await room_lobby.sync()
+    headers = {"ETag": room_lobby.etag, "Cache-Control": "no-cache"}
+    if room_lobby.not_modified(if_none_match):
+        return Response(status_code=304, headers=headers)
+
+    rooms, next_cursor, total = room_lobby.query(
+        game_mode=game_mode,
+        current_map=current_map,
+        has_free_slots=has_free_slots,
+        is_private=is_private,
+        cursor=cursor,
+        limit=limit
+    )
+    return JSONResponse({"rooms": rooms, "next_cursor": next_cursor, "total": total}, headers=headers)
+
+
+@router.get("/metrics")
+async def get_lobby_metrics(current_user: User = Depends(get_current_admin_user)):
+    """大厅索引的房间数、版本和304命中率"""
+    return room_lobby.get_metrics()
 
 
 @router.post("/", response_model=RoomSchema)
 async def create_room(
     room: RoomCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """创建房间"""
     # 检查服务器是否存在
     from app.models.server import Server
-    from app.services.server_manager import ServerManager
+    from app.services.server_manager import server_supervisor
+    from app.services.warm_pool import warm_pool
 
-    server = db.query(Server).filter(Server.id == room.server_id).first()
+    server = await db.get(Server, room.server_id)
     if not server:
         raise HTTPException(status_code=404, detail="服务器未找到")
 
     # 创建房间记录
     db_room = Room(**room.dict(), creator_id=current_user.id)
     db.add(db_room)
-    db.commit()
-    db.refresh(db_room)
+    await db.commit()
+    await db.refresh(db_room)
+    room_lobby.mark_dirty(db_room.id)
 
     # 如果服务器未运行，自动启动服务器
-    if server.status != "running":
+    if not server_supervisor.is_server_running(server.id):
         try:
-            server_manager = ServerManager()
             # 使用房间的配置启动服务器
             config = {
                 "port": server.port,
@@ -63,10 +167,17 @@ async def create_room(
                 "rcon_password": server.rcon_password
             }
 
-            start_result = server_manager.start_server(config)
+            # 优先认领预热实例，没有时再冷启动
+            start_result = await warm_pool.claim(server.id, config)
+            if start_result is None:
+                start_result = await server_supervisor.start_server(server.id, config)
             if start_result["success"]:
                 server.status = "running"
-                db.commit()
+                server.port = start_result["port"]
+                if start_result.get("rcon_password"):
+                    server.rcon_password = start_result["rcon_password"]
+                await db.commit()
+                room_lobby.mark_server_dirty(server.id)
             else:
                 # 服务器启动失败，但房间已经创建
                 print(f"警告：服务器启动失败 - {start_result['message']}")
@@ -76,24 +187,24 @@ async def create_room(
     return db_room
 
 
-@router.get("/{room_id}", response_model=RoomSchema)
-async def get_room(room_id: int, db: Session = Depends(get_db)):
+@router.get("/{room_id}", response_model=RoomDetail)
+async def get_room(room_id: int, db: AsyncSession = Depends(get_async_db)):
     """获取房间详情"""
-    room = db.query(Room).filter(Room.id == room_id).first()
+    room = await db.get(Room, room_id, options=ROOM_DETAIL_OPTIONS)
     if not room:
         raise HTTPException(status_code=404, detail="房间未找到")
-    return room
+    return with_live_state(room, RoomDetail)
 
 
 @router.put("/{room_id}", response_model=RoomSchema)
 async def update_room(
     room_id: int,
     room_update: RoomUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """更新房间"""
-    room = db.query(Room).filter(Room.id == room_id).first()
+    room = await db.get(Room, room_id)
     if not room:
         raise HTTPException(status_code=404, detail="房间未找到")
 
@@ -101,11 +212,20 @@ async def update_room(
     if room.creator_id != current_user.id and not current_user.is_admin:
         raise HTTPException(status_code=403, detail="没有权限")
 
-    for field, value in room_update.dict(exclude_unset=True).items():
+    updates = room_update.dict(exclude_unset=True)
+    for field, value in updates.items():
         setattr(room, field, value)
 
-    db.commit()
-    db.refresh(room)
+    await db.commit()
+    await db.refresh(room)
+    room_lobby.mark_dirty(room.id)
+
+    # 房间所在服务器运行中时，通过RCON实时切换地图/模式/密码
+    if room.server_id:
+        from app.services.server_manager import server_supervisor
+        await server_supervisor.apply_live(room.server_id, {
+            key: updates[key] for key in ("current_map", "game_mode", "password") if key in updates
+        })
     return room
 
 
@@ -113,11 +233,11 @@ async def update_room(
 async def join_room(
     room_id: int,
     join_request: RoomJoinRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """加入房间"""
-    room = db.query(Room).filter(Room.id == room_id).first()
+    room = await db.get(Room, room_id)
     if not room:
         raise HTTPException(status_code=404, detail="房间未找到")
 
@@ -127,7 +247,7 @@ async def join_room(
             message="房间已关闭"
         )
 
-    # 检查房间是否已满
+    # 明显已满时直接拒绝，不占用写锁（最终以_claim_slot中的条件更新为准）
     if room.current_players >= room.max_players:
         return RoomJoinResponse(
             success=False,
@@ -141,24 +261,13 @@ async def join_room(
             message="密码错误"
         )
 
-    # 检查是否已经在房间中
-    existing_player = db.query(RoomPlayer).filter(
-        RoomPlayer.room_id == room_id,
-        RoomPlayer.user_id == current_user.id
-    ).first()
-
-    if existing_player:
-        return RoomJoinResponse(
-            success=False,
-            message="您已经在房间中"
-        )
-
-    # 加入房间
-    room_player = RoomPlayer(room_id=room_id, user_id=current_user.id)
-    db.add(room_player)
-    room.current_players += 1
-    db.commit()
+    # 占用名额和插入玩家记录在同一事务中完成，由数据库保证不超员、不重复加入
+    failure = await _with_retry(db, lambda: _claim_slot(db, room_id, current_user.id))
+    if failure:
+        return RoomJoinResponse(success=False, message=failure)
+    room_lobby.mark_dirty(room_id)
 
+    await db.refresh(room)
     return RoomJoinResponse(
         success=True,
         message="成功加入房间",
@@ -169,42 +278,37 @@ async def join_room(
 @router.post("/{room_id}/leave")
 async def leave_room(
     room_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """离开房间"""
-    room_player = db.query(RoomPlayer).filter(
-        RoomPlayer.room_id == room_id,
-        RoomPlayer.user_id == current_user.id
-    ).first()
-
-    if not room_player:
+    if not await _with_retry(db, lambda: _release_slot(db, room_id, current_user.id)):
         raise HTTPException(status_code=404, detail="您不在此房间中")
-
-    room = db.query(Room).filter(Room.id == room_id).first()
-    if room:
-        room.current_players = max(0, room.current_players - 1)
-        db.delete(room_player)
-        db.commit()
+    room_lobby.mark_dirty(room_id)
 
     return {"message": "已离开房间"}
 
 
 @router.get("/{room_id}/players", response_model=List[RoomPlayerSchema])
-async def get_room_players(room_id: int, db: Session = Depends(get_db)):
-    """获取房间玩家列表"""
-    players = db.query(RoomPlayer).filter(RoomPlayer.room_id == room_id).all()
-    return players
+async def get_room_players(room_id: int, db: AsyncSession = Depends(get_async_db)):
+    """获取房间玩家列表（附带玩家信息）"""
+    players = await db.scalars(
+        select(RoomPlayer)
+        .options(selectinload(RoomPlayer.user))
+        .where(RoomPlayer.room_id == room_id)
+        .order_by(RoomPlayer.id)
+    )
+    return players.all()
 
 
 @router.delete("/{room_id}")
 async def delete_room(
     room_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """删除房间"""
-    room = db.query(Room).filter(Room.id == room_id).first()
+    room = await db.get(Room, room_id)
     if not room:
         raise HTTPException(status_code=404, detail="房间未找到")
 
@@ -213,10 +317,11 @@ async def delete_room(
         raise HTTPException(status_code=403, detail="没有权限")
 
     # 删除所有房间玩家记录
-    db.query(RoomPlayer).filter(RoomPlayer.room_id == room_id).delete()
+    await db.execute(delete(RoomPlayer).where(RoomPlayer.room_id == room_id))
 
     # 删除房间
-    db.delete(room)
-    db.commit()
+    await db.delete(room)
+    await db.commit()
+    room_lobby.mark_dirty(room_id)
 
     return {"message": "房间已删除"}
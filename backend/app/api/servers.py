@@ -1,24 +1,57 @@
-import subprocess
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
-from app.core.database import get_db
+import asyncio
+import json
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Dict, List, Optional
+from app.core.database import get_async_db
 from app.core.auth import get_current_admin_user
-from app.services.server_manager import ServerManager
+from app.services.server_manager import server_supervisor
+from app.services.warm_pool import warm_pool
+from app.services.a2s import a2s_poller
+from app.services.room_lobby import room_lobby
 from app.services.server_installer import ServerInstaller
 from app.services.steam_auth import SteamAuthService
 from app.services.download_manager import download_manager
+from app.services.download_queue import download_queue
 from app.models.server import Server
 from app.schemas.server import (
     Server as ServerSchema,
     ServerCreate,
     ServerUpdate,
+    ServerUpdateResult,
     ServerControl,
     ServerStatusResponse
 )
 
 router = APIRouter()
-server_manager = ServerManager()
+
+# SSE空闲时发送保活注释的间隔（秒）
+SSE_KEEPALIVE_INTERVAL = 15
+
+
+def server_config(server: Server) -> Dict[str, Any]:
+    """服务器记录中用于启动和实时应用的配置"""
+    return {
+        "port": server.port,
+        "max_players": server.max_players,
+        "current_map": server.current_map,
+        "game_mode": server.game_mode,
+        "difficulty": server.difficulty,
+        "password": server.password,
+        "rcon_password": server.rcon_password
+    }
+
+
+def with_live_state(server: Server) -> ServerSchema:
+    """用A2S缓存中的实时地图和人数覆盖数据库中的值"""
+    data = ServerSchema.model_validate(server)
+    live = a2s_poller.get(server.id)
+    if live is not None:
+        data.current_map = live["map"]
+        data.current_players = live["players"]
+    return data
 
 
 # 安装相关路由（必须放在前面，避免与{server_id}冲突）
@@ -95,15 +128,80 @@ async def full_installation(
 
 # 下载任务管理端点
 @router.get("/downloads")
-async def get_download_tasks():
-    """获取所有下载任务"""
-    return download_manager.get_all_tasks()
+async def get_download_tasks(
+    status: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200)
+):
+    """分页获取下载任务（按创建时间倒序，翻页时传入上一页的next_cursor）"""
+    return download_manager.get_tasks(status=status, cursor=cursor, limit=limit)
+
+
+@router.get("/downloads/queue")
+async def get_download_queue_status():
+    """获取下载队列状态（并发上限、执行中的任务、排队数）"""
+    return download_queue.get_status()
+
+
+def _format_sse(event: dict) -> str:
+    return f"id: {event['seq']}\nevent: task\ndata: {json.dumps(event['task'], ensure_ascii=False)}\n\n"
+
+
+@router.get("/downloads/events")
+async def stream_download_events(
+    since: int = 0,
+    last_event_id: Optional[int] = Header(None)
+):
+    """以Server-Sent Events推送任务状态变化（断线重连时自动从Last-Event-ID续传）"""
+    subscription = download_manager.events.subscribe(last_event_id or since)
+
+    async def event_stream():
+        try:
+            while True:
+                events = await subscription.get(timeout=SSE_KEEPALIVE_INTERVAL)
+                if not events:
+                    # 保活注释，防止代理断开空闲连接
+                    yield ": keepalive\n\n"
+                    continue
+                for event in events:
+                    yield _format_sse(event)
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.websocket("/downloads/ws")
+async def download_events_websocket(websocket: WebSocket, since: int = 0):
+    """以WebSocket推送任务状态变化，消息格式为 {"seq": 序号, "task": 任务}"""
+    await websocket.accept()
+    subscription = download_manager.events.subscribe(since)
+
+    async def send_events():
+        while True:
+            for event in await subscription.get():
+                await websocket.send_json(event)
+
+    sender = asyncio.create_task(send_events())
+    try:
+        # 持续接收以便及时发现客户端断开
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        subscription.close()
 
 
 @router.get("/downloads/{task_id}")
 async def get_download_task(task_id: str):
     """获取下载任务详情"""
-    task = download_manager.get_task(task_id)
+    task = await download_manager.fetch_task(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="下载任务不存在")
     return task.to_dict()
@@ -112,101 +210,133 @@ async def get_download_task(task_id: str):
 @router.delete("/downloads/{task_id}")
 async def cancel_download_task(task_id: str, current_user = Depends(get_current_admin_user)):
     """取消下载任务"""
-    task = download_manager.get_task(task_id)
-    if not task:
-        raise HTTPException(status_code=404, detail="下载任务不存在")
+    result = await download_queue.cancel(task_id)
+    if not result["success"]:
+        raise HTTPException(status_code=404 if result["message"] == "下载任务不存在" else 400, detail=result["message"])
+    return {"message": result["message"]}
+
+
+@router.post("/downloads/{task_id}/pause")
+async def pause_download_task(task_id: str, current_user = Depends(get_current_admin_user)):
+    """暂停下载任务"""
+    return await download_queue.pause(task_id)
+
+
+@router.post("/downloads/{task_id}/resume")
+async def resume_download_task(task_id: str, current_user = Depends(get_current_admin_user)):
+    """恢复已暂停的下载任务"""
+    return download_queue.resume(task_id)
 
-    if task.status == "running" and task.process:
-        try:
-            task.process.terminate()
-            task.process.wait(timeout=5)
-        except subprocess.TimeoutExpired:
-            task.process.kill()
 
-    download_manager.fail_task(task_id, "任务已被取消")
-    return {"message": "下载任务已取消"}
+@router.put("/downloads/{task_id}/priority")
+async def set_download_priority(task_id: str, priority: int, current_user = Depends(get_current_admin_user)):
+    """调整下载任务优先级（越大越优先）"""
+    result = download_queue.set_priority(task_id, priority)
+    if result["success"]:
+        download_queue.schedule()
+    return result
+
+
+@router.get("/pool")
+async def get_warm_pool_metrics(current_user = Depends(get_current_admin_user)):
+    """获取预热服务器池状态与命中率"""
+    return warm_pool.get_metrics()
 
 
 @router.get("/", response_model=List[ServerSchema])
-async def get_servers(db: Session = Depends(get_db)):
-    """获取所有服务器"""
-    servers = db.query(Server).all()
-    return servers
+async def get_servers(db: AsyncSession = Depends(get_async_db)):
+    """获取所有服务器（地图和人数来自A2S缓存）"""
+    servers = await db.scalars(select(Server))
+    return [with_live_state(server) for server in servers]
 
 
 @router.post("/", response_model=ServerSchema)
 async def create_server(
     server: ServerCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_admin_user)
 ):
     """创建新服务器"""
     db_server = Server(**server.dict())
     db.add(db_server)
-    db.commit()
-    db.refresh(db_server)
+    await db.commit()
+    await db.refresh(db_server)
     return db_server
 
 
 @router.get("/{server_id}", response_model=ServerSchema)
-async def get_server(server_id: int, db: Session = Depends(get_db)):
+async def get_server(server_id: int, db: AsyncSession = Depends(get_async_db)):
     """获取服务器详情"""
-    server = db.query(Server).filter(Server.id == server_id).first()
+    server = await db.get(Server, server_id)
     if not server:
         raise HTTPException(status_code=404, detail="服务器未找到")
-    return server
+    return with_live_state(server)
 
 
-@router.put("/{server_id}", response_model=ServerSchema)
+@router.put("/{server_id}", response_model=ServerUpdateResult)
 async def update_server(
     server_id: int,
     server_update: ServerUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_admin_user)
 ):
     """更新服务器"""
-    server = db.query(Server).filter(Server.id == server_id).first()
+    server = await db.get(Server, server_id)
     if not server:
         raise HTTPException(status_code=404, detail="服务器未找到")
 
-    for field, value in server_update.dict(exclude_unset=True).items():
+    updates = server_update.dict(exclude_unset=True)
+    for field, value in updates.items():
         setattr(server, field, value)
 
-    db.commit()
-    db.refresh(server)
-    return server
+    await db.commit()
+    await db.refresh(server)
+    room_lobby.mark_server_dirty(server.id)
+
+    # 运行中的服务器通过RCON实时应用地图/模式/难度变更
+    live_apply = await server_supervisor.apply_live(server.id, updates)
+    return ServerUpdateResult(**with_live_state(server).model_dump(), live_apply=live_apply)
 
 
 @router.post("/{server_id}/control", response_model=ServerStatusResponse)
 async def control_server(
     server_id: int,
     control: ServerControl,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_admin_user)
 ):
-    """控制服务器（启动/停止/重启）"""
-    server = db.query(Server).filter(Server.id == server_id).first()
+    """控制服务器（启动/停止/重启/实时应用配置）"""
+    server = await db.get(Server, server_id)
     if not server:
         raise HTTPException(status_code=404, detail="服务器未找到")
 
     action = control.action.lower()
 
     if action == "start":
-        result = server_manager.start_server(server.__dict__)
+        result = await server_supervisor.start_server(server.id, server_config(server))
         if result["success"]:
             server.status = "running"
     elif action == "stop":
-        result = server_manager.stop_server()
+        result = await server_supervisor.stop_server(server.id)
         if result["success"]:
             server.status = "stopped"
     elif action == "restart":
-        result = server_manager.restart_server(server.__dict__)
+        result = await server_supervisor.restart_server(server.id, server_config(server))
         if result["success"]:
             server.status = "running"
+    elif action == "apply":
+        result = await server_supervisor.apply_live(server.id, server_config(server))
+        if result is None:
+            result = {"success": False, "message": "服务器未运行或未配置RCON密码"}
     else:
         raise HTTPException(status_code=400, detail="无效的操作")
 
-    db.commit()
+    # 配置端口被占用时会分配新端口
+    if result.get("port") and result["port"] != server.port:
+        server.port = result["port"]
+
+    await db.commit()
+    room_lobby.mark_server_dirty(server.id)
 
     return ServerStatusResponse(
         success=result["success"],
@@ -218,22 +348,27 @@ async def control_server(
 @router.post("/{server_id}/update", response_model=ServerStatusResponse)
 async def update_server_files(
     server_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_admin_user)
 ):
-    """更新服务器文件"""
-    result = server_manager.update_server()
+    """更新服务器文件（后台下载任务，可通过 /downloads/{task_id} 查看进度）"""
+    server = await db.get(Server, server_id)
+    if not server:
+        raise HTTPException(status_code=404, detail="服务器未找到")
+
+    result = await server_supervisor.update_server()
     return ServerStatusResponse(
         success=result["success"],
-        status="running" if result["success"] else "error",
-        message=result["message"]
+        status=server.status,
+        message=result["message"],
+        details={"task_id": result["task_id"]} if result.get("task_id") else None
     )
 
 
 @router.get("/{server_id}/status")
 async def get_server_status(server_id: int):
     """获取服务器状态"""
-    status_info = server_manager.get_server_info()
+    status_info = server_supervisor.get_server_info(server_id)
     return {
         "server_id": server_id,
         "status": status_info
@@ -1,29 +1,29 @@
 import json
+import time
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.config import settings
-from app.core.database import get_db
+from app.core.database import get_async_db
+from app.core.auth_cache import auth_cache
+from app.core.password_pool import pwd_context
 from app.models.user import User
 
-# 密码哈希上下文
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # JWT令牌
 security = HTTPBearer()
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """验证密码"""
+    """验证密码（同步，会阻塞；请求处理中使用 password_hasher）"""
     return pwd_context.verify(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
-    """获取密码哈希"""
+    """获取密码哈希（同步，会阻塞；请求处理中使用 password_hasher）"""
     return pwd_context.hash(password)
 
 
@@ -40,41 +40,66 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-def verify_token(token: str) -> Optional[dict]:
-    """验证JWT令牌"""
+def decode_signed_token(token: str) -> Optional[dict]:
+    """解码并校验服务端签发的JWT令牌"""
     try:
-        # 首先尝试标准的JWT解码
-        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
-        return payload
+        return jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
     except JWTError:
-        # 如果失败，尝试解码前端生成的base64 token
-        try:
-            import base64
-            decoded = base64.b64decode(token)
-            payload = json.loads(decoded.decode('utf-8'))
-
-            # 检查token是否过期
-            if payload.get('exp', 0) < int(datetime.utcnow().timestamp()):
-                return None
-
-            return payload
-        except Exception:
+        return None
+
+
+def decode_frontend_token(token: str) -> Optional[dict]:
+    """解码前端生成的base64 token（未签名，只检查是否过期）"""
+    try:
+        import base64
+        decoded = base64.b64decode(token)
+        payload = json.loads(decoded.decode('utf-8'))
+
+        # 检查token是否过期
+        if payload.get('exp', 0) < int(datetime.utcnow().timestamp()):
             return None
 
+        return payload
+    except Exception:
+        return None
+
+
+def verify_token(token: str) -> Optional[dict]:
+    """验证JWT令牌"""
+    # 首先尝试标准的JWT解码，失败时尝试解码前端生成的base64 token
+    payload = decode_signed_token(token)
+    if payload is None:
+        payload = decode_frontend_token(token)
+    return payload
+
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> User:
-    """获取当前用户"""
+    """获取当前用户
+
+    已验证过的令牌直接从auth_cache返回（只读的User对象），未命中时验证令牌并查询一次数据库。
+    只缓存签名校验通过的JWT；前端生成的未签名token每次都重新解码和查询。
+    """
+    started = time.perf_counter()
+    token = credentials.credentials
+    user = auth_cache.get(token)
+    if user is not None:
+        auth_cache.record(True, time.perf_counter() - started)
+        return user
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-    token = credentials.credentials
-    payload = verify_token(token)
+    generation = auth_cache.generation
+    payload = decode_signed_token(token)
+    signed = payload is not None
+    if not signed:
+        payload = decode_frontend_token(token)
     if payload is None:
         raise credentials_exception
 
@@ -82,16 +107,11 @@ async def get_current_user(
     if subject is None:
         raise credentials_exception
 
-    # 尝试通过用户ID查找（账号密码登录）
-    try:
-        user_id = int(subject)
-        user = db.query(User).filter(User.id == user_id).first()
-    except ValueError:
-        user = None
-
-    # 如果没找到，尝试通过steam_id查找（Steam登录）
-    if user is None:
-        user = db.query(User).filter(User.steam_id == subject).first()
+    # 账号密码登录的sub为用户ID，Steam登录的sub为steam_id；两列都有索引，合并为一次查询
+    condition = User.steam_id == subject
+    if subject.isdigit():
+        condition = or_(User.id == int(subject), condition)
+    user = await db.scalar(select(User).where(condition).order_by(User.steam_id == subject).limit(1))
 
     if user is None:
         raise credentials_exception
@@ -99,6 +119,10 @@ async def get_current_user(
     if not user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
 
+    db.expunge(user)
+    if signed:
+        auth_cache.put(token, user, payload.get("exp"), generation)
+    auth_cache.record(False, time.perf_counter() - started)
     return user
 
 
@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Set, Tuple
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+from app.core.config import settings
+from app.models.user import User
+
+# 变化后需要让已缓存的令牌失效的用户字段
+PRINCIPAL_FIELDS = ("is_active", "is_admin")
+
+
+class AuthCache:
+    """已验证令牌 -> 用户 的有界TTL缓存
+
+    命中时跳过JWT解码和数据库查询。缓存的是已从会话分离的User对象，只能读取。
+    用户被停用或管理员权限变化时（提交后）立即失效；绕过ORM的批量更新只能等TTL过期。
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, User]]" = OrderedDict()
+        self._tokens_by_user: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+        # 每次失效加一；查询数据库期间发生过失效时不缓存查到的（可能是旧的）用户
+        self.generation = 0
+        self.metrics = {
+            "hits": 0, "misses": 0, "evictions": 0, "invalidations": 0,
+            "hit_seconds": 0.0, "miss_seconds": 0.0
+        }
+
+    def get(self, token: str) -> Optional[User]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at <= now:
+                self._remove(token)
+                return None
+            self._entries.move_to_end(token)
+            return user
+
+    def put(self, token: str, user: User, token_exp: Optional[float] = None, generation: Optional[int] = None):
+        """缓存到TTL或令牌过期时间（取较早者）；generation为查询用户前读取的self.generation"""
+        expires_at = time.time() + self.ttl
+        if token_exp:
+            expires_at = min(expires_at, token_exp)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._remove(token)
+            self._entries[token] = (expires_at, user)
+            self._tokens_by_user.setdefault(user.id, set()).add(token)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.metrics["evictions"] += 1
+
+    def invalidate_user(self, user_id: int):
+        """移除该用户的所有缓存令牌"""
+        with self._lock:
+            self.generation += 1
+            tokens = self._tokens_by_user.pop(user_id, set())
+            for token in tokens:
+                self._entries.pop(token, None)
+            self.metrics["invalidations"] += len(tokens)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def _remove(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is not None:
+            tokens = self._tokens_by_user.get(entry[1].id)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._tokens_by_user[entry[1].id]
+
+    def record(self, hit: bool, elapsed: float):
+        """记录一次认证的耗时"""
+        with self._lock:
+            if hit:
+                self.metrics["hits"] += 1
+                self.metrics["hit_seconds"] += elapsed
+            else:
+                self.metrics["misses"] += 1
+                self.metrics["miss_seconds"] += elapsed
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = dict(self.metrics)
+            size = len(self._entries)
+        hits, misses = metrics["hits"], metrics["misses"]
+        total = hits + misses
+        return {
+            "size": size,
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": hits,
+            "misses": misses,
+            "evictions": metrics["evictions"],
+            "invalidations": metrics["invalidations"],
+            "hit_rate": hits / total if total else None,
+            "avg_latency_ms": (metrics["hit_seconds"] + metrics["miss_seconds"]) * 1000 / total if total else None,
+            "avg_hit_latency_ms": metrics["hit_seconds"] * 1000 / hits if hits else None,
+            "avg_miss_latency_ms": metrics["miss_seconds"] * 1000 / misses if misses else None
+        }
+
+
+@event.listens_for(User, "after_update")
+def _mark_principal_changed(mapper, connection, target: User):
+    """is_active/is_admin变化时记下用户ID，提交后再让缓存失效（避免提交前被旧值重新缓存）"""
+    session = object_session(target)
+    state = inspect(target)
+    if session is not None and any(state.attrs[field].history.has_changes() for field in PRINCIPAL_FIELDS):
+        session.info.setdefault("auth_changed_users", set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_principals(session: Session):
+    for user_id in session.info.pop("auth_changed_users", ()):
+        auth_cache.invalidate_user(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_principals(session: Session):
+    session.info.pop("auth_changed_users", None)
+
+
+# 全局认证缓存
+auth_cache = AuthCache(settings.auth_cache_size, settings.auth_cache_ttl)
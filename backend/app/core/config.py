@@ -10,14 +10,28 @@ class Settings(BaseSettings):
 
     # 数据库配置
     database_url: str = "sqlite:///./l4d2_manager.db"
+    async_database_url: Optional[str] = None  # 默认由database_url推导（sqlite+aiosqlite / postgresql+asyncpg）
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout: float = 10.0  # 秒；连接池耗尽时等待的上限
+    db_pool_recycle: int = 1800
+    sqlite_busy_timeout: int = 5000  # 毫秒；写锁被占用时等待而不是立即报database is locked
 
     # JWT配置
     secret_key: str = "your-secret-key-here-change-in-production"
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
+    auth_cache_size: int = 10000  # 缓存的已验证令牌数上限
+    auth_cache_ttl: int = 60  # 秒；绕过ORM修改用户状态时的最长生效延迟
+    bcrypt_rounds: int = 12  # 调高后旧密码哈希在下次登录时自动升级
+    password_hash_workers: int = 2  # 密码哈希进程数（0表示在请求线程中直接计算）
+    password_hash_max_pending: int = 32  # 排队的哈希任务上限，超出时返回503
 
     # Steam API配置
     steam_api_key: Optional[str] = None
+    steam_web_api_url: str = "https://api.steampowered.com"
+    workshop_metadata_ttl: int = 3600
+    workshop_metadata_timeout: float = 10.0
 
     # 管理员配置
     admin_steam_ids: list = ["76561198384629467"]
@@ -26,10 +40,48 @@ class Settings(BaseSettings):
     l4d2_server_path: str = "/home/steam/l4d2_server"
     steamcmd_path: str = "/home/steam/steamcmd"
     steam_config_path: str = "/home/steam/.steam_config"
+    server_stop_timeout: int = 30
+    server_bind_ip: str = "0.0.0.0"
+    server_port_range_start: int = 27015
+    server_port_range_end: int = 27115
+    server_max_restarts: int = 5
+    server_restart_backoff_base: float = 2.0
+    server_restart_backoff_max: float = 60.0
+    server_stable_uptime: int = 120
+    rcon_pool_size: int = 2
+    rcon_timeout: float = 5.0
+
+    # A2S状态轮询配置（0表示禁用轮询）
+    a2s_poll_interval: float = 10.0
+    a2s_cache_ttl: float = 30.0
+    a2s_timeout: float = 2.0
+
+    # 房间大厅内存索引：定时全量同步的间隔（秒，用于补上其他进程的修改；0表示禁用）
+    lobby_resync_interval: float = 30.0
+
+    # 预热服务器池配置（0表示禁用）
+    warm_pool_size: int = 0
+    warm_pool_max_players: int = 8
+    warm_pool_lobby_map: str = "c1m1_hotel"
+    warm_pool_ready_timeout: int = 120
+    warm_pool_check_interval: int = 30
 
     # 工作配置
     download_workers: int = 4
     max_download_concurrent: int = 3
+    download_progress_interval: float = 2.0
+    download_event_interval: float = 0.5
+    task_flush_interval: float = 5.0
+    task_retention_max: int = 500
+    task_retention_ttl: int = 86400
+    size_reconcile_interval: int = 60
+    steamcmd_login_timeout: int = 60
+    workshop_download_timeout: int = 300
+    workshop_min_download_speed: int = 262144  # 字节/秒，用于按物品大小放宽下载超时
+    workshop_retry_attempts: int = 4
+    workshop_retry_base_delay: float = 5.0
+    workshop_retry_max_delay: float = 300.0
+    workshop_blob_gc_grace: int = 3600  # 秒；新建或刚被链接的blob在此期间不会被清理
 
     # Redis配置（可选，用于缓存）
     redis_url: Optional[str] = "redis://localhost:6379/0"
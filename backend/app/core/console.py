@@ -0,0 +1,39 @@
+import enum
+import re
+from typing import Any, Dict
+
+# 以下配置项会被拼接进srcds启动参数和RCON命令，必须校验，防止注入额外的控制台命令
+
+# 地图名、游戏模式：只允许字母、数字和下划线（拼接时不加引号）
+CONSOLE_TOKEN_PATTERN = re.compile(r"^[A-Za-z0-9_]+$")
+CONSOLE_TOKEN_KEYS = ("current_map", "game_mode")
+
+# z_difficulty 的取值
+DIFFICULTIES = ("Easy", "Normal", "Hard", "Impossible")
+
+# 密码放在引号内，不能包含结束引号、命令分隔符或换行
+UNSAFE_QUOTED_CHARS = ('"', ";", "\n", "\r")
+CONSOLE_QUOTED_KEYS = ("password", "rcon_password")
+
+
+def console_value(key: str, value: Any) -> Any:
+    """校验单个配置项，合法时返回字符串形式的值，否则抛出ValueError"""
+    if value is None:
+        return None
+    if isinstance(value, enum.Enum):
+        value = value.value
+    if key in CONSOLE_TOKEN_KEYS:
+        if not isinstance(value, str) or not CONSOLE_TOKEN_PATTERN.match(value):
+            raise ValueError(f"{key} 只能包含字母、数字和下划线")
+    elif key == "difficulty":
+        if value not in DIFFICULTIES:
+            raise ValueError(f"difficulty 必须是 {', '.join(DIFFICULTIES)} 之一")
+    elif key in CONSOLE_QUOTED_KEYS:
+        if not isinstance(value, str) or any(char in value for char in UNSAFE_QUOTED_CHARS):
+            raise ValueError(f"{key} 不能包含引号、分号或换行")
+    return value
+
+
+def console_config(config: Dict[str, Any]) -> Dict[str, Any]:
+    """校验配置中所有会进入控制台的项，返回规范化后的副本"""
+    return {key: console_value(key, value) for key, value in config.items()}
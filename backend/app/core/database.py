@@ -1,23 +1,85 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from app.core.config import settings
 
-# 创建数据库引擎
-engine = create_engine(
-    settings.database_url,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.database_url else {}
-)
+# 同步驱动 -> 异步驱动
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+}
+
+
+def _async_url(url: str) -> str:
+    """由同步连接串推导异步驱动的连接串"""
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.drivername)
+    return parsed.set(drivername=driver).render_as_string(hide_password=False) if driver else url
+
+
+def _engine_args(url: str, is_async: bool = False) -> dict:
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "sqlite":
+        return {
+            "pool_size": settings.db_pool_size,
+            "max_overflow": settings.db_max_overflow,
+            "pool_timeout": settings.db_pool_timeout,
+            "pool_recycle": settings.db_pool_recycle,
+            "pool_pre_ping": True
+        }
+    if parsed.database in (None, "", ":memory:"):
+        # 内存数据库只能使用单连接池
+        return {"connect_args": {"check_same_thread": False}}
+    # SQLite同一时刻只有一个写者，连接数过多只会增加锁竞争；aiosqlite默认不使用连接池，这里显式指定
+    return {
+        "connect_args": {"check_same_thread": False},
+        "poolclass": AsyncAdaptedQueuePool if is_async else QueuePool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": 0,
+        "pool_timeout": settings.db_pool_timeout
+    }
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL模式下读写互不阻塞；synchronous=NORMAL在WAL下仍保证一致性，只在断电时可能丢失最后的提交"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout)}")
+    cursor.close()
+
+
+# 创建数据库引擎（同步，供后台服务和线程池中的任务使用）
+engine = create_engine(settings.database_url, **_engine_args(settings.database_url))
+
+# 异步引擎，供请求处理使用，查询时不阻塞事件循环
+async_database_url = settings.async_database_url or _async_url(settings.database_url)
+async_engine = create_async_engine(async_database_url, **_engine_args(async_database_url, is_async=True))
+
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+if async_engine.dialect.name == "sqlite":
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
 
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 提交后不过期对象：异步会话中访问过期属性会触发隐式IO而报错
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 # 声明式基类
 Base = declarative_base()
 
 
 def get_db():
-    """获取数据库会话"""
+    """获取数据库会话（同步）"""
     db = SessionLocal()
     try:
         yield db
@@ -25,6 +87,42 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    """获取异步数据库会话"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def close_engines():
+    """关闭连接池"""
+    await async_engine.dispose()
+    engine.dispose()
+
+
 def create_tables():
     """创建所有表"""
     Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+
+
+def add_missing_columns():
+    """为已有数据库补齐模型中新增的列和索引（create_all不会修改已存在的表）"""
+    inspector = inspect(engine)
+    tables = [table for table in Base.metadata.sorted_tables if inspector.has_table(table.name)]
+    with engine.begin() as conn:
+        for table in tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+    # 每个索引单独提交：已有数据违反新唯一索引时只跳过该索引，不影响启动
+    for table in tables:
+        for index in table.indexes:
+            try:
+                with engine.begin() as conn:
+                    index.create(bind=conn, checkfirst=True)
+            except IntegrityError as e:
+                print(f"警告：表 {table.name} 中存在重复数据，未创建唯一索引 {index.name} - {str(e.orig)}")
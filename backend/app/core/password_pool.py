@@ -0,0 +1,97 @@
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+from passlib.context import CryptContext
+from app.core.config import settings
+
+# 密码哈希上下文；bcrypt_rounds调高后，旧哈希在下次登录成功时按needs_update自动重新计算
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.bcrypt_rounds)
+
+
+class PasswordPoolBusy(Exception):
+    """等待中的哈希任务已达上限"""
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(password, hashed)
+
+
+class PasswordHasher:
+    """在独立进程池中计算bcrypt，避免阻塞事件循环
+
+    每次bcrypt约需数百毫秒CPU，放在事件循环里会让所有请求排队。进程池大小固定，
+    排队（含执行中）的任务超过max_pending时立即拒绝，由调用方返回503，
+    而不是让登录请求无限堆积。workers为0时在当前线程直接计算（测试/单机小规模使用）。
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.metrics = {"completed": 0, "rejected": 0, "rehashed": 0}
+
+    def start(self):
+        if self.workers > 0 and self._executor is None:
+            # spawn：子进程不继承事件循环和数据库连接
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def _submit(self, fn, *args):
+        if self.workers <= 0:
+            result = fn(*args)
+            self.metrics["completed"] += 1
+            return result
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.metrics["rejected"] += 1
+                raise PasswordPoolBusy("登录请求过多，请稍后重试")
+            self._pending += 1
+        try:
+            self.start()
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self.metrics["completed"] += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(_hash, password)
+
+    async def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """验证密码；哈希的cost已过时时同时返回新哈希（否则为None）"""
+        valid, new_hash = await self._submit(_verify_and_update, password, hashed)
+        if new_hash:
+            self.metrics["rehashed"] += 1
+        return valid, new_hash
+
+    def get_metrics(self):
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self._pending,
+            "rounds": settings.bcrypt_rounds,
+            **self.metrics
+        }
+
+
+# 全局密码哈希进程池
+password_hasher = PasswordHasher(settings.password_hash_workers, settings.password_hash_max_pending)
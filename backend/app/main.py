@@ -1,7 +1,16 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.core.database import create_tables
+from app.core.database import create_tables, close_engines
 from app.api import auth, servers, mods, rooms
+from app.services.server_manager import server_supervisor
+from app.services.warm_pool import warm_pool
+from app.services.rcon import rcon_pool
+from app.services.a2s import a2s_poller
+from app.services.download_manager import download_manager
+from app.core.password_pool import password_hasher
+from app.services.download_queue import download_queue
+from app.services.workshop_metadata import workshop_metadata
+from app.services.room_lobby import room_lobby
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -29,6 +38,26 @@ app.include_router(rooms.router, prefix="/api/rooms", tags=["房间管理"])
 @app.on_event("startup")
 async def startup_event():
     create_tables()
+    password_hasher.start()
+    await download_manager.start()
+    download_queue.start()
+    warm_pool.start()
+    a2s_poller.start()
+    room_lobby.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await download_queue.close()
+    await mods.download_service.close()
+    await workshop_metadata.close()
+    await room_lobby.close()
+    await a2s_poller.close()
+    await warm_pool.close()
+    await rcon_pool.close_all()
+    await server_supervisor.stop_all()
+    await download_manager.close()
+    password_hasher.close()
+    await close_engines()
 
 @app.get("/")
 async def root():
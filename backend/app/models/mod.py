@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, Float, String, DateTime, Boolean, Text, ForeignKey
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.core.database import Base
@@ -13,10 +13,13 @@ class WorkshopItem(Base):
     description = Column(Text, nullable=True)
     author = Column(String, nullable=True)
     preview_url = Column(String, nullable=True)
-    file_size = Column(String, nullable=True)
-    item_type = Column(String, nullable=False)  # mod, map, etc.
+    # 字节数；旧版本的file_size列为自由文本，已弃用
+    file_size = Column("file_size_bytes", BigInteger, nullable=True)
+    item_type = Column(String, nullable=False)  # mod, map, unknown（元数据获取前）
+    time_updated = Column(Integer, nullable=True)  # Steam上的最后更新时间（Unix时间戳）
     is_installed = Column(Boolean, default=False)
     install_path = Column(String, nullable=True)
+    installed_size = Column(BigInteger, nullable=True)  # 安装到游戏目录的字节数（file_size为Steam上的下载大小）
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -25,14 +28,27 @@ class WorkshopItem(Base):
 
 
 class DownloadTask(Base):
+    """下载任务（服务器安装/更新与创意工坊下载共用，由DownloadManager批量写入）"""
     __tablename__ = "download_tasks"
 
     id = Column(Integer, primary_key=True, index=True)
+    task_key = Column(String, unique=True, index=True, nullable=True)  # DownloadManager中的任务ID
+    task_type = Column(String, index=True, default="workshop")  # l4d2_server, server_update, workshop
+    description = Column(String, nullable=True)
     workshop_item_id = Column(Integer, ForeignKey("workshop_items.id"))
-    status = Column(String, default="pending")  # pending, downloading, completed, failed
+    status = Column(String, index=True, default="pending")  # pending, running, paused, completed, failed
+    priority = Column(Integer, default=0)  # 越大越优先
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)  # 提交者，用于按用户公平调度
+    payload = Column(Text, nullable=True)  # 任务参数（JSON，不含密码等敏感信息）
     progress = Column(Integer, default=0)  # 0-100
+    message = Column(Text, nullable=True)
     error_message = Column(Text, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    total_size = Column(BigInteger, default=0)
+    downloaded_size = Column(BigInteger, default=0)
+    pid = Column(Integer, nullable=True)  # 下载进程PID，重启后用于重新接管
+    start_time = Column(Float, nullable=True)  # Unix时间戳
+    end_time = Column(Float, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     # 关联工作坊物品
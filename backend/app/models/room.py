@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.core.database import Base
@@ -6,6 +6,10 @@ from app.core.database import Base
 
 class Room(Base):
     __tablename__ = "rooms"
+    __table_args__ = (
+        # 大厅列表：WHERE is_active AND id > cursor ORDER BY id
+        Index("ix_rooms_is_active_id", "is_active", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
@@ -31,6 +35,10 @@ class Room(Base):
 
 class RoomPlayer(Base):
     __tablename__ = "room_players"
+    __table_args__ = (
+        # 同一玩家在一个房间中只能有一条记录
+        Index("ux_room_players_room_user", "room_id", "user_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     room_id = Column(Integer, ForeignKey("rooms.id"))
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 from datetime import datetime
 
 
@@ -9,7 +9,7 @@ class WorkshopItemBase(BaseModel):
     description: Optional[str] = None
     author: Optional[str] = None
     preview_url: Optional[str] = None
-    file_size: Optional[str] = None
+    file_size: Optional[int] = None
     item_type: str
 
 
@@ -22,7 +22,7 @@ class WorkshopItemUpdate(BaseModel):
     description: Optional[str] = None
     author: Optional[str] = None
     preview_url: Optional[str] = None
-    file_size: Optional[str] = None
+    file_size: Optional[int] = None
     item_type: Optional[str] = None
     is_installed: Optional[bool] = None
     install_path: Optional[str] = None
@@ -30,8 +30,10 @@ class WorkshopItemUpdate(BaseModel):
 
 class WorkshopItem(WorkshopItemBase):
     id: int
+    time_updated: Optional[int] = None
     is_installed: bool
     install_path: Optional[str] = None
+    installed_size: Optional[int] = None
     created_at: datetime
     updated_at: Optional[datetime]
 
@@ -49,8 +51,10 @@ class DownloadTaskCreate(DownloadTaskBase):
 
 class DownloadTask(DownloadTaskBase):
     id: int
+    task_key: Optional[str] = None
     status: str
     progress: int
+    message: Optional[str] = None
     error_message: Optional[str] = None
     created_at: datetime
     updated_at: Optional[datetime]
@@ -68,10 +72,34 @@ class WorkshopSearchQuery(BaseModel):
 
 
 class WorkshopDownloadRequest(BaseModel):
-    workshop_ids: List[str]
+    workshop_ids: List[str] = []
+    collection_ids: List[str] = []  # 合集（递归展开子合集）
+    include_required: bool = True  # 同时下载物品的"必需物品"，并在其之后执行
+    priority: int = 0  # 越大越优先
 
 
 class WorkshopDownloadResponse(BaseModel):
     success: bool
     message: str
     tasks: List[DownloadTask]
+    skipped: List[Dict[str, str]] = []
+    collections: List[str] = []  # 已展开的合集
+    cycles: List[List[str]] = []  # 检测到的合集嵌套环/必需物品环
+
+
+class WorkshopSyncRequest(BaseModel):
+    workshop_ids: Optional[List[str]] = None  # 为空时同步所有已安装的物品
+    dry_run: bool = False  # 只返回差异，不下载也不修复
+    refresh: bool = True  # 重新获取Steam元数据（否则使用缓存）
+    priority: int = 0
+
+
+class WorkshopSyncResponse(BaseModel):
+    success: bool
+    message: str
+    dry_run: bool
+    diff: Dict[str, List[Dict[str, Any]]]  # unchanged/new/outdated/damaged/missing/unversioned
+    unknown: List[str] = []  # 数据库中没有记录的物品ID
+    repaired: List[str] = []
+    task_ids: List[str] = []
+    already_queued: List[str] = []
@@ -1,6 +1,8 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 from typing import Optional, List
 from datetime import datetime
+from app.core.console import console_value
+from app.models.server import ServerStatus
 
 
 class RoomBase(BaseModel):
@@ -14,7 +16,11 @@ class RoomBase(BaseModel):
 
 
 class RoomCreate(RoomBase):
-    pass
+    @field_validator("current_map", "game_mode", "password")
+    @classmethod
+    def check_console_value(cls, value, info):
+        """这些值会进入srcds控制台命令"""
+        return console_value(info.field_name, value)
 
 
 class RoomUpdate(BaseModel):
@@ -26,6 +32,34 @@ class RoomUpdate(BaseModel):
     current_map: Optional[str] = None
     is_active: Optional[bool] = None
 
+    @field_validator("current_map", "game_mode", "password")
+    @classmethod
+    def check_console_value(cls, value, info):
+        """这些值会进入srcds控制台命令"""
+        return console_value(info.field_name, value)
+
+
+class RoomServer(BaseModel):
+    """房间所在服务器的连接信息"""
+    id: int
+    name: str
+    host: Optional[str] = None
+    port: Optional[int] = None
+    status: Optional[ServerStatus] = None
+
+    class Config:
+        from_attributes = True
+
+
+class RoomUser(BaseModel):
+    """房间创建者/玩家的公开信息"""
+    id: int
+    username: str
+    avatar_url: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
 
 class Room(RoomBase):
     id: int
@@ -39,6 +73,18 @@ class Room(RoomBase):
         from_attributes = True
 
 
+class RoomDetail(Room):
+    """附带服务器和创建者信息（需要预加载server和creator关系）"""
+    server: Optional[RoomServer] = None
+    creator: Optional[RoomUser] = None
+
+
+class RoomPage(BaseModel):
+    rooms: List[RoomDetail]
+    next_cursor: Optional[int] = None
+    total: int
+
+
 class RoomPlayerBase(BaseModel):
     room_id: int
     user_id: int
@@ -47,6 +93,7 @@ class RoomPlayerBase(BaseModel):
 class RoomPlayer(RoomPlayerBase):
     id: int
     joined_at: datetime
+    user: Optional[RoomUser] = None
 
     class Config:
         from_attributes = True
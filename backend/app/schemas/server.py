@@ -1,6 +1,7 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 from typing import Optional
 from datetime import datetime
+from app.core.console import console_value
 from app.models.server import ServerStatus, GameMode
 
 
@@ -17,7 +18,11 @@ class ServerBase(BaseModel):
 
 
 class ServerCreate(ServerBase):
-    pass
+    @field_validator("current_map", "difficulty", "password", "rcon_password")
+    @classmethod
+    def check_console_value(cls, value, info):
+        """这些值会进入srcds控制台命令"""
+        return console_value(info.field_name, value)
 
 
 class ServerUpdate(BaseModel):
@@ -31,10 +36,18 @@ class ServerUpdate(BaseModel):
     password: Optional[str] = None
     rcon_password: Optional[str] = None
 
+    @field_validator("current_map", "difficulty", "password", "rcon_password")
+    @classmethod
+    def check_console_value(cls, value, info):
+        """这些值会进入srcds控制台命令"""
+        return console_value(info.field_name, value)
+
 
 class Server(ServerBase):
     id: int
     status: ServerStatus
+    # 实时人数（来自A2S缓存，服务器未运行时为空）
+    current_players: Optional[int] = None
     created_at: datetime
     updated_at: Optional[datetime]
 
@@ -42,8 +55,13 @@ class Server(ServerBase):
         from_attributes = True
 
 
+class ServerUpdateResult(Server):
+    # 运行中的服务器通过RCON实时应用变更的结果（服务器未运行或未配置RCON密码时为空）
+    live_apply: Optional[dict] = None
+
+
 class ServerControl(BaseModel):
-    action: str  # start, stop, restart
+    action: str  # start, stop, restart, apply
 
 
 class ServerStatusResponse(BaseModel):
@@ -0,0 +1,292 @@
+import asyncio
+import socket
+import struct
+import time
+from typing import Callable, Optional, Dict, Any, List, Tuple
+from app.core.config import settings
+from app.services.server_manager import ServerSupervisor, server_supervisor
+
+
+# A2S 请求/响应类型
+A2S_INFO = 0x54
+A2S_PLAYER = 0x55
+S2A_INFO = 0x49
+S2A_PLAYER = 0x44
+S2C_CHALLENGE = 0x41
+
+SIMPLE_HEADER = b"\xFF\xFF\xFF\xFF"
+SPLIT_HEADER = b"\xFE\xFF\xFF\xFF"
+INFO_PAYLOAD = b"Source Engine Query\x00"
+
+Address = Tuple[str, int]
+
+# 主机名解析结果的缓存时间（秒）
+RESOLVE_TTL = 60
+
+
+class A2SError(Exception):
+    """A2S查询异常"""
+
+
+class _Reader:
+    """按A2S格式顺序读取响应字段"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.offset = 0
+
+    def byte(self) -> int:
+        value = self.data[self.offset]
+        self.offset += 1
+        return value
+
+    def unpack(self, fmt: str):
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values[0]
+
+    def string(self) -> str:
+        end = self.data.index(b"\x00", self.offset)
+        value = self.data[self.offset:end].decode("utf-8", errors="replace")
+        self.offset = end + 1
+        return value
+
+
+def parse_info(payload: bytes) -> Dict[str, Any]:
+    """解析 S2A_INFO 响应（不含包头与类型字节）"""
+    reader = _Reader(payload)
+    reader.byte()  # 协议版本
+    info = {
+        "name": reader.string(),
+        "map": reader.string(),
+        "folder": reader.string(),
+        "game": reader.string(),
+    }
+    reader.unpack("<h")  # app id
+    info["players"] = reader.byte()
+    info["max_players"] = reader.byte()
+    info["bots"] = reader.byte()
+    return info
+
+
+def parse_players(payload: bytes) -> List[Dict[str, Any]]:
+    """解析 S2A_PLAYER 响应（不含包头与类型字节）"""
+    reader = _Reader(payload)
+    players = []
+    for _ in range(reader.byte()):
+        reader.byte()  # index，总为0
+        players.append({
+            "name": reader.string(),
+            "score": reader.unpack("<i"),
+            "duration": reader.unpack("<f")
+        })
+    return players
+
+
+class _A2SProtocol(asyncio.DatagramProtocol):
+    """共享UDP套接字，按来源地址把数据报分发给对应的查询"""
+
+    def __init__(self):
+        self.waiters: Dict[Address, asyncio.Queue] = {}
+        # 分包响应：(地址, 响应ID) -> {序号: 数据}
+        self.fragments: Dict[Tuple[Address, int], Dict[int, bytes]] = {}
+
+    def datagram_received(self, data: bytes, addr):
+        addr = (addr[0], addr[1])
+        queue = self.waiters.get(addr)
+        if queue is None:
+            return
+
+        if data.startswith(SPLIT_HEADER) and len(data) >= 12:
+            # Source格式分包：ID(4) 总数(1) 序号(1) 分片大小(2)
+            response_id, total, number = struct.unpack_from("<iBB", data, 4)
+            key = (addr, response_id)
+            parts = self.fragments.setdefault(key, {})
+            parts[number] = data[12:]
+            if len(parts) < total:
+                return
+            del self.fragments[key]
+            data = b"".join(parts[i] for i in range(total))
+
+        if data.startswith(SIMPLE_HEADER) and len(data) >= 5:
+            queue.put_nowait(data[4:])
+
+    def error_received(self, exc):
+        pass
+
+
+class A2SClient:
+    """异步A2S查询客户端
+
+    所有查询共用一个UDP套接字，不同服务器的查询可以并发进行；
+    同一地址的查询串行执行，以便按顺序匹配响应。
+    """
+
+    def __init__(self, timeout: float = 2):
+        self.timeout = timeout
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        self._protocol: Optional[_A2SProtocol] = None
+        self._locks: Dict[Address, asyncio.Lock] = {}
+        # 主机名 -> (IPv4地址, 解析时间)
+        self._resolved: Dict[str, Tuple[str, float]] = {}
+
+    async def _ensure_socket(self):
+        if self._transport is None or self._transport.is_closing():
+            loop = asyncio.get_running_loop()
+            self._transport, self._protocol = await loop.create_datagram_endpoint(
+                _A2SProtocol, local_addr=("0.0.0.0", 0)
+            )
+
+    async def _request(self, addr: Address, request_type: int, payload: bytes, expected: int) -> bytes:
+        """发送请求并处理challenge握手，返回响应正文"""
+        queue = self._protocol.waiters[addr]
+        challenge = b"\xFF\xFF\xFF\xFF" if request_type == A2S_PLAYER else b""
+
+        # 最多两次：首次请求可能只换回一个challenge
+        for _ in range(2):
+            self._transport.sendto(SIMPLE_HEADER + bytes([request_type]) + payload + challenge, addr)
+            while True:
+                try:
+                    response = await asyncio.wait_for(queue.get(), timeout=self.timeout)
+                except asyncio.TimeoutError:
+                    raise A2SError(f"A2S查询超时: {addr[0]}:{addr[1]}")
+                if response[0] == S2C_CHALLENGE and len(response) >= 5:
+                    challenge = response[1:5]
+                    break
+                if response[0] == expected:
+                    return response[1:]
+                # 其他类型（如迟到的旧响应）忽略
+        raise A2SError(f"A2S challenge握手失败: {addr[0]}:{addr[1]}")
+
+    async def _resolve(self, host: str) -> str:
+        """把主机名解析为IPv4地址：响应按来源IP分发，等待者必须以IP为键"""
+        cached = self._resolved.get(host)
+        if cached is not None and time.monotonic() - cached[1] < RESOLVE_TTL:
+            return cached[0]
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(
+                host, None, family=socket.AF_INET, type=socket.SOCK_DGRAM
+            )
+        except socket.gaierror as e:
+            raise A2SError(f"无法解析主机 {host}: {e}")
+        ip = infos[0][4][0]
+        self._resolved[host] = (ip, time.monotonic())
+        return ip
+
+    async def query(self, host: str, port: int, players: bool = True) -> Dict[str, Any]:
+        """查询服务器信息，players为True时同时查询玩家列表"""
+        await self._ensure_socket()
+        addr = (await self._resolve(host), port)
+        lock = self._locks.setdefault(addr, asyncio.Lock())
+        async with lock:
+            self._protocol.waiters[addr] = asyncio.Queue()
+            try:
+                info = parse_info(await self._request(addr, A2S_INFO, INFO_PAYLOAD, S2A_INFO))
+                if players:
+                    info["player_list"] = parse_players(
+                        await self._request(addr, A2S_PLAYER, b"", S2A_PLAYER)
+                    )
+            except (IndexError, ValueError, struct.error) as e:
+                raise A2SError(f"无效的A2S响应: {e}")
+            finally:
+                self._protocol.waiters.pop(addr, None)
+        return info
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+            self._protocol = None
+
+
+class A2SPoller:
+    """定时并发查询所有运行中的服务器，结果缓存在内存中
+
+    列表接口只读缓存，不会因为请求触发任何UDP查询。地图或人数变化（以及缓存失效）时
+    回调监听者，房间大厅据此更新实时状态。
+    """
+
+    def __init__(self, supervisor: ServerSupervisor):
+        self.supervisor = supervisor
+        self.client = A2SClient(timeout=settings.a2s_timeout)
+        # 服务器ID -> 最近一次成功查询的结果
+        self._cache: Dict[int, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._listeners: List[Callable[[int], None]] = []
+
+    def add_listener(self, callback: Callable[[int], None]):
+        """注册状态变化回调，参数为服务器ID"""
+        self._listeners.append(callback)
+
+    def _notify(self, server_id: int):
+        for callback in self._listeners:
+            callback(server_id)
+
+    def start(self):
+        if settings.a2s_poll_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._poll_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.client.close()
+
+    def get(self, server_id: int) -> Optional[Dict[str, Any]]:
+        """获取缓存的实时状态，过期或不存在时返回None"""
+        state = self._cache.get(server_id)
+        if state is None or time.monotonic() - state["_fetched_at"] > settings.a2s_cache_ttl:
+            return None
+        return state
+
+    async def poll_once(self):
+        """并发查询一轮所有运行中的服务器"""
+        targets = {
+            server_id: instance for server_id, instance in self.supervisor.instances.items()
+            if instance.running and instance.port
+        }
+        results = await asyncio.gather(
+            *(self.client.query(instance.rcon_host, instance.port) for instance in targets.values()),
+            return_exceptions=True
+        )
+
+        now = time.monotonic()
+        changed = set()
+        for server_id, result in zip(targets, results):
+            if isinstance(result, A2SError):
+                continue
+            if isinstance(result, BaseException):
+                raise result
+            previous = self._cache.get(server_id)
+            if previous is None or (previous["map"], previous["players"]) != (result["map"], result["players"]):
+                changed.add(server_id)
+            self._cache[server_id] = {
+                "map": result["map"],
+                "players": result["players"],
+                "max_players": result["max_players"],
+                "bots": result["bots"],
+                "player_list": result.get("player_list", []),
+                "_fetched_at": now
+            }
+
+        # 已停止的服务器和长时间查询失败（已过期）的服务器不再保留缓存
+        for server_id, state in list(self._cache.items()):
+            instance = self.supervisor.instances.get(server_id)
+            if instance is None or not instance.running or now - state["_fetched_at"] > settings.a2s_cache_ttl:
+                del self._cache[server_id]
+                changed.add(server_id)
+
+        for server_id in changed:
+            self._notify(server_id)
+
+    async def _poll_loop(self):
+        while True:
+            try:
+                await self.poll_once()
+            except Exception as e:
+                print(f"A2S轮询失败: {str(e)}")
+            await asyncio.sleep(settings.a2s_poll_interval)
+
+
+# 全局A2S轮询器
+a2s_poller = A2SPoller(server_supervisor)
@@ -0,0 +1,118 @@
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Dict, Any, Tuple
+from app.services.file_linker import place_file
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class BlobStore:
+    """按内容寻址的文件存储（sha256 -> 文件）
+
+    相同内容的vpk/资源文件只保存一份，游戏目录中的文件都是指向
+    blobs/<前两位>/<sha256> 的硬链接。blob本身是源文件的reflink或副本而不是硬链接：
+    SteamCMD更新物品时可能原地改写content目录中的文件，共享inode会让blob的内容与摘要不符。
+    """
+
+    def __init__(self, root: Path, gc_grace_period: float = 0):
+        self.root = root
+        # 新建或刚被链接的blob在宽限期内不会被清理（覆盖其他进程中正在进行的安装）
+        self.gc_grace_period = gc_grace_period
+        # 安装（共享）与清理（独占）互斥：安装先写入blob、最后才写清单
+        self._condition = threading.Condition()
+        self._installs = 0
+        self._collecting = False
+
+    @contextmanager
+    def installing(self):
+        """安装期间持有，期间的blob在写入清单前不会被gc删除；可多个安装同时持有"""
+        with self._condition:
+            while self._collecting:
+                self._condition.wait()
+            self._installs += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._installs -= 1
+                self._condition.notify_all()
+
+    @contextmanager
+    def collecting(self):
+        """清理期间独占持有：等待进行中的安装结束，并阻止新的安装开始"""
+        with self._condition:
+            while self._collecting or self._installs:
+                self._condition.wait()
+            self._collecting = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._collecting = False
+                self._condition.notify_all()
+
+    def blob_path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def has(self, digest: str) -> bool:
+        return self.blob_path(digest).exists()
+
+    def add(self, src: Path) -> Tuple[str, bool]:
+        """把文件存入仓库，返回 (digest, 是否新增)"""
+        digest = self.hash_file(src)
+        blob = self.blob_path(digest)
+        if blob.exists():
+            return digest, False
+
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        place_file(src, blob, allow_hardlink=False)
+        return digest, True
+
+    def gc(self, referenced: Iterable[str]) -> Dict[str, Any]:
+        """删除不再被引用的blob（在collecting()中调用，referenced需在持有期间读取）"""
+        keep = set(referenced)
+        # 链接数变化也会更新ctime，刚被安装引用的旧blob同样受宽限期保护
+        recent = time.time() - self.gc_grace_period
+        removed = 0
+        freed = 0
+        if not self.root.exists():
+            return {"removed": 0, "freed_bytes": 0}
+
+        for bucket in self.root.iterdir():
+            if not bucket.is_dir():
+                continue
+            for blob in bucket.iterdir():
+                if blob.name in keep or blob.name.startswith("."):
+                    continue
+                try:
+                    st = blob.stat()
+                    if st.st_ctime > recent:
+                        continue
+                    blob.unlink()
+                except FileNotFoundError:
+                    continue
+                removed += 1
+                # 仍有其他硬链接时并不会真正释放空间
+                if st.st_nlink <= 1:
+                    freed += st.st_size
+            try:
+                bucket.rmdir()
+            except OSError:
+                pass
+
+        return {"removed": removed, "freed_bytes": freed}
+
+    @staticmethod
+    def hash_file(path: Path) -> str:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha.update(chunk)
+        return sha.hexdigest()
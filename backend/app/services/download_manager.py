@@ -1,21 +1,42 @@
 import asyncio
+import bisect
+import json
 import time
 import threading
-from typing import Dict, Any, Optional
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
 from pathlib import Path
-import subprocess
 import psutil
-import os
+from app.core.config import settings
+from app.models.mod import DownloadTask as DownloadTaskRecord
+from app.services.size_tracker import DirectorySizeTracker
+from app.services.task_events import TaskEventBus
+from app.services.task_store import TaskStore
+from app.services.steamcmd_output import iter_output_lines, parse_progress_line
 
 
 class DownloadTask:
-    """下载任务类"""
+    """下载任务类（使用__slots__以减小大量历史任务的内存占用）"""
 
-    def __init__(self, task_id: str, task_type: str, description: str):
+    __slots__ = (
+        "task_id", "task_type", "description", "workshop_item_id", "db_id", "pid",
+        "priority", "user_id", "payload", "status", "progress", "message", "start_time", "end_time", "process",
+        "total_size", "downloaded_size", "speed", "_last_sample", "_listener", "_indexed_status"
+    )
+
+    def __init__(self, task_id: str, task_type: str, description: str, workshop_item_id: Optional[int] = None,
+                 priority: int = 0, user_id: Optional[int] = None, payload: Optional[Dict[str, Any]] = None):
         self.task_id = task_id
         self.task_type = task_type
         self.description = description
-        self.status = "pending"  # pending, running, completed, failed
+        self.workshop_item_id = workshop_item_id
+        self.db_id: Optional[int] = None
+        self.pid: Optional[int] = None
+        self.priority = priority
+        self.user_id = user_id
+        self.payload = payload or {}
+        self.status = "pending"  # pending, running, paused, completed, failed
         self.progress = 0
         self.message = ""
         self.start_time = None
@@ -23,26 +44,88 @@ class DownloadTask:
         self.process = None
         self.total_size = 0
         self.downloaded_size = 0
+        self.speed = 0.0  # 字节/秒
+        self._last_sample = None
+        # 状态变化回调（由DownloadManager设置）
+        self._listener = None
+        # 当前所在的状态索引
+        self._indexed_status: Optional[str] = None
+
+    @classmethod
+    def from_record(cls, record) -> "DownloadTask":
+        """从数据库记录恢复任务"""
+        task = cls(record.task_key or f"task_{record.id}", record.task_type or "workshop",
+                   record.description or "", record.workshop_item_id,
+                   record.priority or 0, record.user_id, json.loads(record.payload) if record.payload else None)
+        task.db_id = record.id
+        task.status = record.status
+        if task.status == "downloading":
+            # 旧版本创意工坊任务使用的状态名
+            task.status = "running"
+        task.progress = record.progress or 0
+        task.message = record.message or record.error_message or ""
+        task.total_size = record.total_size or 0
+        task.downloaded_size = record.downloaded_size or 0
+        task.pid = record.pid
+        task.start_time = record.start_time
+        task.end_time = record.end_time
+        return task
+
+    def _changed(self):
+        if self._listener is not None:
+            self._listener(self)
 
     def start(self):
         self.status = "running"
         self.start_time = time.time()
+        self._changed()
+
+    def pause(self, message: str = "已暂停"):
+        self.status = "paused"
+        self.message = message
+        self.speed = 0.0
+        self._changed()
+
+    def requeue(self, message: str = "等待下载"):
+        """放回队列等待重新执行"""
+        self.status = "pending"
+        self.message = message
+        self.process = None
+        self.speed = 0.0
+        self._last_sample = None
+        self._changed()
 
     def complete(self, message: str = "完成"):
         self.status = "completed"
         self.progress = 100
         self.message = message
         self.end_time = time.time()
+        self._changed()
 
     def fail(self, message: str):
         self.status = "failed"
         self.message = message
         self.end_time = time.time()
+        self._changed()
 
     def update_progress(self, progress: int, message: str = ""):
         self.progress = max(0, min(100, progress))
         if message:
             self.message = message
+        self._changed()
+
+    def update_size(self, downloaded_size: int):
+        """更新已下载大小并计算平滑后的下载速度"""
+        now = time.time()
+        if self._last_sample is not None:
+            last_time, last_size = self._last_sample
+            elapsed = now - last_time
+            if elapsed > 0:
+                instant = max(0.0, (downloaded_size - last_size) / elapsed)
+                self.speed = instant if self.speed == 0 else 0.7 * self.speed + 0.3 * instant
+        self._last_sample = (now, downloaded_size)
+        self.downloaded_size = downloaded_size
+        self._changed()
 
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -56,106 +139,376 @@ class DownloadTask:
             "end_time": self.end_time,
             "duration": (self.end_time - self.start_time) if self.start_time and self.end_time else None,
             "total_size": self.total_size,
-            "downloaded_size": self.downloaded_size
+            "downloaded_size": self.downloaded_size,
+            "speed": int(self.speed) if self.status == "running" else 0,
+            "workshop_item_id": self.workshop_item_id,
+            "priority": self.priority,
+            "user_id": self.user_id
         }
 
 
+class _TaskIndex:
+    """按数据库ID有序的任务索引，支持按游标倒序分页"""
+
+    def __init__(self):
+        self._ids: List[int] = []
+        self._tasks: Dict[int, DownloadTask] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def tasks(self):
+        return self._tasks.values()
+
+    def ordered(self) -> List[DownloadTask]:
+        return [self._tasks[db_id] for db_id in self._ids]
+
+    def add(self, task: DownloadTask):
+        if task.db_id not in self._tasks:
+            bisect.insort(self._ids, task.db_id)
+        self._tasks[task.db_id] = task
+
+    def remove(self, task: DownloadTask):
+        if self._tasks.pop(task.db_id, None) is not None:
+            position = bisect.bisect_left(self._ids, task.db_id)
+            del self._ids[position]
+
+    def page(self, cursor: Optional[int], limit: int):
+        """返回ID小于cursor的最新limit个任务及下一页游标"""
+        end = bisect.bisect_left(self._ids, cursor) if cursor is not None else len(self._ids)
+        start = max(0, end - limit)
+        tasks = [self._tasks[db_id] for db_id in reversed(self._ids[start:end])]
+        return tasks, (self._ids[start] if start > 0 else None)
+
+
+FINISHED_STATUSES = ("completed", "failed")
+
+
 class DownloadManager:
-    """下载管理器"""
+    """下载管理器
+
+    内存中的任务表是 download_tasks 表的缓存：创建时立即落库，
+    进度变化由TaskStore定时批量写回，重启后从数据库恢复。
+    """
 
     def __init__(self):
         self.tasks: Dict[str, DownloadTask] = {}
         self._lock = threading.Lock()
+        self._monitors = set()
+        # 全部任务与按状态划分的索引（分页查询不需要全表扫描）
+        self._all = _TaskIndex()
+        self._by_status: Dict[str, _TaskIndex] = {}
+        # 按任务类型、按（类型, 状态）划分的索引，用于只列出某类任务
+        self._by_type: Dict[str, _TaskIndex] = {}
+        self._by_type_status: Dict[Tuple[str, str], _TaskIndex] = {}
+        # 已结束的任务，按最近访问排序（LRU），超出上限或闲置超时后从内存淘汰
+        self._finished: "OrderedDict[str, float]" = OrderedDict()
+        # 任务状态推送（WebSocket/SSE订阅）
+        self.events = TaskEventBus(settings.download_event_interval)
+        self.store = TaskStore(settings.task_flush_interval)
+
+    def _on_task_changed(self, task: DownloadTask):
+        self.events.publish(task)
+        self.store.mark_dirty(task)
+        if task._indexed_status != task.status:
+            with self._lock:
+                self._reindex(task)
+                self._evict()
+
+    def _reindex(self, task: DownloadTask):
+        if task._indexed_status is not None:
+            self._by_status[task._indexed_status].remove(task)
+            self._by_type_status[(task.task_type, task._indexed_status)].remove(task)
+        self._by_status.setdefault(task.status, _TaskIndex()).add(task)
+        self._by_type_status.setdefault((task.task_type, task.status), _TaskIndex()).add(task)
+        task._indexed_status = task.status
+        if task.status in FINISHED_STATUSES:
+            self._finished[task.task_id] = time.monotonic()
+
+    def _evict(self):
+        """淘汰超出保留数量或闲置超时的已结束任务（数据库中仍保留）"""
+        expire_before = time.monotonic() - settings.task_retention_ttl
+        while self._finished:
+            task_id, last_access = next(iter(self._finished.items()))
+            if len(self._finished) <= settings.task_retention_max and last_access > expire_before:
+                break
+            del self._finished[task_id]
+            task = self.tasks.pop(task_id, None)
+            if task is not None:
+                self._all.remove(task)
+                self._by_status[task._indexed_status].remove(task)
+                self._by_type[task.task_type].remove(task)
+                self._by_type_status[(task.task_type, task._indexed_status)].remove(task)
+                task._listener = None
+                self.events.forget(task_id)
 
-    def create_task(self, task_id: str, task_type: str, description: str) -> DownloadTask:
-        """创建下载任务"""
+    def _register(self, task: DownloadTask):
+        task._listener = self._on_task_changed
         with self._lock:
-            task = DownloadTask(task_id, task_type, description)
-            self.tasks[task_id] = task
-            return task
+            self.tasks[task.task_id] = task
+            self._all.add(task)
+            self._by_type.setdefault(task.task_type, _TaskIndex()).add(task)
+            self._reindex(task)
+            self._evict()
+
+    @staticmethod
+    def new_task_id(task_type: str) -> str:
+        return f"{task_type}_{uuid.uuid4().hex[:8]}"
+
+    async def create_task(self, task_id: str, task_type: str, description: str,
+                          workshop_item_id: Optional[int] = None, priority: int = 0,
+                          user_id: Optional[int] = None, payload: Optional[Dict[str, Any]] = None) -> DownloadTask:
+        """创建下载任务（记录在线程池中插入，不阻塞事件循环）"""
+        task = DownloadTask(
+            task_id, task_type, description, workshop_item_id=workshop_item_id,
+            priority=priority, user_id=user_id, payload=payload
+        )
+        await self.store.insert_many_async([task])
+        self._add_created([task])
+        return task
+
+    def create_tasks(self, specs: List[Dict[str, Any]], db=None) -> List[DownloadTask]:
+        """批量创建任务，所有记录在一个事务中插入（传入db时与该会话中的其他变更一起提交）
+
+        同步执行，在事件循环中需通过 AsyncSession.run_sync 调用。
+        """
+        tasks = [DownloadTask(**spec) for spec in specs]
+        self.store.insert_many(tasks, db)
+        self._add_created(tasks)
+        return tasks
+
+    def _add_created(self, tasks: List[DownloadTask]):
+        for task in tasks:
+            self._register(task)
+            self.events.publish(task)
+
+    def active_workshop_tasks(self) -> Dict[int, DownloadTask]:
+        """正在排队、下载中或已暂停的创意工坊任务，按物品ID索引（未结束的任务不会被淘汰，内存中即为全集）"""
+        with self._lock:
+            return {
+                task.workshop_item_id: task
+                for status in ("pending", "running", "paused") if status in self._by_status
+                for task in self._by_status[status].tasks()
+                if task.workshop_item_id is not None
+            }
+
+    def tasks_with_status(self, status: str) -> List[DownloadTask]:
+        """按创建顺序返回指定状态的所有任务"""
+        with self._lock:
+            index = self._by_status.get(status)
+            return index.ordered() if index else []
+
+    async def start(self):
+        """从数据库恢复任务并启动定时写入"""
+        self.recover(await self.store.load_recent_async(settings.task_retention_max))
+        self.store.start()
+
+    async def close(self):
+        await self.store.close()
+
+    def recover(self, records: List[DownloadTaskRecord]):
+        """恢复历史任务
+
+        排队中和已暂停的任务保持原状态，由下载队列继续调度；重启前正在执行的任务
+        若进程仍在则重新接管，否则放回队列重新执行。
+        """
+        for record in records:
+            if record.task_key in self.tasks:
+                continue
+            task = DownloadTask.from_record(record)
+            self._register(task)
+            if task.status != "running":
+                continue
+
+            process = self._find_orphan_process(task)
+            if process is not None:
+                task.message = "服务重启后已重新接管下载进程"
+                self._track(self._watch_orphan(task, process))
+            else:
+                task.requeue("服务重启，重新排队")
+
+    @staticmethod
+    def _find_orphan_process(task: DownloadTask) -> Optional[psutil.Process]:
+        if not task.pid or not task.start_time:
+            return None
+        try:
+            process = psutil.Process(task.pid)
+            # 排除PID被其他进程复用的情况
+            if process.create_time() > task.start_time + 5 or "steamcmd" not in " ".join(process.cmdline()):
+                return None
+            return process
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return None
+
+    async def _watch_orphan(self, task: DownloadTask, process: psutil.Process):
+        """重新接管的进程无法读取输出和退出码，只能等待其结束"""
+        loop = asyncio.get_running_loop()
+        while await loop.run_in_executor(None, process.is_running):
+            await asyncio.sleep(settings.download_progress_interval)
+        if task.status == "running":
+            task.fail("服务重启期间启动的下载进程已结束，无法确认结果，请检查后重试")
+
+    def start_task(self, task_id: str):
+        """标记任务开始执行"""
+        with self._lock:
+            task = self.tasks.get(task_id)
+        if task:
+            task.start()
 
     def get_task(self, task_id: str) -> Optional[DownloadTask]:
-        """获取下载任务"""
+        """获取内存中的下载任务（不访问数据库；未结束的任务不会被淘汰，总能找到）"""
         with self._lock:
-            return self.tasks.get(task_id)
+            task = self.tasks.get(task_id)
+            if task is not None:
+                if task_id in self._finished:
+                    self._finished[task_id] = time.monotonic()
+                    self._finished.move_to_end(task_id)
+                return task
 
-    def get_all_tasks(self) -> Dict[str, Dict[str, Any]]:
-        """获取所有任务"""
+        # 淘汰后尚未写回的任务以内存中的状态为准
+        return self.store.find_unflushed(task_id)
+
+    async def fetch_task(self, task_id: str) -> Optional[DownloadTask]:
+        """获取下载任务，已从内存淘汰的历史任务在线程池中从数据库读取"""
+        task = self.get_task(task_id)
+        if task is not None:
+            return task
+        record = await self.store.load_async(task_id)
+        return DownloadTask.from_record(record) if record else None
+
+    def get_tasks(self, status: Optional[str] = None, cursor: Optional[int] = None,
+                  limit: int = 50, task_type: Optional[str] = None) -> Dict[str, Any]:
+        """按状态（和任务类型）分页获取任务（按创建顺序倒序），cursor为上一页返回的next_cursor"""
         with self._lock:
-            return {task_id: task.to_dict() for task_id, task in self.tasks.items()}
+            self._evict()
+            if task_type is None:
+                index = self._all if status is None else self._by_status.get(status)
+            elif status is None:
+                index = self._by_type.get(task_type)
+            else:
+                index = self._by_type_status.get((task_type, status))
+            if index is None:
+                return {"tasks": [], "next_cursor": None, "total": 0}
+            tasks, next_cursor = index.page(cursor, limit)
+            total = len(index)
+        return {
+            "tasks": [task.to_dict() for task in tasks],
+            "next_cursor": next_cursor,
+            "total": total
+        }
 
     def update_task_progress(self, task_id: str, progress: int, message: str = ""):
         """更新任务进度"""
         with self._lock:
             task = self.tasks.get(task_id)
-            if task:
-                task.update_progress(progress, message)
+        if task:
+            task.update_progress(progress, message)
 
     def complete_task(self, task_id: str, message: str = "完成"):
         """完成任务"""
         with self._lock:
             task = self.tasks.get(task_id)
-            if task:
-                task.complete(message)
+        if task:
+            task.complete(message)
 
     def fail_task(self, task_id: str, message: str):
         """任务失败"""
         with self._lock:
             task = self.tasks.get(task_id)
-            if task:
-                task.fail(message)
+        if task:
+            task.fail(message)
+
+    def start_monitor(self, task_id: str, process: asyncio.subprocess.Process, server_path: Path):
+        """在后台监控下载进程（保留引用，避免监控协程被回收）"""
+        self._track(self.monitor_download_progress(task_id, process, server_path))
+
+    def _track(self, coro):
+        monitor = asyncio.create_task(coro)
+        self._monitors.add(monitor)
+        monitor.add_done_callback(self._monitors.discard)
+
+    async def monitor_download_progress(self, task_id: str, process: asyncio.subprocess.Process, server_path: Path):
+        """监控下载进度
 
-    async def monitor_download_progress(self, task_id: str, process: subprocess.Popen, server_path: Path):
-        """监控下载进度"""
+        优先解析SteamCMD输出中的进度行；在没有进度行时才按磁盘占用估算。
+        """
         task = self.get_task(task_id)
         if not task:
             return
 
+        task.process = process
+        task.pid = process.pid
         task.start()
 
+        loop = asyncio.get_running_loop()
+        tracker = DirectorySizeTracker(server_path, settings.size_reconcile_interval)
+        output_state = {"progress_seen": False, "last_line": ""}
+
+        async def consume_output():
+            # 持续读取输出，避免管道写满阻塞SteamCMD
+            async for line in iter_output_lines(process.stdout):
+                parsed = parse_progress_line(line)
+                if parsed is None:
+                    output_state["last_line"] = line
+                    continue
+
+                output_state["progress_seen"] = True
+                task.total_size = parsed.total
+                task.update_size(parsed.downloaded)
+                task.update_progress(
+                    min(99, int(parsed.progress)),
+                    f"{parsed.state}: {parsed.downloaded / (1024*1024*1024):.1f} / "
+                    f"{parsed.total / (1024*1024*1024):.1f} GB"
+                )
+
+        reader = asyncio.create_task(consume_output())
+
         try:
-            # 监控目录大小变化
-            initial_size = self._get_directory_size(server_path)
+            # 基线扫描放到线程池，避免阻塞事件循环
+            initial_size = await loop.run_in_executor(None, tracker.start)
 
-            while process.poll() is None:
-                await asyncio.sleep(2)  # 每2秒更新一次
+            while process.returncode is None:
+                await asyncio.sleep(settings.download_progress_interval)
 
-                current_size = self._get_directory_size(server_path)
-                size_diff = current_size - initial_size
+                if output_state["progress_seen"] or process.returncode is not None:
+                    continue
 
-                # 估算进度（L4D2服务器大约需要8-10GB）
+                current_size = await loop.run_in_executor(None, tracker.refresh)
+                size_diff = max(0, current_size - initial_size)
+                task.update_size(size_diff)
+
+                # 没有进度输出时按磁盘占用估算（L4D2服务器大约需要8-10GB）
                 estimated_total = 10 * 1024 * 1024 * 1024  # 10GB
                 progress = min(95, int((size_diff / estimated_total) * 100))
 
                 task.update_progress(progress, f"已下载: {size_diff / (1024*1024*1024):.1f} GB")
 
-            # 等待进程完成
-            return_code = process.wait()
+            # 等待进程完成并读完剩余输出
+            return_code = await process.wait()
+            await reader
+
+            if task.status != "running":
+                # 任务已被取消
+                return
 
             if return_code == 0:
-                final_size = self._get_directory_size(server_path)
-                downloaded = final_size - initial_size
+                if output_state["progress_seen"]:
+                    downloaded = task.downloaded_size
+                else:
+                    final_size = await loop.run_in_executor(None, tracker.scan)
+                    downloaded = final_size - initial_size
+                    task.update_size(downloaded)
                 task.complete(f"下载完成，共下载 {downloaded / (1024*1024*1024):.1f} GB")
             else:
-                task.fail("下载失败")
+                detail = output_state["last_line"]
+                task.fail(f"下载失败: {detail}" if detail else "下载失败")
 
         except Exception as e:
             task.fail(f"监控出错: {str(e)}")
-
-    def _get_directory_size(self, path: Path) -> int:
-        """获取目录大小"""
-        total_size = 0
-        try:
-            for dirpath, dirnames, filenames in os.walk(path):
-                for filename in filenames:
-                    filepath = os.path.join(dirpath, filename)
-                    try:
-                        total_size += os.path.getsize(filepath)
-                    except OSError:
-                        pass
-        except Exception:
-            pass
-        return total_size
+        finally:
+            if not reader.done():
+                reader.cancel()
+            tracker.close()
 
 
 # 全局下载管理器实例
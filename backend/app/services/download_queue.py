@@ -0,0 +1,239 @@
+import asyncio
+from collections import Counter
+from typing import Dict, Any, Optional, Callable, Awaitable
+from app.core.config import settings
+from app.services.download_manager import DownloadManager, DownloadTask, download_manager, FINISHED_STATUSES
+
+# 任务执行函数：runner(task, payload, secrets)，负责把任务标记为完成或失败
+JobRunner = Callable[[DownloadTask, Dict[str, Any], Optional[Dict[str, Any]]], Awaitable[None]]
+
+
+class DownloadQueue:
+    """全局下载队列
+
+    所有创意工坊、服务器和插件下载都以 pending 状态的任务排队（持久化在
+    download_tasks 表中，重启后继续），同时执行的任务数不超过
+    max_download_concurrent。调度顺序：优先级高者优先；同优先级时
+    当前占用执行名额最少、最久未被调度的用户优先；最后按提交顺序。
+    """
+
+    def __init__(self, manager: DownloadManager, max_concurrent: int):
+        self.manager = manager
+        self.max_concurrent = max_concurrent
+        self._runners: Dict[str, JobRunner] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        # 密码等敏感参数只保存在内存中，重启后丢失时由runner使用默认凭据
+        self._secrets: Dict[str, Dict[str, Any]] = {}
+        self._last_served: Dict[Optional[int], int] = {}
+        self._dispatch_count = 0
+        self._started = False
+        # 已从内存淘汰的前置任务：后台从数据库读取，读取完成后再次调度
+        self._dependency_lookups: Dict[str, asyncio.Task] = {}
+        self._fetched_dependencies: Dict[str, Optional[DownloadTask]] = {}
+
+    def register_runner(self, task_type: str, runner: JobRunner):
+        self._runners[task_type] = runner
+
+    def start(self):
+        """开始调度（在任务恢复之后调用）"""
+        self._started = True
+        self.schedule()
+
+    async def close(self):
+        """停止正在执行的任务并放回队列，下次启动时重新执行"""
+        self._started = False
+        for task_id in list(self._running):
+            task = self.manager.get_task(task_id)
+            if task is not None:
+                task.requeue("服务关闭，等待重新执行")
+                await self._stop_job(task)
+
+    async def submit(self, task_type: str, description: str, payload: Optional[Dict[str, Any]] = None,
+                     priority: int = 0, user_id: Optional[int] = None, workshop_item_id: Optional[int] = None,
+                     secrets: Optional[Dict[str, Any]] = None, task_id: Optional[str] = None) -> DownloadTask:
+        """提交一个下载任务"""
+        task = await self.manager.create_task(
+            task_id or self.manager.new_task_id(task_type), task_type, description,
+            workshop_item_id=workshop_item_id, priority=priority, user_id=user_id, payload=payload
+        )
+        if secrets:
+            self._secrets[task.task_id] = secrets
+        self.schedule()
+        return task
+
+    @property
+    def running_count(self) -> int:
+        return len(self._running)
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "running": list(self._running),
+            "pending": len(self.manager.tasks_with_status("pending")),
+            "paused": len(self.manager.tasks_with_status("paused"))
+        }
+
+    def schedule(self):
+        """在有空闲名额时启动排队中的任务"""
+        if not self._started:
+            return
+        while len(self._running) < self.max_concurrent:
+            task = self._pick()
+            if task is None:
+                return
+            self._dispatch(task)
+
+    def _pick(self) -> Optional[DownloadTask]:
+        running_by_user = Counter(
+            task.user_id for task in map(self.manager.get_task, self._running) if task is not None
+        )
+        best = None
+        best_key = None
+        for task in self.manager.tasks_with_status("pending"):
+            # 已派发但执行函数尚未把状态改为running的任务仍是pending
+            if task.task_id in self._running:
+                continue
+            if task.task_type not in self._runners or not self._dependency_ready(task):
+                continue
+            key = (
+                -task.priority,
+                running_by_user[task.user_id],
+                self._last_served.get(task.user_id, 0),
+                task.db_id
+            )
+            if best_key is None or key < best_key:
+                best, best_key = task, key
+        return best
+
+    def _dependency_ready(self, task: DownloadTask) -> bool:
+        """depends_on（单个或多个任务ID）指定的前置任务都成功后才能执行，任一失败时本任务也失败"""
+        depends_on = task.payload.get("depends_on")
+        if not depends_on:
+            return True
+        if isinstance(depends_on, str):
+            depends_on = [depends_on]
+        ready = True
+        for dependency_id in depends_on:
+            dependency = self.manager.get_task(dependency_id)
+            if dependency is None:
+                if dependency_id not in self._fetched_dependencies:
+                    self._fetch_dependency(dependency_id)
+                    ready = False
+                    continue
+                dependency = self._fetched_dependencies[dependency_id]
+            if dependency is None or dependency.status == "completed":
+                continue
+            if dependency.status == "failed":
+                task.fail(f"前置任务失败: {dependency.description}")
+                return False
+            ready = False
+        return ready
+
+    def _fetch_dependency(self, dependency_id: str):
+        if dependency_id not in self._dependency_lookups:
+            self._dependency_lookups[dependency_id] = asyncio.create_task(self._load_dependency(dependency_id))
+
+    async def _load_dependency(self, dependency_id: str):
+        try:
+            dependency = await self.manager.fetch_task(dependency_id)
+            # 已结束任务的状态不再变化，缓存只需控制大小
+            if len(self._fetched_dependencies) >= settings.task_retention_max:
+                self._fetched_dependencies.clear()
+            self._fetched_dependencies[dependency_id] = dependency
+        except Exception as e:
+            print(f"读取前置任务失败: {str(e)}")
+            await asyncio.sleep(settings.download_progress_interval)
+        finally:
+            self._dependency_lookups.pop(dependency_id, None)
+        self.schedule()
+
+    def _dispatch(self, task: DownloadTask):
+        self._dispatch_count += 1
+        self._last_served[task.user_id] = self._dispatch_count
+        self._running[task.task_id] = asyncio.create_task(self._run(task))
+
+    async def _run(self, task: DownloadTask):
+        runner = self._runners[task.task_type]
+        try:
+            await runner(task, task.payload, self._secrets.get(task.task_id))
+            # 只有仍在运行的任务才自动完成；关闭时重新排队（pending）的任务保持原状态
+            if task.status == "running":
+                task.complete()
+        except asyncio.CancelledError:
+            # 暂停/取消/关闭时由调用方设置状态
+            pass
+        except Exception as e:
+            task.fail(f"执行出错: {str(e)}")
+        finally:
+            self._running.pop(task.task_id, None)
+            if task.status in FINISHED_STATUSES:
+                self._secrets.pop(task.task_id, None)
+            self.schedule()
+
+    async def _stop_job(self, task: DownloadTask):
+        """终止正在执行的任务（先结束下载进程，再取消执行协程）"""
+        process = task.process
+        if process is not None and process.returncode is None:
+            process.terminate()
+            try:
+                await asyncio.wait_for(process.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                process.kill()
+
+        job = self._running.get(task.task_id)
+        if job is not None:
+            job.cancel()
+            await asyncio.gather(job, return_exceptions=True)
+
+    async def pause(self, task_id: str) -> Dict[str, Any]:
+        """暂停任务：排队中的不再调度，执行中的终止后保留进度信息"""
+        task = await self.manager.fetch_task(task_id)
+        if task is None:
+            return {"success": False, "message": "下载任务不存在"}
+        if task.status not in ("pending", "running"):
+            return {"success": False, "message": "只能暂停排队中或下载中的任务"}
+
+        running = task.task_id in self._running
+        task.pause()
+        if running:
+            await self._stop_job(task)
+        return {"success": True, "message": "任务已暂停"}
+
+    def resume(self, task_id: str) -> Dict[str, Any]:
+        """恢复已暂停的任务（重新排队，SteamCMD会从已下载的部分继续）"""
+        task = self.manager.get_task(task_id)
+        if task is None:
+            return {"success": False, "message": "下载任务不存在"}
+        if task.status != "paused":
+            return {"success": False, "message": "任务未暂停"}
+
+        task.requeue()
+        self.schedule()
+        return {"success": True, "message": "任务已恢复"}
+
+    async def cancel(self, task_id: str) -> Dict[str, Any]:
+        """取消任务"""
+        task = await self.manager.fetch_task(task_id)
+        if task is None:
+            return {"success": False, "message": "下载任务不存在"}
+        if task.status in FINISHED_STATUSES:
+            return {"success": False, "message": "任务已结束"}
+
+        task.fail("任务已被取消")
+        self._secrets.pop(task.task_id, None)
+        await self._stop_job(task)
+        return {"success": True, "message": "下载任务已取消"}
+
+    def set_priority(self, task_id: str, priority: int) -> Dict[str, Any]:
+        """调整任务优先级（对排队中的任务生效）"""
+        task = self.manager.get_task(task_id)
+        if task is None:
+            return {"success": False, "message": "下载任务不存在"}
+
+        task.priority = priority
+        task._changed()
+        return {"success": True, "message": "优先级已更新"}
+
+
+# 全局下载队列
+download_queue = DownloadQueue(download_manager, settings.max_download_concurrent)
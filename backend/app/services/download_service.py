@@ -1,10 +1,15 @@
 import asyncio
-import subprocess
-import os
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Awaitable, Callable, Tuple
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor
 from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.mod import WorkshopItem
+from app.services.download_queue import download_queue
+from app.services.steamcmd_pool import SteamCMDSessionPool
+from app.services.retry_policy import RetryPolicy, size_aware_timeout
+from app.services.workshop_installer import WorkshopInstaller
+from app.services.blob_store import BlobStore
 
 
 class DownloadService:
@@ -13,10 +18,75 @@ class DownloadService:
     def __init__(self):
         self.steamcmd_path = Path(settings.steamcmd_path)
         self.workshop_content_path = Path(settings.l4d2_server_path) / "steam" / "steamapps" / "workshop" / "content" / "550"
+        # SteamCMD的下载缓存，未完成的下载保留在这里，重试时从断点继续
+        self.download_cache_path = self.steamcmd_path / "steamapps" / "workshop" / "downloads" / "550"
+        self.retry_policy = RetryPolicy(
+            max_attempts=settings.workshop_retry_attempts,
+            base_delay=settings.workshop_retry_base_delay,
+            max_delay=settings.workshop_retry_max_delay
+        )
         self.executor = ThreadPoolExecutor(max_workers=settings.download_workers)
+        self._session_pool: Optional[SteamCMDSessionPool] = None
+        server_path = Path(settings.l4d2_server_path)
+        self.installer = WorkshopInstaller(
+            game_dir=server_path / "left4dead2",
+            manifest_dir=server_path / ".workshop" / "manifests",
+            blob_store=BlobStore(server_path / ".workshop" / "blobs", settings.workshop_blob_gc_grace)
+        )
 
-    async def download_workshop_items(self, workshop_ids: List[str]) -> Dict[str, Any]:
-        """下载创意工坊物品"""
+    async def run_download_job(self, task, payload: Dict[str, Any], secrets: Optional[Dict[str, Any]]):
+        """队列执行函数：下载并安装单个创意工坊物品，并把结果写回物品记录"""
+        workshop_id = payload.get("workshop_id")
+        if not workshop_id:
+            task.fail("任务缺少创意工坊物品ID")
+            return
+
+        loop = asyncio.get_running_loop()
+
+        async def on_retry(workshop_id: str, attempt: int, delay: float, result: Dict[str, Any]):
+            # 遍历下载缓存目录是阻塞的文件系统操作，放到线程池中执行
+            partial = await loop.run_in_executor(None, self.partial_download_size, workshop_id)
+            resume = f"，已缓存 {partial} 字节将断点续传" if partial else ""
+            task.update_progress(
+                task.progress,
+                f"第{attempt}次下载失败（{result.get('error')}），{delay:.0f}秒后重试{resume}"
+            )
+
+        size, time_updated = await loop.run_in_executor(None, self._item_version, workshop_id, payload)
+        task.start()
+        result = await self.download_workshop_items(
+            [workshop_id],
+            sizes={workshop_id: size},
+            versions={workshop_id: time_updated},
+            on_retry=on_retry
+        )
+        if task.status != "running":
+            # 已被暂停或取消
+            return
+        if not result.get("successful"):
+            failed = result.get("failed") or [{}]
+            task.fail(failed[0].get("error") or result.get("message") or "下载失败")
+            return
+
+        install = result["successful"][0].get("install") or {}
+        await loop.run_in_executor(None, self._mark_installed, workshop_id, install)
+        task.complete("下载并安装完成")
+
+    async def download_workshop_items(
+        self,
+        workshop_ids: List[str],
+        sizes: Optional[Dict[str, Optional[int]]] = None,
+        versions: Optional[Dict[str, Optional[int]]] = None,
+        on_retry: Optional[Callable[[str, int, float, Dict[str, Any]], Awaitable[None]]] = None
+    ) -> Dict[str, Any]:
+        """下载创意工坊物品
+
+        sizes为已知的物品大小（字节），用于放宽大文件的下载超时；
+        versions为下载版本在Steam上的time_updated，记录在安装清单中供增量同步比较；
+        临时性失败按重试策略退避后重试，每次重试前 await on_retry(workshop_id, 次数, 等待秒数, 结果)。
+        """
+        sizes = sizes or {}
+        versions = versions or {}
         if not self.steamcmd_path.exists():
             return {
                 "success": False,
@@ -31,18 +101,43 @@ class DownloadService:
                 "message": "未找到Steam账户配置，请先配置Steam账户"
             }
 
-        tasks = []
-        for workshop_id in workshop_ids:
-            task = asyncio.get_event_loop().run_in_executor(
-                self.executor,
-                self._download_single_item,
-                workshop_id,
-                steam_config
+        pool = await self._get_session_pool(steam_config)
+        loop = asyncio.get_running_loop()
+
+        async def download_and_install(workshop_id: str) -> Dict[str, Any]:
+            timeout = size_aware_timeout(
+                sizes.get(workshop_id),
+                settings.workshop_download_timeout,
+                settings.workshop_min_download_speed
+            )
+            result = await self.retry_policy.run(
+                lambda attempt, attempt_timeout: pool.download_item(workshop_id, attempt_timeout),
+                timeout,
+                on_retry=(lambda *args: on_retry(workshop_id, *args)) if on_retry else None
             )
-            tasks.append(task)
+            if result["success"]:
+                # 链接文件到服务器目录
+                try:
+                    result["install"] = await loop.run_in_executor(
+                        self.executor,
+                        self._install_to_server_directory,
+                        workshop_id,
+                        result.get("path"),
+                        versions.get(workshop_id)
+                    )
+                except OSError as e:
+                    return {
+                        "success": False,
+                        "workshop_id": workshop_id,
+                        "error": f"安装文件失败: {e}"
+                    }
+            return result
 
-        # 并发执行下载任务
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        # 所有物品在会话池的常驻SteamCMD进程之间分批下载
+        results = await asyncio.gather(
+            *(download_and_install(workshop_id) for workshop_id in workshop_ids),
+            return_exceptions=True
+        )
 
         # 处理结果
         successful = []
@@ -66,51 +161,74 @@ class DownloadService:
             "failed": failed
         }
 
-    def _download_single_item(self, workshop_id: str, steam_config: Dict[str, str]) -> Dict[str, Any]:
-        """下载单个创意工坊物品"""
+    def partial_download_size(self, workshop_id: str) -> int:
+        """SteamCMD下载缓存中该物品已下载的字节数"""
+        total = 0
+        for path in (self.download_cache_path / workshop_id).rglob("*"):
+            try:
+                if path.is_file():
+                    total += path.stat().st_size
+            except OSError:
+                continue
+        return total
+
+    def _item_version(self, workshop_id: str, payload: Dict[str, Any]) -> Tuple[Optional[int], Optional[int]]:
+        """物品大小和Steam上的time_updated：优先使用任务中记录的值，否则使用物品记录中的元数据（同步，在线程池中执行）"""
+        size = payload.get("file_size")
+        time_updated = payload.get("time_updated")
+        if size is None or time_updated is None:
+            db = SessionLocal()
+            try:
+                item = db.query(WorkshopItem.file_size, WorkshopItem.time_updated).filter(
+                    WorkshopItem.workshop_id == workshop_id
+                ).first()
+            finally:
+                db.close()
+            if item:
+                size = size if size is not None else item.file_size
+                time_updated = time_updated if time_updated is not None else item.time_updated
+        return size, time_updated
+
+    def _mark_installed(self, workshop_id: str, install: Dict[str, Any]):
+        """把安装结果写回物品记录（同步，在线程池中执行）"""
+        db = SessionLocal()
         try:
-            cmd = [
-                str(self.steamcmd_path / "steamcmd.sh"),
-                "+login", steam_config["username"], steam_config.get("password", ""),
-                "+workshop_download_item", "550", workshop_id,
-                "+quit"
-            ]
-
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=300  # 5分钟超时
-            )
+            item = db.query(WorkshopItem).filter(WorkshopItem.workshop_id == workshop_id).first()
+            if item:
+                item.is_installed = True
+                item.install_path = str(self.installer.game_dir)
+                if "bytes" in install:
+                    item.installed_size = install["bytes"]
+                db.commit()
+        finally:
+            db.close()
 
-            if result.returncode == 0:
-                # 复制文件到服务器目录
-                self._copy_to_server_directory(workshop_id)
+    async def _get_session_pool(self, steam_config: Dict[str, str]) -> SteamCMDSessionPool:
+        """获取（必要时重建）SteamCMD会话池"""
+        credentials = {
+            "username": steam_config.get("username", ""),
+            "password": steam_config.get("password", "")
+        }
+        if self._session_pool is not None and self._session_pool.credentials != credentials:
+            # 账户配置变更，旧会话作废
+            await self._session_pool.close()
+            self._session_pool = None
 
-                return {
-                    "success": True,
-                    "workshop_id": workshop_id,
-                    "message": "下载成功"
-                }
-            else:
-                return {
-                    "success": False,
-                    "workshop_id": workshop_id,
-                    "error": result.stderr.strip()
-                }
+        if self._session_pool is None:
+            self._session_pool = SteamCMDSessionPool(
+                self.steamcmd_path,
+                credentials,
+                size=settings.download_workers,
+                login_timeout=settings.steamcmd_login_timeout,
+                download_timeout=settings.workshop_download_timeout
+            )
+        return self._session_pool
 
-        except subprocess.TimeoutExpired:
-            return {
-                "success": False,
-                "workshop_id": workshop_id,
-                "error": "下载超时"
-            }
-        except Exception as e:
-            return {
-                "success": False,
-                "workshop_id": workshop_id,
-                "error": str(e)
-            }
+    async def close(self):
+        """关闭常驻的SteamCMD会话"""
+        if self._session_pool is not None:
+            await self._session_pool.close()
+            self._session_pool = None
 
     def _load_steam_config(self) -> Optional[Dict[str, str]]:
         """加载Steam配置"""
@@ -130,25 +248,29 @@ class DownloadService:
 
         return config
 
-    def _copy_to_server_directory(self, workshop_id: str):
-        """将下载的文件复制到服务器目录"""
-        workshop_dir = self.workshop_content_path / workshop_id
-        server_dir = Path(settings.l4d2_server_path) / "left4dead2"
+    def _install_to_server_directory(self, workshop_id: str, source_dir: Optional[str] = None,
+                                     time_updated: Optional[int] = None) -> Dict[str, Any]:
+        """将下载的文件链接到服务器目录"""
+        workshop_dir = Path(source_dir) if source_dir else self.workshop_content_path / workshop_id
+        return self.installer.install(workshop_id, workshop_dir, time_updated)
 
-        if workshop_dir.exists() and server_dir.exists():
-            import shutil
-            try:
-                # 复制所有文件
-                for item in workshop_dir.iterdir():
-                    if item.is_file():
-                        shutil.copy2(item, server_dir)
-                    elif item.is_dir():
-                        dest_dir = server_dir / item.name
-                        if dest_dir.exists():
-                            shutil.rmtree(dest_dir)
-                        shutil.copytree(item, dest_dir)
-            except Exception as e:
-                print(f"复制文件失败: {e}")
+    async def uninstall_item(self, workshop_id: str) -> int:
+        """卸载物品安装的文件，返回删除的文件数"""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.installer.uninstall, workshop_id
+        )
+
+    def _gc_blobs(self, referenced_ids: List[str]) -> Dict[str, Any]:
+        # 独占期间读取清单，进行中的安装写完清单后才开始清理
+        with self.installer.blob_store.collecting():
+            digests = self.installer.referenced_digests(referenced_ids)
+            return self.installer.blob_store.gc(digests)
+
+    async def gc_blobs(self, referenced_ids: List[str]) -> Dict[str, Any]:
+        """清理不再被任何物品引用的blob"""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self._gc_blobs, referenced_ids
+        )
 
     async def get_download_progress(self, workshop_ids: List[str]) -> Dict[str, Any]:
         """获取下载进度"""
@@ -167,3 +289,8 @@ class DownloadService:
             "completed": sum(1 for p in progress.values() if p == 100),
             "total": len(workshop_ids)
         }
+
+
+# 全局下载服务实例（创意工坊任务由下载队列调度执行）
+download_service = DownloadService()
+download_queue.register_runner("workshop", download_service.run_download_job)
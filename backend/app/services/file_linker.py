@@ -0,0 +1,99 @@
+import errno
+import fcntl
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# 硬链接不可用时转为reflink/复制的错误码
+_LINK_FALLBACK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP, errno.EACCES}
+# reflink不可用时转为sendfile复制的错误码
+_CLONE_FALLBACK_ERRNOS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EBADF, errno.EPERM}
+
+
+def place_file(src: Path, dest: Path, allow_hardlink: bool = True, prefer_reflink: bool = False) -> str:
+    """把文件放到目标位置，返回使用的方式（hardlink/reflink/copy）
+
+    优先硬链接；同一文件系统上不能硬链接时尝试 FICLONE reflink，
+    跨文件系统时用 os.sendfile 复制。目标通过临时文件原子替换。
+    allow_hardlink=False 时目标总是独立的inode（reflink或复制），源文件之后被原地修改也不影响目标。
+    prefer_reflink=True 时先尝试reflink，文件系统不支持时才硬链接。
+    """
+    if allow_hardlink and not prefer_reflink:
+        try:
+            if os.path.samefile(src, dest):
+                # 已经是指向同一文件的硬链接
+                return "hardlink"
+        except FileNotFoundError:
+            pass
+
+    tmp = dest.with_name(f".{dest.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        method = None
+        if prefer_reflink and _reflink(src, tmp):
+            method = "reflink"
+        if method is None and allow_hardlink:
+            try:
+                os.link(src, tmp)
+                method = "hardlink"
+            except OSError as e:
+                if e.errno not in _LINK_FALLBACK_ERRNOS:
+                    raise
+        if method is None:
+            method = _clone_or_copy(src, tmp)
+
+        os.replace(tmp, dest)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return method
+
+
+def _reflink(src: Path, dest: Path) -> bool:
+    """尝试reflink，文件系统不支持时删除临时目标并返回False"""
+    with open(src, "rb") as fsrc, open(dest, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            cloned = True
+        except OSError as e:
+            if e.errno not in _CLONE_FALLBACK_ERRNOS:
+                raise
+            cloned = False
+    if cloned:
+        shutil.copystat(src, dest)
+    else:
+        dest.unlink(missing_ok=True)
+    return cloned
+
+
+def _clone_or_copy(src: Path, dest: Path) -> str:
+    with open(src, "rb") as fsrc, open(dest, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            method = "reflink"
+        except OSError as e:
+            if e.errno not in _CLONE_FALLBACK_ERRNOS:
+                raise
+            _sendfile_copy(fsrc, fdst)
+            method = "copy"
+    shutil.copystat(src, dest)
+    return method
+
+
+def _sendfile_copy(fsrc, fdst):
+    size = os.fstat(fsrc.fileno()).st_size
+    offset = 0
+    try:
+        while offset < size:
+            sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    except OSError:
+        # 个别文件系统不支持sendfile，退回普通复制
+        fsrc.seek(offset)
+        fdst.seek(offset)
+        shutil.copyfileobj(fsrc, fdst)
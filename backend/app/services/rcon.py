@@ -0,0 +1,247 @@
+import asyncio
+import struct
+from typing import Optional, Dict, List, Tuple
+from app.core.config import settings
+
+
+# Source RCON 数据包类型
+SERVERDATA_AUTH = 3
+SERVERDATA_AUTH_RESPONSE = 2
+SERVERDATA_EXECCOMMAND = 2
+SERVERDATA_RESPONSE_VALUE = 0
+
+# 单个数据包正文最大长度，超出的响应会被服务器拆成多个包
+MAX_PACKET_BODY = 4096
+
+_HEADER = struct.Struct("<iii")  # size, id, type
+
+
+class RconError(Exception):
+    """RCON通信异常"""
+
+
+def encode_packet(request_id: int, packet_type: int, body: str) -> bytes:
+    payload = body.encode("utf-8") + b"\x00\x00"
+    return _HEADER.pack(len(payload) + 8, request_id, packet_type) + payload
+
+
+async def read_packet(reader: asyncio.StreamReader):
+    """读取一个数据包，返回 (id, type, body)"""
+    size_data = await reader.readexactly(4)
+    (size,) = struct.unpack("<i", size_data)
+    if size < 10 or size > MAX_PACKET_BODY + 10:
+        raise RconError(f"无效的RCON数据包长度: {size}")
+    data = await reader.readexactly(size)
+    request_id, packet_type = struct.unpack("<ii", data[:8])
+    body = data[8:-2].decode("utf-8", errors="replace")
+    return request_id, packet_type, body
+
+
+class RconClient:
+    """Source RCON客户端（单连接）
+
+    支持请求流水线：多个命令可同时在途，响应按请求ID分发。
+    每个命令后紧跟一个空的 RESPONSE_VALUE 包作为结束标记，服务器会按顺序
+    原样返回它，收到标记即说明该命令的多包响应已全部到达。
+    """
+
+    def __init__(self, host: str, port: int, password: str, timeout: float = 5):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._read_task: Optional[asyncio.Task] = None
+        self._connect_lock = asyncio.Lock()
+        self._next_id = 1
+        # 连接已断开或关闭（连接池据此淘汰）
+        self.defunct = False
+        # 命令ID -> (future, 已收到的分片)
+        self._pending: Dict[int, Tuple[asyncio.Future, List[str]]] = {}
+        # 结束标记ID -> 命令ID
+        self._terminators: Dict[int, int] = {}
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    async def connect(self):
+        """建立连接并认证"""
+        async with self._connect_lock:
+            if self.connected:
+                return
+            try:
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), timeout=self.timeout
+                )
+                await asyncio.wait_for(self._authenticate(), timeout=self.timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                await self.close()
+                raise RconError(f"RCON连接失败: {e}")
+            except RconError:
+                await self.close()
+                raise
+            self.defunct = False
+            self._read_task = asyncio.create_task(self._read_loop())
+
+    async def _authenticate(self):
+        request_id = self._allocate_id()
+        self._writer.write(encode_packet(request_id, SERVERDATA_AUTH, self.password))
+        await self._writer.drain()
+
+        while True:
+            response_id, packet_type, _ = await read_packet(self._reader)
+            # 认证前服务器会先回一个空的RESPONSE_VALUE包
+            if packet_type != SERVERDATA_AUTH_RESPONSE:
+                continue
+            if response_id == -1:
+                raise RconError("RCON密码错误")
+            if response_id == request_id:
+                return
+
+    async def _read_loop(self):
+        reader = self._reader
+        error: Optional[Exception] = None
+        try:
+            while True:
+                response_id, packet_type, body = await read_packet(reader)
+                if packet_type != SERVERDATA_RESPONSE_VALUE:
+                    continue
+
+                command_id = self._terminators.pop(response_id, None)
+                if command_id is not None:
+                    entry = self._pending.pop(command_id, None)
+                    if entry and not entry[0].done():
+                        entry[0].set_result("".join(entry[1]))
+                    continue
+
+                entry = self._pending.get(response_id)
+                if entry is not None:
+                    entry[1].append(body)
+                # 其他ID（如结束标记后的附加包、已超时的请求）直接忽略
+        except (OSError, asyncio.IncompleteReadError, RconError) as e:
+            error = e
+        finally:
+            self.defunct = True
+            self._fail_pending(RconError(f"RCON连接已断开: {error}" if error else "RCON连接已关闭"))
+            if self._writer is not None:
+                self._writer.close()
+
+    def _fail_pending(self, error: Exception):
+        pending, self._pending = self._pending, {}
+        self._terminators = {}
+        for future, _ in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def _submit(self, command: str) -> Tuple[asyncio.Future, int, int]:
+        """登记并写出一条命令及其结束标记（不等待响应）"""
+        command_id = self._allocate_id()
+        terminator_id = self._allocate_id()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[command_id] = (future, [])
+        self._terminators[terminator_id] = command_id
+        self._writer.write(
+            encode_packet(command_id, SERVERDATA_EXECCOMMAND, command)
+            + encode_packet(terminator_id, SERVERDATA_RESPONSE_VALUE, "")
+        )
+        return future, command_id, terminator_id
+
+    async def execute(self, command: str, timeout: Optional[float] = None) -> str:
+        """执行命令并返回完整输出（可并发调用，自动流水线）"""
+        return (await self.execute_many([command], timeout))[0]
+
+    async def execute_many(self, commands: List[str], timeout: Optional[float] = None) -> List[str]:
+        """一次性按顺序写出多条命令，再统一等待响应"""
+        if not self.connected:
+            await self.connect()
+
+        submitted = []
+        try:
+            for command in commands:
+                submitted.append(self._submit(command))
+            await self._writer.drain()
+            return await asyncio.wait_for(
+                asyncio.gather(*(future for future, _, _ in submitted)),
+                timeout=timeout or self.timeout
+            )
+        except asyncio.TimeoutError:
+            raise RconError(f"RCON命令超时: {'; '.join(commands)}")
+        except OSError as e:
+            await self.close()
+            raise RconError(f"RCON命令执行失败: {e}")
+        finally:
+            for _, command_id, terminator_id in submitted:
+                self._pending.pop(command_id, None)
+                self._terminators.pop(terminator_id, None)
+
+    def _allocate_id(self) -> int:
+        request_id = self._next_id
+        self._next_id = self._next_id % 0x7FFFFFFF + 1
+        return request_id
+
+    async def close(self):
+        self.defunct = True
+        if self._read_task is not None:
+            self._read_task.cancel()
+            self._read_task = None
+        self._fail_pending(RconError("RCON连接已关闭"))
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+        self._reader = None
+        self._writer = None
+
+
+class RconPool:
+    """按服务器维护的持久RCON连接池"""
+
+    def __init__(self, max_connections: int = 2, timeout: float = 5):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._clients: Dict[Tuple[str, int, str], List[RconClient]] = {}
+
+    def _acquire(self, host: str, port: int, password: str) -> RconClient:
+        key = (host, port, password)
+        clients = [c for c in self._clients.get(key, []) if not c.defunct]
+        self._clients[key] = clients
+
+        # 连接支持流水线，优先复用在途请求最少的连接
+        idle = min(clients, key=lambda c: c.in_flight, default=None)
+        if idle is not None and (idle.in_flight == 0 or len(clients) >= self.max_connections):
+            return idle
+
+        client = RconClient(host, port, password, self.timeout)
+        clients.append(client)
+        return client
+
+    async def execute(self, host: str, port: int, password: str, command: str) -> str:
+        """在指定服务器上执行命令"""
+        return await self._acquire(host, port, password).execute(command)
+
+    async def execute_many(self, host: str, port: int, password: str, commands: List[str]) -> List[str]:
+        """在同一连接上按顺序流水线执行多条命令"""
+        return await self._acquire(host, port, password).execute_many(commands)
+
+    async def close_server(self, host: str, port: int):
+        """关闭某个服务器的所有连接（服务器停止或密码变更时）"""
+        for key in [k for k in self._clients if k[0] == host and k[1] == port]:
+            for client in self._clients.pop(key):
+                await client.close()
+
+    async def close_all(self):
+        clients = [c for group in self._clients.values() for c in group]
+        self._clients = {}
+        await asyncio.gather(*(c.close() for c in clients), return_exceptions=True)
+
+
+# 全局RCON连接池
+rcon_pool = RconPool(settings.rcon_pool_size, settings.rcon_timeout)
@@ -0,0 +1,116 @@
+import asyncio
+import random
+import re
+from typing import Dict, Any, Optional, Callable, Awaitable
+
+# SteamCMD错误分类
+ERROR_TIMEOUT = "timeout"
+ERROR_RATE_LIMIT = "rate_limit"
+ERROR_LOGIN = "login"
+ERROR_LOGIN_TIMEOUT = "login_timeout"
+ERROR_NOT_FOUND = "not_found"
+ERROR_TRANSIENT = "transient"
+
+# 按顺序匹配，括号内为SteamCMD的EResult文本，中文为本项目自己生成的错误信息
+# 登录相关的错误排在超时之前："SteamCMD登录超时"是登录阶段的网络问题，不是下载超时，
+# 也不是账户问题：可以重试，但不需要放宽下载超时
+ERROR_PATTERNS = (
+    (ERROR_NOT_FOUND, re.compile(r"File Not Found|Not Found|Invalid Param|Access Denied|未找到", re.I)),
+    (ERROR_RATE_LIMIT, re.compile(r"Rate Limit|Limit Exceeded|Too Many|Busy|Service Unavailable", re.I)),
+    (ERROR_LOGIN_TIMEOUT, re.compile(r"登录超时|Log(?:in|on).{0,20}Timed? ?out", re.I)),
+    (ERROR_LOGIN, re.compile(r"Not logged on|Login Failure|Invalid Password|Logon|Two.?factor|登录", re.I)),
+    (ERROR_TIMEOUT, re.compile(r"Timeout|Timed out|超时", re.I)),
+)
+
+# 不值得重试的错误：物品不存在/无权限，或账户登录问题（重试只会触发Steam的登录限流）
+FATAL_ERRORS = (ERROR_NOT_FOUND, ERROR_LOGIN)
+
+# 操作函数：operation(attempt, timeout) -> {"success": bool, "error": str, ...}
+Operation = Callable[[int, float], Awaitable[Dict[str, Any]]]
+# 重试回调：await on_retry(attempt, delay, result)
+RetryCallback = Callable[[int, float, Dict[str, Any]], Awaitable[None]]
+
+
+def classify_steamcmd_error(error: Optional[str]) -> str:
+    """把SteamCMD的错误信息归类，未识别的（如 Failure、No Connection）视为临时错误"""
+    for category, pattern in ERROR_PATTERNS:
+        if error and pattern.search(error):
+            return category
+    return ERROR_TRANSIENT
+
+
+def size_aware_timeout(size: Optional[int], floor: float, min_speed: float) -> float:
+    """按物品大小估算下载超时：不低于floor，大文件按最低可接受速度放宽"""
+    if not size or min_speed <= 0:
+        return floor
+    return max(floor, 60 + size / min_speed)
+
+
+class RetryPolicy:
+    """指数退避 + 抖动的重试策略
+
+    第n次重试前等待 base_delay * 2^(n-1)（不超过max_delay）的一半到全部之间的随机时长，
+    避免多个失败的下载同时重试；遇到限流时退避时间再乘以rate_limit_factor。
+    超时后的重试会把超时时间翻倍——SteamCMD会保留下载缓存中的已下载部分，
+    下一次尝试从断点继续，而不是从头开始。
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 4,
+        base_delay: float = 5,
+        max_delay: float = 300,
+        rate_limit_factor: float = 4,
+        max_timeout_factor: float = 4
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limit_factor = rate_limit_factor
+        self.max_timeout_factor = max_timeout_factor
+
+    def should_retry(self, category: str, attempt: int) -> bool:
+        return category not in FATAL_ERRORS and attempt < self.max_attempts
+
+    def delay(self, category: str, attempt: int) -> float:
+        """第attempt次失败后的等待时长"""
+        delay = self.base_delay * (2 ** (attempt - 1))
+        if category == ERROR_RATE_LIMIT:
+            delay *= self.rate_limit_factor
+        delay = min(delay, self.max_delay)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def timeout(self, base_timeout: float, timeouts: int) -> float:
+        """已经超时timeouts次后下一次尝试的超时时间"""
+        return base_timeout * min(2 ** timeouts, self.max_timeout_factor)
+
+    async def run(
+        self,
+        operation: Operation,
+        base_timeout: float,
+        on_retry: Optional[RetryCallback] = None
+    ) -> Dict[str, Any]:
+        """执行operation直到成功、遇到不可重试的错误或次数用尽
+
+        返回最后一次的结果，并附加 attempts 和 error_type 字段。
+        """
+        timeouts = 0
+        attempt = 0
+        while True:
+            attempt += 1
+            result = await operation(attempt, self.timeout(base_timeout, timeouts))
+            result["attempts"] = attempt
+            if result.get("success"):
+                return result
+
+            category = classify_steamcmd_error(result.get("error"))
+            result["error_type"] = category
+            if not self.should_retry(category, attempt):
+                return result
+
+            if category == ERROR_TIMEOUT:
+                timeouts += 1
+            delay = self.delay(category, attempt)
+            if on_retry is not None:
+                await on_retry(attempt, delay, result)
+            await asyncio.sleep(delay)
@@ -0,0 +1,333 @@
+import asyncio
+import bisect
+import secrets
+from typing import Dict, Any, List, Optional, Set, Tuple
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.room import Room
+from app.schemas.room import RoomDetail
+from app.services.a2s import A2SPoller, a2s_poller
+from app.services.task_store import IN_QUERY_BATCH
+
+# 缓存的列表响应数量上限（大厅版本变化时全部清空）
+RESPONSE_CACHE_SIZE = 256
+
+
+class LobbyRoom:
+    """大厅中的一个房间：数据库中的字段（已序列化）和叠加A2S实时状态后的输出"""
+
+    __slots__ = ("id", "server_id", "base", "data")
+
+    def __init__(self, base: Dict[str, Any]):
+        self.id = base["id"]
+        self.server_id = base["server_id"]
+        self.base = base
+        self.data = base
+
+    @property
+    def game_mode(self) -> Optional[str]:
+        return self.data["game_mode"]
+
+    @property
+    def current_map(self) -> Optional[str]:
+        return self.data["current_map"]
+
+    @property
+    def has_free_slots(self) -> bool:
+        return self.data["current_players"] < self.data["max_players"]
+
+    @property
+    def is_private(self) -> bool:
+        return bool(self.data["is_private"])
+
+
+class RoomLobby:
+    """开放中房间的内存索引
+
+    房间以序列化后的字典保存，按模式、地图、是否有空位、是否私密建立索引，列表查询
+    完全在内存中完成。房间接口在提交后调用mark_dirty（服务器接口调用mark_server_dirty），
+    下一次查询前批量从数据库重新加载这些房间；A2S实时地图/人数变化直接在内存中叠加。
+    每次内容变化version加一，作为列表的ETag。
+
+    索引只反映本进程的写入：多进程部署时其他进程的修改由定时全量同步
+    （lobby_resync_interval秒）补上。
+    """
+
+    def __init__(self, poller: A2SPoller, resync_interval: float = 30):
+        self.poller = poller
+        self.resync_interval = resync_interval
+        self.version = 0
+        # 进程启动时随机生成，重启后旧ETag不会误匹配
+        self._epoch = secrets.token_hex(4)
+        self._loaded = False
+        self._rooms: Dict[int, LobbyRoom] = {}
+        self._ids: List[int] = []
+        self._by_mode: Dict[str, Set[int]] = {}
+        self._by_map: Dict[str, Set[int]] = {}
+        self._by_server: Dict[int, Set[int]] = {}
+        self._free: Set[int] = set()
+        self._private: Set[int] = set()
+        self._dirty: Set[int] = set()
+        self._dirty_servers: Set[int] = set()
+        self._responses: Dict[Tuple, Tuple[List[Dict[str, Any]], Optional[int], int]] = {}
+        self._lock = asyncio.Lock()
+        self._resync_task: Optional[asyncio.Task] = None
+        self.metrics = {
+            "requests": 0, "not_modified": 0, "queries": 0, "cached_queries": 0, "reloads": 0, "full_syncs": 0
+        }
+        poller.add_listener(self._on_live_changed)
+
+    @property
+    def etag(self) -> str:
+        return f'"{self._epoch}-{self.version}"'
+
+    def not_modified(self, if_none_match: Optional[str]) -> bool:
+        """客户端缓存的ETag与当前版本一致时返回True（调用前需先sync）"""
+        self.metrics["requests"] += 1
+        if not if_none_match:
+            return False
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if self.etag in tags or "*" in tags:
+            self.metrics["not_modified"] += 1
+            return True
+        return False
+
+    def start(self):
+        if self.resync_interval > 0 and self._resync_task is None:
+            self._resync_task = asyncio.create_task(self._resync_loop())
+
+    async def close(self):
+        if self._resync_task is not None:
+            self._resync_task.cancel()
+            self._resync_task = None
+
+    # 变更来源
+    def mark_dirty(self, room_id: int):
+        """房间已变化（创建/修改/加入/离开/删除），下次查询前重新加载"""
+        self._dirty.add(room_id)
+
+    def mark_server_dirty(self, server_id: int):
+        """服务器信息已变化，下次查询前重新加载该服务器上的所有房间"""
+        self._dirty_servers.add(server_id)
+
+    def _on_live_changed(self, server_id: int):
+        changed = False
+        for room_id in self._by_server.get(server_id, ()):
+            changed |= self._render(self._rooms[room_id])
+        if changed:
+            self._bump()
+
+    # 同步
+    async def sync(self):
+        """应用尚未处理的变更；没有变更时不访问数据库"""
+        if self._loaded and not self._dirty and not self._dirty_servers:
+            return
+        async with self._lock:
+            if not self._loaded:
+                await self._full_sync()
+                return
+            dirty, self._dirty = self._dirty, set()
+            dirty_servers, self._dirty_servers = self._dirty_servers, set()
+            try:
+                await self._reload(dirty, dirty_servers)
+            except Exception:
+                self._dirty |= dirty
+                self._dirty_servers |= dirty_servers
+                raise
+
+    async def _reload(self, room_ids: Set[int], server_ids: Set[int]):
+        for server_id in server_ids:
+            room_ids |= self._by_server.get(server_id, set())
+        ids = sorted(room_ids)
+        loaded: Dict[int, Room] = {}
+        async with AsyncSessionLocal() as db:
+            for i in range(0, len(ids), IN_QUERY_BATCH):
+                loaded.update((room.id, room) for room in await db.scalars(self._query().where(
+                    Room.id.in_(ids[i:i + IN_QUERY_BATCH])
+                )))
+            # 服务器上新增的房间（由其他进程创建）不在本地索引中，按服务器补查
+            if server_ids:
+                loaded.update((room.id, room) for room in await db.scalars(self._query().where(
+                    Room.server_id.in_(sorted(server_ids))
+                )))
+        changed = False
+        for room_id in set(ids) | set(loaded):
+            room = loaded.get(room_id)
+            if room is None:
+                changed |= self._remove(room_id)
+            else:
+                changed |= self._put(self._serialize(room))
+        self.metrics["reloads"] += 1
+        if changed:
+            self._bump()
+
+    async def _full_sync(self):
+        # 查询开始后才标记的变更保留到下一次同步（查询可能读到提交前的数据）
+        self._dirty.clear()
+        self._dirty_servers.clear()
+        async with AsyncSessionLocal() as db:
+            rooms = [self._serialize(room) for room in await db.scalars(self._query())]
+        changed = False
+        current = {base["id"] for base in rooms}
+        for room_id in [room_id for room_id in self._rooms if room_id not in current]:
+            changed |= self._remove(room_id)
+        for base in rooms:
+            changed |= self._put(base)
+        self._loaded = True
+        self.metrics["full_syncs"] += 1
+        if changed:
+            self._bump()
+
+    async def _resync_loop(self):
+        while True:
+            await asyncio.sleep(self.resync_interval)
+            try:
+                async with self._lock:
+                    await self._full_sync()
+            except Exception as e:
+                print(f"大厅同步失败: {str(e)}")
+
+    @staticmethod
+    def _query():
+        return (
+            select(Room)
+            .options(selectinload(Room.server), selectinload(Room.creator))
+            .where(Room.is_active == True)
+        )
+
+    @staticmethod
+    def _serialize(room: Room) -> Dict[str, Any]:
+        return RoomDetail.model_validate(room).model_dump(mode="json")
+
+    # 索引维护
+    def _put(self, base: Dict[str, Any]) -> bool:
+        record = self._rooms.get(base["id"])
+        if record is not None and record.base == base:
+            return False
+        if record is None:
+            record = LobbyRoom(base)
+            self._rooms[record.id] = record
+            bisect.insort(self._ids, record.id)
+        else:
+            self._unindex(record)
+            record.base = base
+            record.server_id = base["server_id"]
+        record.data = self._overlay(record)
+        self._index(record)
+        return True
+
+    def _remove(self, room_id: int) -> bool:
+        record = self._rooms.pop(room_id, None)
+        if record is None:
+            return False
+        self._unindex(record)
+        del self._ids[bisect.bisect_left(self._ids, room_id)]
+        return True
+
+    def _overlay(self, record: LobbyRoom) -> Dict[str, Any]:
+        """服务器在线时用A2S缓存中的实际人数和地图覆盖数据库中的值"""
+        live = self.poller.get(record.server_id) if record.server_id else None
+        if live is None:
+            return record.base
+        return {**record.base, "current_map": live["map"], "current_players": live["players"]}
+
+    def _render(self, record: LobbyRoom) -> bool:
+        """重新叠加实时状态，返回输出是否变化"""
+        data = self._overlay(record)
+        if data == record.data:
+            return False
+        self._unindex(record)
+        record.data = data
+        self._index(record)
+        return True
+
+    def _index(self, record: LobbyRoom):
+        self._by_mode.setdefault(record.game_mode, set()).add(record.id)
+        self._by_map.setdefault(record.current_map, set()).add(record.id)
+        self._by_server.setdefault(record.server_id, set()).add(record.id)
+        if record.has_free_slots:
+            self._free.add(record.id)
+        if record.is_private:
+            self._private.add(record.id)
+
+    def _unindex(self, record: LobbyRoom):
+        for index, key in (
+            (self._by_mode, record.game_mode),
+            (self._by_map, record.current_map),
+            (self._by_server, record.server_id)
+        ):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(record.id)
+                if not ids:
+                    del index[key]
+        self._free.discard(record.id)
+        self._private.discard(record.id)
+
+    def _bump(self):
+        self.version += 1
+        self._responses.clear()
+
+    # 查询
+    def query(
+        self,
+        game_mode: Optional[str] = None,
+        current_map: Optional[str] = None,
+        has_free_slots: Optional[bool] = None,
+        is_private: Optional[bool] = None,
+        cursor: Optional[int] = None,
+        limit: int = 100
+    ) -> Tuple[List[Dict[str, Any]], Optional[int], int]:
+        """按条件分页查询（按ID升序），返回 (房间列表, 下一页游标, 符合条件的总数)"""
+        key = (game_mode, current_map, has_free_slots, is_private, cursor, limit)
+        self.metrics["queries"] += 1
+        cached = self._responses.get(key)
+        if cached is not None:
+            self.metrics["cached_queries"] += 1
+            return cached
+
+        include: List[Set[int]] = []
+        exclude: List[Set[int]] = []
+        if game_mode is not None:
+            include.append(self._by_mode.get(game_mode, set()))
+        if current_map is not None:
+            include.append(self._by_map.get(current_map, set()))
+        for flag, ids in ((has_free_slots, self._free), (is_private, self._private)):
+            if flag is True:
+                include.append(ids)
+            elif flag is False:
+                exclude.append(ids)
+
+        if include or exclude:
+            # 从最小的集合出发求交集，结果通常远小于房间总数
+            include.sort(key=len)
+            matched = set(include[0] if include else self._rooms).intersection(*include[1:]).difference(*exclude)
+            total = len(matched)
+            page = sorted(room_id for room_id in matched if cursor is None or room_id > cursor)[:limit + 1]
+        else:
+            total = len(self._ids)
+            start = bisect.bisect_right(self._ids, cursor) if cursor is not None else 0
+            page = self._ids[start:start + limit + 1]
+
+        next_cursor = page[limit - 1] if len(page) > limit else None
+        result = ([self._rooms[room_id].data for room_id in page[:limit]], next_cursor, total)
+        if len(self._responses) >= RESPONSE_CACHE_SIZE:
+            self._responses.clear()
+        self._responses[key] = result
+        return result
+
+    def get_metrics(self) -> Dict[str, Any]:
+        requests = self.metrics["requests"]
+        return {
+            **self.metrics,
+            "version": self.version,
+            "rooms": len(self._rooms),
+            "pending_changes": len(self._dirty) + len(self._dirty_servers),
+            "not_modified_rate": self.metrics["not_modified"] / requests if requests else None
+        }
+
+
+# 全局房间大厅索引
+room_lobby = RoomLobby(a2s_poller, settings.lobby_resync_interval)
@@ -1,11 +1,11 @@
 import subprocess
 import os
 import asyncio
-import uuid
 from typing import Optional, Dict, Any
 from pathlib import Path
 from app.core.config import settings
 from app.services.download_manager import download_manager
+from app.services.download_queue import download_queue
 
 
 class ServerInstaller:
@@ -82,6 +82,57 @@ class ServerInstaller:
                 "message": f"安装SteamCMD失败: {str(e)}"
             }
 
+    def _steamcmd_login_args(self, steam_credentials: Optional[Dict[str, str]]) -> list:
+        if steam_credentials and steam_credentials.get("username"):
+            return ["+login", steam_credentials["username"], steam_credentials.get("password", "")]
+        return ["+login", "anonymous"]
+
+    async def start_app_update(
+        self,
+        steam_credentials: Optional[Dict[str, str]],
+        task_type: str,
+        description: str,
+        priority: int = 0
+    ) -> str:
+        """把 app_update 222860 加入下载队列，返回任务ID"""
+        task = await download_queue.submit(
+            task_type,
+            description,
+            priority=priority,
+            secrets=steam_credentials if steam_credentials and steam_credentials.get("username") else None
+        )
+        return task.task_id
+
+    async def run_app_update(self, task, payload: Dict[str, Any], secrets: Optional[Dict[str, Any]]):
+        """队列执行函数：运行 app_update 并跟踪进度直到结束"""
+        # 确保服务器目录存在
+        self.server_path.mkdir(parents=True, exist_ok=True)
+
+        # 构建SteamCMD命令
+        cmd = [
+            str(self.steamcmd_path / "steamcmd.sh"),
+            "+force_install_dir", str(self.server_path)
+        ]
+        cmd.extend(self._steamcmd_login_args(secrets))
+        cmd.extend([
+            "+app_update", "222860", "validate",
+            "+quit"
+        ])
+
+        # 启动下载进程
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                cwd=str(self.steamcmd_path.parent)
+            )
+        except Exception as e:
+            task.fail(f"启动SteamCMD失败: {str(e)}")
+            return
+
+        await download_manager.monitor_download_progress(task.task_id, process, self.server_path)
+
     async def download_l4d2_server(self, steam_credentials: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
         """下载L4D2服务器"""
         try:
@@ -91,55 +142,15 @@ class ServerInstaller:
                     "message": "SteamCMD未安装，请先安装SteamCMD"
                 }
 
-            # 确保服务器目录存在
-            self.server_path.mkdir(parents=True, exist_ok=True)
-
-            # 构建SteamCMD命令
-            cmd = [
-                str(self.steamcmd_path / "steamcmd.sh"),
-                "+force_install_dir", str(self.server_path)
-            ]
-
-            # 添加认证信息
-            if steam_credentials and steam_credentials.get("username"):
-                cmd.extend([
-                    "+login", steam_credentials["username"],
-                    steam_credentials.get("password", "")
-                ])
-            else:
-                cmd.extend(["+login", "anonymous"])
-
-            # 添加下载命令
-            cmd.extend([
-                "+app_update", "222860", "validate",
-                "+quit"
-            ])
-
-            # 创建下载任务
-            task_id = f"l4d2_server_{uuid.uuid4().hex[:8]}"
-            task = download_manager.create_task(
-                task_id=task_id,
+            task_id = await self.start_app_update(
+                steam_credentials,
                 task_type="l4d2_server",
                 description="下载L4D2服务器"
             )
 
-            # 启动下载进程
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                cwd=str(self.steamcmd_path.parent)
-            )
-
-            # 启动进度监控
-            asyncio.create_task(
-                download_manager.monitor_download_progress(task_id, process, self.server_path)
-            )
-
             return {
                 "success": True,
-                "message": "L4D2服务器下载已开始",
+                "message": "L4D2服务器下载已加入下载队列",
                 "task_id": task_id
             }
 
@@ -154,7 +165,42 @@ class ServerInstaller:
                 "message": f"下载L4D2服务器失败: {str(e)}"
             }
 
-    async def install_sourcemod_and_metamod(self, steam_credentials: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    async def install_sourcemod_and_metamod(
+        self,
+        steam_credentials: Optional[Dict[str, str]] = None,
+        depends_on: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """把SourceMod和MetaMod安装加入下载队列（depends_on为需要先完成的服务器下载任务）"""
+        if not depends_on and not self.is_server_installed():
+            return {
+                "success": False,
+                "message": "L4D2服务器未安装，请先安装服务器"
+            }
+
+        task = await download_queue.submit(
+            "plugins",
+            "安装SourceMod和MetaMod",
+            payload={"depends_on": depends_on} if depends_on else None,
+            secrets=steam_credentials if steam_credentials and steam_credentials.get("username") else None
+        )
+        return {
+            "success": True,
+            "message": "插件安装已加入下载队列",
+            "task_id": task.task_id
+        }
+
+    async def run_plugin_install(self, task, payload: Dict[str, Any], secrets: Optional[Dict[str, Any]]):
+        """队列执行函数：安装插件"""
+        task.start()
+        result = await self._install_plugins(secrets)
+        if task.status != "running":
+            return
+        if result["success"]:
+            task.complete(result["message"])
+        else:
+            task.fail(result["message"])
+
+    async def _install_plugins(self, steam_credentials: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
         """安装SourceMod和MetaMod"""
         try:
             if not self.is_server_installed():
@@ -276,8 +322,10 @@ class ServerInstaller:
                 "results": results
             }
 
-        # 3. 安装插件
-        plugins_result = await self.install_sourcemod_and_metamod(steam_credentials)
+        # 3. 安装插件（排在服务器下载完成之后执行）
+        plugins_result = await self.install_sourcemod_and_metamod(
+            steam_credentials, depends_on=server_result["task_id"]
+        )
         results.append({"step": "plugins", **plugins_result})
 
         # 检查整体安装结果
@@ -288,3 +336,10 @@ class ServerInstaller:
             "message": "安装完成" if all_success else "安装过程中出现错误",
             "results": results
         }
+
+
+# 注册下载队列执行函数
+_installer = ServerInstaller()
+download_queue.register_runner("l4d2_server", _installer.run_app_update)
+download_queue.register_runner("server_update", _installer.run_app_update)
+download_queue.register_runner("plugins", _installer.run_plugin_install)
@@ -1,105 +1,329 @@
-import subprocess
-import os
-import signal
-from typing import Optional, Dict, Any
+import asyncio
+import socket
+import time
+from collections import deque
+from typing import Optional, Dict, Any, List, Set
 from pathlib import Path
 from app.core.config import settings
+from app.core.console import console_config
 from app.models.server import ServerStatus
+from app.services.download_manager import download_manager
+from app.services.server_installer import ServerInstaller
+from app.services.steamcmd_output import iter_output_lines
+from app.services.rcon import rcon_pool, RconError
 
 
-class ServerManager:
-    """L4D2服务器管理器"""
+# 可以通过RCON实时修改、无需重启进程的配置项
+LIVE_CONFIG_KEYS = ("current_map", "game_mode", "difficulty", "password")
+
+# 会改写服务器文件的下载任务类型，执行期间不能运行srcds
+SERVER_FILE_TASK_TYPES = ("l4d2_server", "server_update")
+
+
+class ServerInstance:
+    """单个srcds进程（对应一条Server记录）"""
+
+    def __init__(self, server_id: Optional[int], server_path: Path):
+        self.server_id = server_id
+        self.server_path = server_path
+        self.config: Dict[str, Any] = {}
+        self.port: Optional[int] = None
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.state = ServerStatus.STOPPED
+        self.desired_running = False
+        self.restart_count = 0
+        self.last_exit_code: Optional[int] = None
+        self.started_at: Optional[float] = None
+        # 最近的控制台输出
+        self.console = deque(maxlen=200)
+        self._output_reader: Optional[asyncio.Task] = None
+        self._watcher: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    @property
+    def rcon_host(self) -> str:
+        ip = self.config.get("ip") or settings.server_bind_ip
+        return "127.0.0.1" if ip == "0.0.0.0" else ip
+
+    def build_command(self) -> list:
+        config = self.config
+        cmd = [
+            str(self.server_path / "srcds_run"),
+            "-console",
+            "-game", "left4dead2",
+            "-ip", config.get("ip") or settings.server_bind_ip,
+            "-port", str(self.port),
+            "+maxplayers", str(config.get("max_players", 8)),
+            "+map", config.get("current_map", "c1m1_hotel"),
+            "+sv_gametypes", config.get("game_mode", "coop"),
+            "+z_difficulty", config.get("difficulty", "Normal")
+        ]
+
+        # 如果设置了密码
+        if config.get("password"):
+            cmd.extend(["+sv_password", config["password"]])
+
+        # 如果设置了RCON密码
+        if config.get("rcon_password"):
+            cmd.extend(["+rcon_password", config["rcon_password"]])
+
+        return cmd
+
+    async def spawn(self):
+        """启动进程并开始监视"""
+        self.process = await asyncio.create_subprocess_exec(
+            *self.build_command(),
+            cwd=str(self.server_path),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT
+        )
+        self.state = ServerStatus.RUNNING
+        self.started_at = time.monotonic()
+        # 持续读取控制台输出，避免管道写满阻塞srcds
+        self._output_reader = asyncio.create_task(self._read_console(self.process))
+        self._watcher = asyncio.create_task(self._watch(self.process))
+
+    async def terminate(self):
+        """停止进程（不会触发自动重启）"""
+        self.desired_running = False
+        self.state = ServerStatus.STOPPING
+        process = self.process
+
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), timeout=settings.server_stop_timeout)
+        except asyncio.TimeoutError:
+            # 如果进程没有在超时时间内结束，强制杀死
+            process.kill()
+            await process.wait()
+
+        if self._output_reader is not None:
+            # srcds_run的子进程可能仍持有管道，最多等待片刻
+            try:
+                await asyncio.wait_for(self._output_reader, timeout=5)
+            except asyncio.TimeoutError:
+                pass
+            self._output_reader = None
+
+        self.last_exit_code = process.returncode
+        self.process = None
+        self.state = ServerStatus.STOPPED
+
+    async def _read_console(self, process: asyncio.subprocess.Process):
+        async for line in iter_output_lines(process.stdout):
+            self.console.append(line)
+
+    async def _watch(self, process: asyncio.subprocess.Process):
+        """崩溃检测：进程意外退出时按指数退避自动重启"""
+        return_code = await process.wait()
+        if self.process is not process or not self.desired_running:
+            return
+
+        self.last_exit_code = return_code
+        uptime = time.monotonic() - (self.started_at or 0)
+        if uptime >= settings.server_stable_uptime:
+            # 稳定运行过一段时间，重新计算重启次数
+            self.restart_count = 0
+
+        if self.restart_count >= settings.server_max_restarts:
+            self.state = ServerStatus.ERROR
+            self.desired_running = False
+            return
+
+        delay = min(
+            settings.server_restart_backoff_max,
+            settings.server_restart_backoff_base * (2 ** self.restart_count)
+        )
+        self.restart_count += 1
+        self.state = ServerStatus.STARTING
+        self.console.append(f"[supervisor] 进程退出（代码 {return_code}），{delay:g}秒后重启")
+
+        await asyncio.sleep(delay)
+        async with self.lock:
+            if self.desired_running and not self.running:
+                try:
+                    await self.spawn()
+                except Exception as e:
+                    self.state = ServerStatus.ERROR
+                    self.desired_running = False
+                    self.console.append(f"[supervisor] 重启失败: {e}")
+
+    def get_status(self) -> Dict[str, Any]:
+        running = self.running
+        return {
+            "running": running,
+            "status": self.state,
+            "pid": self.process.pid if running else None,
+            "port": self.port,
+            "restart_count": self.restart_count,
+            "last_exit_code": self.last_exit_code,
+            "uptime": (time.monotonic() - self.started_at) if running and self.started_at else None
+        }
+
+
+class ServerSupervisor:
+    """多实例srcds进程管理器
+
+    以 Server.id 为键维护进程注册表，负责端口分配、崩溃重启，
+    状态查询为O(1)字典查找。
+    """
 
     def __init__(self):
         self.server_path = Path(settings.l4d2_server_path)
         self.steamcmd_path = Path(settings.steamcmd_path)
-        self.process = None
+        self.instances: Dict[int, ServerInstance] = {}
+        # 预热池中尚未分配的实例（由WarmServerPool维护），用于端口占用判断和更新前的检查
+        self.warm_instances: List[ServerInstance] = []
+        # 已决定更新、更新任务尚未提交时为True（检查与提交之间有await）
+        self._update_requested = False
+
+    def _instance(self, server_id: int) -> ServerInstance:
+        instance = self.instances.get(server_id)
+        if instance is None:
+            instance = ServerInstance(server_id, self.server_path)
+            self.instances[server_id] = instance
+        return instance
+
+    def _ports_in_use(self, exclude: Optional[int]) -> Set[int]:
+        ports = {
+            inst.port for sid, inst in self.instances.items()
+            if sid != exclude and inst.port is not None and (inst.running or inst.desired_running)
+        }
+        ports.update(inst.port for inst in self.warm_instances if inst.port is not None)
+        return ports
+
+    @staticmethod
+    def _port_available(port: int) -> bool:
+        # srcds同时使用同端口的UDP（游戏）和TCP（RCON）
+        for sock_type in (socket.SOCK_DGRAM, socket.SOCK_STREAM):
+            with socket.socket(socket.AF_INET, sock_type) as sock:
+                try:
+                    sock.bind((settings.server_bind_ip, port))
+                except OSError:
+                    return False
+        return True
+
+    def allocate_port(self, server_id: Optional[int], preferred: Optional[int] = None) -> int:
+        """分配端口：优先使用配置的端口，冲突时从端口范围中选取"""
+        in_use = self._ports_in_use(server_id)
+        candidates = []
+        if preferred:
+            candidates.append(preferred)
+        candidates.extend(range(settings.server_port_range_start, settings.server_port_range_end + 1))
 
-    def is_server_running(self) -> bool:
+        for port in candidates:
+            if port not in in_use and self._port_available(port):
+                return port
+        raise RuntimeError("没有可用的服务器端口")
+
+    def adopt(self, server_id: int, instance: ServerInstance):
+        """把预热池中的实例登记为指定服务器的进程"""
+        if self.files_updating():
+            raise RuntimeError("服务器文件正在更新")
+        current = self.instances.get(server_id)
+        if current is not None and (current.running or current.desired_running):
+            raise RuntimeError("服务器已经在运行")
+        if instance in self.warm_instances:
+            self.warm_instances.remove(instance)
+        instance.server_id = server_id
+        self.instances[server_id] = instance
+
+    def files_updating(self) -> bool:
+        """服务器文件更新任务排队中、执行中或已暂停时返回True，期间不允许启动srcds或补充预热池"""
+        if self._update_requested:
+            return True
+        return any(
+            task.task_type in SERVER_FILE_TASK_TYPES
+            for status in ("pending", "running", "paused")
+            for task in download_manager.tasks_with_status(status)
+        )
+
+    def is_server_running(self, server_id: int) -> bool:
         """检查服务器是否正在运行"""
-        if self.process is None:
-            return False
-        return self.process.poll() is None
+        instance = self.instances.get(server_id)
+        return instance is not None and instance.running
 
-    def get_server_status(self) -> Dict[str, Any]:
+    def get_server_status(self, server_id: int) -> Dict[str, Any]:
         """获取服务器状态"""
-        running = self.is_server_running()
-        return {
-            "running": running,
-            "status": ServerStatus.RUNNING if running else ServerStatus.STOPPED,
-            "pid": self.process.pid if self.process else None
-        }
+        instance = self.instances.get(server_id)
+        if instance is None:
+            return {
+                "running": False,
+                "status": ServerStatus.STOPPED,
+                "pid": None,
+                "port": None
+            }
+        return instance.get_status()
 
-    def start_server(self, config: Dict[str, Any]) -> Dict[str, Any]:
+    async def start_server(self, server_id: int, config: Dict[str, Any]) -> Dict[str, Any]:
         """启动服务器"""
+        instance = self._instance(server_id)
+        async with instance.lock:
+            return await self._start(instance, config)
+
+    async def _start(self, instance: ServerInstance, config: Dict[str, Any]) -> Dict[str, Any]:
         try:
-            if self.is_server_running():
+            if instance.running:
                 return {
                     "success": False,
                     "message": "服务器已经在运行"
                 }
+            if self.files_updating():
+                return {
+                    "success": False,
+                    "message": "服务器文件正在更新，请在更新完成后再启动"
+                }
 
-            # 构建启动命令
-            cmd = [
-                str(self.server_path / "srcds_run"),
-                "-console",
-                "-game", "left4dead2",
-                "-port", str(config.get("port", 27015)),
-                "+maxplayers", str(config.get("max_players", 8)),
-                "+map", config.get("current_map", "c1m1_hotel"),
-                "+sv_gametypes", config.get("game_mode", "coop"),
-                "+z_difficulty", config.get("difficulty", "Normal")
-            ]
-
-            # 如果设置了密码
-            if config.get("password"):
-                cmd.extend(["+sv_password", config["password"]])
-
-            # 如果设置了RCON密码
-            if config.get("rcon_password"):
-                cmd.extend(["+rcon_password", config["rcon_password"]])
-
-            # 启动进程
-            self.process = subprocess.Popen(
-                cmd,
-                cwd=str(self.server_path),
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
+            # 配置会拼接进启动参数（+map等在srcds中作为控制台命令执行）
+            instance.config = console_config(config)
+            instance.port = self.allocate_port(instance.server_id, config.get("port"))
+            instance.restart_count = 0
+            instance.desired_running = True
+            await instance.spawn()
 
             return {
                 "success": True,
                 "message": "服务器启动中...",
-                "pid": self.process.pid
+                "pid": instance.process.pid,
+                "port": instance.port
             }
 
         except Exception as e:
+            instance.desired_running = False
+            instance.state = ServerStatus.ERROR
             return {
                 "success": False,
                 "message": f"启动服务器失败: {str(e)}"
             }
 
-    def stop_server(self) -> Dict[str, Any]:
+    async def stop_server(self, server_id: int) -> Dict[str, Any]:
         """停止服务器"""
+        instance = self.instances.get(server_id)
+        if instance is None:
+            return {
+                "success": False,
+                "message": "服务器未在运行"
+            }
+        async with instance.lock:
+            return await self._stop(instance)
+
+    async def _stop(self, instance: ServerInstance) -> Dict[str, Any]:
         try:
-            if not self.is_server_running():
+            if not instance.running:
+                # 可能处于重启退避中，取消自动重启
+                instance.desired_running = False
+                instance.state = ServerStatus.STOPPED
                 return {
                     "success": False,
                     "message": "服务器未在运行"
                 }
 
-            # 发送终止信号
-            self.process.terminate()
-
-            # 等待进程结束
-            try:
-                self.process.wait(timeout=30)
-            except subprocess.TimeoutExpired:
-                # 如果进程没有在30秒内结束，强制杀死
-                self.process.kill()
-                self.process.wait()
-
-            self.process = None
+            await instance.terminate()
+            await rcon_pool.close_server(instance.rcon_host, instance.port)
 
             return {
                 "success": True,
@@ -112,54 +336,149 @@ class ServerManager:
                 "message": f"停止服务器失败: {str(e)}"
             }
 
-    def restart_server(self, config: Dict[str, Any]) -> Dict[str, Any]:
+    async def restart_server(self, server_id: int, config: Dict[str, Any]) -> Dict[str, Any]:
         """重启服务器"""
-        stop_result = self.stop_server()
-        if not stop_result["success"]:
-            return stop_result
+        instance = self._instance(server_id)
+        async with instance.lock:
+            stop_result = await self._stop(instance)
+            if not stop_result["success"]:
+                return stop_result
+
+            # 等待一会儿再启动（释放端口）
+            await asyncio.sleep(2)
 
-        # 等待一会儿再启动
-        import time
-        time.sleep(2)
+            return await self._start(instance, config)
 
-        return self.start_server(config)
+    async def apply_live(self, server_id: int, changes: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """通过RCON实时应用地图、模式、难度和密码变更
+
+        服务器未运行或没有RCON密码时返回None，由调用方决定是否重启。
+        """
+        instance = self.instances.get(server_id)
+        if instance is None or not instance.running or not instance.config.get("rcon_password"):
+            return None
 
-    def update_server(self) -> Dict[str, Any]:
-        """更新服务器"""
         try:
-            cmd = [
-                str(self.steamcmd_path / "steamcmd.sh"),
-                "+force_install_dir", str(self.server_path),
-                "+login", "anonymous",
-                "+app_update", "222860", "validate",
-                "+quit"
-            ]
+            changes = console_config({key: value for key, value in changes.items() if key in LIVE_CONFIG_KEYS})
+        except ValueError as e:
+            return {
+                "success": False,
+                "message": f"配置值无效: {str(e)}"
+            }
+        changes = {
+            key: value for key, value in changes.items()
+            if value is not None and value != instance.config.get(key)
+        }
+        if not changes:
+            return {
+                "success": True,
+                "message": "配置未变化"
+            }
 
-            result = subprocess.run(cmd, capture_output=True, text=True)
+        commands = []
+        if "game_mode" in changes:
+            commands.append(f'mp_gamemode "{changes["game_mode"]}"')
+        if "difficulty" in changes:
+            commands.append(f'z_difficulty "{changes["difficulty"]}"')
+        if "password" in changes:
+            commands.append(f'sv_password "{changes["password"]}"')
+        if "current_map" in changes:
+            # 换图放在最后，使模式设置在新地图上生效
+            commands.append(f'changelevel {changes["current_map"]}')
 
-            if result.returncode == 0:
-                return {
-                    "success": True,
-                    "message": "服务器更新完成"
-                }
-            else:
+        try:
+            await rcon_pool.execute_many(
+                instance.rcon_host, instance.port, instance.config["rcon_password"], commands
+            )
+        except RconError as e:
+            return {
+                "success": False,
+                "message": f"RCON应用配置失败: {str(e)}"
+            }
+
+        # 崩溃重启时沿用新配置
+        instance.config.update(changes)
+        return {
+            "success": True,
+            "message": "配置已实时应用",
+            "applied": list(changes)
+        }
+
+    async def stop_all(self):
+        """停止所有实例（应用关闭时调用）"""
+        await asyncio.gather(
+            *(self.stop_server(server_id) for server_id in list(self.instances)),
+            return_exceptions=True
+        )
+
+    async def update_server(self) -> Dict[str, Any]:
+        """更新服务器（作为下载任务在后台执行）
+
+        更新任务结束前拒绝启动服务器和认领预热实例，预热池也暂停补充；
+        空闲的预热实例没有玩家，直接停止。
+        """
+        if self.files_updating():
+            return {
+                "success": False,
+                "message": "已有服务器更新任务在进行中"
+            }
+        running = [sid for sid, inst in self.instances.items() if inst.running or inst.desired_running]
+        if running:
+            return {
+                "success": False,
+                "message": f"有 {len(running)} 个服务器实例正在运行，请先停止后再更新"
+            }
+
+        # 从这里开始拒绝新的启动，直到更新任务提交（之后由任务状态判断）
+        self._update_requested = True
+        try:
+            installer = ServerInstaller()
+            if not installer.is_steamcmd_installed():
                 return {
                     "success": False,
-                    "message": f"服务器更新失败: {result.stderr}"
+                    "message": "SteamCMD未安装，请先安装SteamCMD"
                 }
 
+            warm = list(self.warm_instances)
+            await asyncio.gather(
+                *(instance.terminate() for instance in warm if instance.running),
+                return_exceptions=True
+            )
+            for instance in warm:
+                instance.desired_running = False
+
+            task_id = await installer.start_app_update(
+                None,
+                task_type="server_update",
+                description="更新L4D2服务器"
+            )
+
+            return {
+                "success": True,
+                "message": "服务器更新已开始",
+                "task_id": task_id
+            }
+
         except Exception as e:
             return {
                 "success": False,
                 "message": f"更新服务器失败: {str(e)}"
             }
+        finally:
+            self._update_requested = False
 
-    def get_server_info(self) -> Dict[str, Any]:
+    def get_server_info(self, server_id: int) -> Dict[str, Any]:
         """获取服务器信息"""
-        info = self.get_server_status()
+        info = self.get_server_status(server_id)
+        instance = self.instances.get(server_id)
         info.update({
             "server_path": str(self.server_path),
             "steamcmd_path": str(self.steamcmd_path),
-            "config_exists": (self.server_path / "left4dead2" / "cfg" / "server.cfg").exists()
+            "config_exists": (self.server_path / "left4dead2" / "cfg" / "server.cfg").exists(),
+            "console": list(instance.console)[-20:] if instance else []
         })
         return info
+
+
+# 全局服务器进程管理器实例
+server_supervisor = ServerSupervisor()
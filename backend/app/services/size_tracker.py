@@ -0,0 +1,239 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+
+# inotify 事件掩码（见 <sys/inotify.h>）
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM
+    | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+# 无法使用inotify时的全量扫描间隔（秒）
+FALLBACK_SCAN_INTERVAL = 10.0
+
+
+class _Inotify:
+    """基于ctypes的最小inotify封装"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path: str) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def read_events(self) -> List[Tuple[int, int, str]]:
+        """读取所有待处理事件（非阻塞）"""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(data):
+                wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class DirectorySizeTracker:
+    """增量目录大小跟踪器
+
+    先做一次基线扫描，之后依据inotify事件只对发生变化的文件重新stat，
+    并定期用 os.scandir 全量对账兜底。所有方法都是同步阻塞的，
+    调用方应通过 run_in_executor 在事件循环之外执行。
+    """
+
+    def __init__(self, root: Path, reconcile_interval: float = 60.0):
+        self.root = str(root)
+        self.reconcile_interval = reconcile_interval
+        self.total_size = 0
+        self._sizes: Dict[str, int] = {}
+        self._dirty: Set[str] = set()
+        self._watches: Dict[int, str] = {}
+        self._watched_dirs: Set[str] = set()
+        self._inotify: Optional[_Inotify] = None
+        self._last_scan = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def watching(self) -> bool:
+        """是否处于inotify增量模式"""
+        return self._inotify is not None
+
+    def start(self) -> int:
+        """初始化监听并执行基线扫描，返回当前总大小"""
+        with self._lock:
+            try:
+                self._inotify = _Inotify()
+            except (OSError, AttributeError):
+                # 非Linux或inotify不可用，退化为定期扫描
+                self._inotify = None
+            self._scan()
+            return self.total_size
+
+    def refresh(self) -> int:
+        """应用自上次调用以来的变化，返回当前总大小"""
+        with self._lock:
+            if self._inotify is not None:
+                self._drain_events()
+                self._restat_dirty()
+                interval = self.reconcile_interval
+            else:
+                interval = min(self.reconcile_interval, FALLBACK_SCAN_INTERVAL)
+
+            if time.monotonic() - self._last_scan >= interval:
+                self._scan()
+            return self.total_size
+
+    def scan(self) -> int:
+        """强制全量对账，返回当前总大小"""
+        with self._lock:
+            self._scan()
+            return self.total_size
+
+    def close(self):
+        """释放inotify资源"""
+        with self._lock:
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
+            self._watches.clear()
+            self._watched_dirs.clear()
+
+    def _watch(self, directory: str):
+        if self._inotify is None or directory in self._watched_dirs:
+            return
+        try:
+            wd = self._inotify.add_watch(directory)
+        except OSError:
+            # 监听数量达到上限等情况：放弃增量模式，完全依赖对账
+            self._inotify.close()
+            self._inotify = None
+            self._watches.clear()
+            self._watched_dirs.clear()
+            return
+        self._watches[wd] = directory
+        self._watched_dirs.add(directory)
+
+    def _walk(self, top: str, sizes: Dict[str, int]):
+        """用scandir遍历目录树，记录文件大小并为子目录添加监听"""
+        stack = [top]
+        while stack:
+            directory = stack.pop()
+            self._watch(directory)
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False):
+                                sizes[entry.path] = entry.stat(follow_symlinks=False).st_size
+                        except OSError:
+                            pass
+            except OSError:
+                pass
+
+    def _scan(self):
+        sizes: Dict[str, int] = {}
+        if os.path.isdir(self.root):
+            self._walk(self.root, sizes)
+        self._sizes = sizes
+        self.total_size = sum(sizes.values())
+        self._dirty.clear()
+        self._last_scan = time.monotonic()
+
+    def _drain_events(self):
+        for wd, mask, name in self._inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                # 事件队列溢出，下一次refresh立即全量对账
+                self._last_scan = 0.0
+                continue
+            if mask & IN_IGNORED:
+                directory = self._watches.pop(wd, None)
+                if directory is not None:
+                    self._watched_dirs.discard(directory)
+                continue
+
+            directory = self._watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    added: Dict[str, int] = {}
+                    self._walk(path, added)
+                    for file_path, size in added.items():
+                        self.total_size += size - self._sizes.get(file_path, 0)
+                        self._sizes[file_path] = size
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._forget_tree(path)
+            else:
+                self._dirty.add(path)
+
+            if self._inotify is None:
+                # _walk中监听失败已降级
+                return
+
+    def _forget_tree(self, path: str):
+        prefix = path + os.sep
+        for file_path in [p for p in self._sizes if p.startswith(prefix)]:
+            self.total_size -= self._sizes.pop(file_path)
+        for wd in [w for w, d in self._watches.items() if d == path or d.startswith(prefix)]:
+            self._watched_dirs.discard(self._watches.pop(wd))
+
+    def _restat_dirty(self):
+        for path in self._dirty:
+            old_size = self._sizes.get(path, 0)
+            try:
+                new_size = os.stat(path, follow_symlinks=False).st_size
+            except OSError:
+                if path in self._sizes:
+                    del self._sizes[path]
+                    self.total_size -= old_size
+                continue
+            self._sizes[path] = new_size
+            self.total_size += new_size - old_size
+        self._dirty.clear()
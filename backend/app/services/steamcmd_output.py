@@ -0,0 +1,63 @@
+import asyncio
+import re
+from typing import AsyncIterator, NamedTuple, Optional
+
+
+# 例: " Update state (0x61) downloading, progress: 42.17 (3728104925 / 8840462218)"
+PROGRESS_PATTERN = re.compile(
+    r"Update state \((0x[0-9a-fA-F]+)\) ([\w ]+?), progress: "
+    r"([\d.]+) \((\d+) / (\d+)\)"
+)
+
+# 单行最大长度，防止异常输出导致缓冲区无限增长
+MAX_LINE_LENGTH = 64 * 1024
+
+
+class SteamCMDProgress(NamedTuple):
+    """SteamCMD进度行解析结果"""
+    state_code: str
+    state: str
+    progress: float
+    downloaded: int
+    total: int
+
+
+def parse_progress_line(line: str) -> Optional[SteamCMDProgress]:
+    """解析SteamCMD的进度输出行，非进度行返回None"""
+    match = PROGRESS_PATTERN.search(line)
+    if not match:
+        return None
+    state_code, state, progress, downloaded, total = match.groups()
+    return SteamCMDProgress(
+        state_code=state_code,
+        state=state.strip(),
+        progress=float(progress),
+        downloaded=int(downloaded),
+        total=int(total)
+    )
+
+
+async def iter_output_lines(stream: asyncio.StreamReader, chunk_size: int = 4096) -> AsyncIterator[str]:
+    """逐行读取SteamCMD输出
+
+    SteamCMD会用 \\r 刷新同一行进度，因此 \\r 和 \\n 都视为行结束。
+    只保留未完成的半行，不缓存完整输出。
+    """
+    pending = b""
+    while True:
+        chunk = await stream.read(chunk_size)
+        if not chunk:
+            break
+        pending += chunk
+        parts = re.split(rb"[\r\n]", pending)
+        pending = parts.pop()
+        if len(pending) > MAX_LINE_LENGTH:
+            pending = b""
+        for part in parts:
+            line = part.decode("utf-8", errors="replace").strip()
+            if line:
+                yield line
+
+    line = pending.decode("utf-8", errors="replace").strip()
+    if line:
+        yield line
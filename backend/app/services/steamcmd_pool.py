@@ -0,0 +1,236 @@
+import asyncio
+import re
+from pathlib import Path
+from typing import Dict, Any, Optional, List
+from app.services.steamcmd_output import iter_output_lines
+
+
+# 登录完成 / 失败标志
+LOGIN_OK_PATTERN = re.compile(r"Waiting for user info\.\.\.OK|Logged in OK")
+LOGIN_FAILED_PATTERN = re.compile(r"FAILED|Login Failure|Invalid Password")
+
+# 例: Success. Downloaded item 123456 to "/path/to/550/123456" (1024 bytes)
+DOWNLOAD_OK_PATTERN = re.compile(r'Success\. Downloaded item (\d+) to "([^"]*)" \((\d+) bytes\)')
+# 例: ERROR! Download item 123456 failed (Failure).
+DOWNLOAD_FAILED_PATTERN = re.compile(r"ERROR! Download item (\d+) failed \(([^)]*)\)")
+
+
+class SteamCMDSessionError(Exception):
+    """SteamCMD会话异常（登录失败、进程退出等）"""
+
+
+class SteamCMDSession:
+    """一个已登录的交互式SteamCMD进程"""
+
+    def __init__(self, steamcmd_path: Path, credentials: Dict[str, str]):
+        self.steamcmd_path = steamcmd_path
+        self.credentials = credentials
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self._lines = None
+        self.last_line = ""
+        # 被终止后立即标记，不依赖returncode（进程被回收前returncode仍为None）
+        self.closed = False
+
+    @property
+    def alive(self) -> bool:
+        return not self.closed and self.process is not None and self.process.returncode is None
+
+    def abort(self):
+        """立即结束进程（不等待退出），会话不能再使用"""
+        self.closed = True
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+
+    async def start(self, timeout: float):
+        """启动SteamCMD并等待登录完成"""
+        cmd = [str(self.steamcmd_path / "steamcmd.sh"), "+login"]
+        if self.credentials.get("username"):
+            cmd.extend([self.credentials["username"], self.credentials.get("password", "")])
+        else:
+            cmd.append("anonymous")
+
+        self.process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            cwd=str(self.steamcmd_path)
+        )
+        self._lines = iter_output_lines(self.process.stdout)
+
+        try:
+            await asyncio.wait_for(self._wait_for_login(), timeout=timeout)
+        except asyncio.TimeoutError:
+            await self.close()
+            raise SteamCMDSessionError("SteamCMD登录超时")
+        except SteamCMDSessionError:
+            await self.close()
+            raise
+        except BaseException:
+            # 被取消或其他异常：不能再await，直接结束进程（由调用方等待回收）
+            self.abort()
+            raise
+
+    async def _wait_for_login(self):
+        while True:
+            line = await self._next_line()
+            if LOGIN_OK_PATTERN.search(line):
+                return
+            if LOGIN_FAILED_PATTERN.search(line):
+                raise SteamCMDSessionError(f"SteamCMD登录失败: {line}")
+
+    async def _next_line(self) -> str:
+        try:
+            line = await self._lines.__anext__()
+        except StopAsyncIteration:
+            raise SteamCMDSessionError(f"SteamCMD进程已退出: {self.last_line}")
+        self.last_line = line
+        return line
+
+    async def download_item(self, workshop_id: str, timeout: float) -> Dict[str, Any]:
+        """在当前会话中下载一个创意工坊物品"""
+        try:
+            self.process.stdin.write(f"workshop_download_item 550 {workshop_id}\n".encode())
+            await self.process.stdin.drain()
+        except ConnectionError:
+            raise SteamCMDSessionError(f"SteamCMD进程已退出: {self.last_line}")
+
+        try:
+            return await asyncio.wait_for(self._wait_for_item(workshop_id), timeout=timeout)
+        except asyncio.TimeoutError:
+            # 会话状态未知，直接丢弃
+            await self.close()
+            return {
+                "success": False,
+                "workshop_id": workshop_id,
+                "error": "下载超时"
+            }
+        except asyncio.CancelledError:
+            # 任务被暂停/取消时会话仍在下载，结束进程以免被下一个请求复用
+            self.abort()
+            raise
+
+    async def reap(self):
+        """结束进程并等待其退出"""
+        self.abort()
+        if self.process is not None:
+            await self.process.wait()
+
+    async def _wait_for_item(self, workshop_id: str) -> Dict[str, Any]:
+        while True:
+            line = await self._next_line()
+
+            match = DOWNLOAD_OK_PATTERN.search(line)
+            if match and match.group(1) == workshop_id:
+                return {
+                    "success": True,
+                    "workshop_id": workshop_id,
+                    "path": match.group(2),
+                    "size": int(match.group(3)),
+                    "message": "下载成功"
+                }
+
+            match = DOWNLOAD_FAILED_PATTERN.search(line)
+            if match and match.group(1) == workshop_id:
+                return {
+                    "success": False,
+                    "workshop_id": workshop_id,
+                    "error": match.group(2)
+                }
+
+    async def close(self, timeout: float = 10):
+        """退出SteamCMD"""
+        if not self.alive:
+            return
+        self.closed = True
+        try:
+            self.process.stdin.write(b"quit\n")
+            await self.process.stdin.drain()
+            await asyncio.wait_for(self.process.wait(), timeout=timeout)
+        except (asyncio.TimeoutError, ConnectionError):
+            self.process.kill()
+            await self.process.wait()
+
+
+class SteamCMDSessionPool:
+    """SteamCMD会话池
+
+    维护最多 size 个常驻、只登录一次的SteamCMD进程，通过stdin下发
+    workshop_download_item 命令。并发请求会在空闲会话之间自动分批。
+    """
+
+    def __init__(
+        self,
+        steamcmd_path: Path,
+        credentials: Dict[str, str],
+        size: int,
+        login_timeout: float = 60,
+        download_timeout: float = 300
+    ):
+        self.steamcmd_path = steamcmd_path
+        self.credentials = credentials
+        self.size = size
+        self.login_timeout = login_timeout
+        self.download_timeout = download_timeout
+        self._slots = asyncio.Semaphore(size)
+        self._idle: List[SteamCMDSession] = []
+        # 被丢弃的会话进程，等待其退出
+        self._reaping = set()
+
+    async def _acquire(self) -> SteamCMDSession:
+        await self._slots.acquire()
+        while self._idle:
+            session = self._idle.pop()
+            if session.alive:
+                return session
+
+        # 没有可复用的会话，新建一个（每个名额最多一个进程）
+        session = SteamCMDSession(self.steamcmd_path, self.credentials)
+        try:
+            await session.start(self.login_timeout)
+        except BaseException:
+            # 登录失败或被取消：结束并回收已启动的进程后再释放名额，进程数不会超过size
+            self._release(session, reusable=False)
+            raise
+        return session
+
+    def _release(self, session: SteamCMDSession, reusable: bool):
+        """归还会话；下载没有正常结束（取消、异常）时会话状态未知，直接结束进程"""
+        if reusable and session.alive:
+            self._idle.append(session)
+        else:
+            session.abort()
+            reaper = asyncio.create_task(session.reap())
+            self._reaping.add(reaper)
+            reaper.add_done_callback(self._reaping.discard)
+        self._slots.release()
+
+    async def download_item(self, workshop_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """借用一个会话下载物品"""
+        try:
+            session = await self._acquire()
+        except SteamCMDSessionError as e:
+            return {
+                "success": False,
+                "workshop_id": workshop_id,
+                "error": str(e)
+            }
+
+        reusable = False
+        try:
+            result = await session.download_item(workshop_id, timeout or self.download_timeout)
+            reusable = True
+            return result
+        except SteamCMDSessionError as e:
+            return {
+                "success": False,
+                "workshop_id": workshop_id,
+                "error": str(e)
+            }
+        finally:
+            self._release(session, reusable)
+
+    async def close(self):
+        """关闭所有空闲会话，并等待被丢弃的会话进程退出"""
+        sessions, self._idle = self._idle, []
+        await asyncio.gather(*(s.close() for s in sessions), *self._reaping, return_exceptions=True)
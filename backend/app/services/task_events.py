@@ -0,0 +1,102 @@
+import asyncio
+from typing import Dict, Any, List, Optional, Set
+
+
+class TaskSubscription:
+    """单个订阅者（WebSocket/SSE连接）
+
+    待发送事件按任务ID合并：客户端处理较慢时只保留每个任务的最新状态，
+    不会无限堆积。
+    """
+
+    def __init__(self, bus: "TaskEventBus"):
+        self._bus = bus
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._ready = asyncio.Event()
+
+    def _push(self, event: Dict[str, Any]):
+        self._pending[event["task"]["task_id"]] = event
+        self._ready.set()
+
+    async def get(self, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """等待并取出所有待发送事件（按序号排序），超时返回空列表"""
+        if not self._pending:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                return []
+        events = sorted(self._pending.values(), key=lambda e: e["seq"])
+        self._pending.clear()
+        self._ready.clear()
+        return events
+
+    def close(self):
+        self._bus.unsubscribe(self)
+
+
+class TaskEventBus:
+    """下载任务状态的发布/订阅总线
+
+    任务状态变化时只做标记，每个合并周期内每个任务最多推送一次。
+    每条事件带递增序号，总线保留每个任务最新的一条事件，
+    客户端断线重连时带上最后收到的序号即可补齐错过的状态。
+    """
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.seq = 0
+        self._dirty: Dict[str, Any] = {}
+        self._latest: Dict[str, Dict[str, Any]] = {}
+        self._subscribers: Set[TaskSubscription] = set()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def publish(self, task):
+        """标记任务状态已变化（需在事件循环线程中调用）"""
+        self._dirty[task.task_id] = task
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 没有事件循环时留到下次发布或订阅时再推送
+            return
+        self._flush_handle = loop.call_later(self.interval, self.flush)
+
+    def flush(self):
+        """把已标记的任务状态生成事件并推送给所有订阅者"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        dirty, self._dirty = self._dirty, {}
+        for task_id, task in dirty.items():
+            self.seq += 1
+            event = {"seq": self.seq, "task": task.to_dict()}
+            self._latest[task_id] = event
+            for subscriber in self._subscribers:
+                subscriber._push(event)
+
+    def forget(self, task_id: str):
+        """任务被移除后不再保留其事件"""
+        self._dirty.pop(task_id, None)
+        self._latest.pop(task_id, None)
+
+    def subscribe(self, since: int = 0) -> TaskSubscription:
+        """订阅任务事件，since为客户端最后收到的序号（0表示全量）"""
+        if self._dirty:
+            self.flush()
+        if since > self.seq:
+            # 序号比当前还大说明服务已重启，按全量重新同步
+            since = 0
+        subscription = TaskSubscription(self)
+        for event in self._latest.values():
+            if event["seq"] > since:
+                subscription._push(event)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: TaskSubscription):
+        self._subscribers.discard(subscription)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
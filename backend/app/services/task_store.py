@@ -0,0 +1,204 @@
+import asyncio
+import json
+import threading
+from typing import Dict, Any, List, Optional
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from app.core.database import SessionLocal
+from app.models.mod import DownloadTask as DownloadTaskRecord, WorkshopItem
+
+# 需要持久化的任务字段
+PERSISTED_FIELDS = (
+    "status", "progress", "message", "total_size", "downloaded_size",
+    "pid", "start_time", "end_time", "priority"
+)
+
+# 单条IN查询包含的最大参数数（SQLite默认上限为999）
+IN_QUERY_BATCH = 500
+
+# 未结束的任务状态（downloading为旧版本创意工坊任务使用的状态名）
+ACTIVE_STATUSES = ("pending", "running", "paused", "downloading")
+
+
+class TaskStore:
+    """下载任务的数据库持久化
+
+    创建任务时立即插入一行以获得ID；之后的进度变化只在内存中标记，
+    由后台定时任务合并为一次批量UPDATE写入，避免每次进度刷新都提交事务。
+    同步方法会阻塞调用线程，在事件循环中通过 *_async 方法放到线程池执行。
+    """
+
+    def __init__(self, flush_interval: float = 5):
+        self.flush_interval = flush_interval
+        self._dirty: Dict[int, Any] = {}
+        self._lock = threading.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _values(task) -> Dict[str, Any]:
+        values = {field: getattr(task, field) for field in PERSISTED_FIELDS}
+        values["error_message"] = task.message if task.status == "failed" else None
+        return values
+
+    def insert(self, task) -> int:
+        """插入任务记录并返回数据库ID"""
+        self.insert_many([task])
+        return task.db_id
+
+    def insert_many(self, tasks: List[Any], db: Optional[Session] = None):
+        """在一个事务中批量插入任务记录并回填db_id
+
+        传入db时使用调用方的会话，会话中的其他变更随同一次提交写入。
+        """
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        try:
+            if tasks:
+                # executemany插入（ORM逐行INSERT以取回自增ID），再按task_key一次查回ID
+                db.execute(insert(DownloadTaskRecord), [
+                    {
+                        "task_key": task.task_id,
+                        "task_type": task.task_type,
+                        "description": task.description,
+                        "workshop_item_id": task.workshop_item_id,
+                        "user_id": task.user_id,
+                        "payload": json.dumps(task.payload) if task.payload else None,
+                        **self._values(task)
+                    }
+                    for task in tasks
+                ])
+                ids = {}
+                keys = [task.task_id for task in tasks]
+                for i in range(0, len(keys), IN_QUERY_BATCH):
+                    ids.update(db.query(DownloadTaskRecord.task_key, DownloadTaskRecord.id).filter(
+                        DownloadTaskRecord.task_key.in_(keys[i:i + IN_QUERY_BATCH])
+                    ).all())
+                for task in tasks:
+                    task.db_id = ids[task.task_id]
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            if own_session:
+                db.close()
+
+    async def insert_many_async(self, tasks: List[Any]):
+        """在线程池中批量插入任务记录"""
+        await asyncio.get_running_loop().run_in_executor(None, self.insert_many, tasks)
+
+    def mark_dirty(self, task):
+        if task.db_id is not None:
+            with self._lock:
+                self._dirty[task.db_id] = task
+
+    def flush(self) -> int:
+        """把所有已标记的任务一次性写入数据库，返回写入条数"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return 0
+
+        mappings = [{"id": db_id, **self._values(task)} for db_id, task in dirty.items()]
+        db = SessionLocal()
+        try:
+            db.bulk_update_mappings(DownloadTaskRecord, mappings)
+            db.commit()
+        except Exception:
+            db.rollback()
+            # 写入失败时放回，下个周期重试（期间更新过的任务以新状态为准）
+            with self._lock:
+                for db_id, task in dirty.items():
+                    self._dirty.setdefault(db_id, task)
+            raise
+        finally:
+            db.close()
+        return len(mappings)
+
+    def load_recent(self, finished_limit: int) -> List[DownloadTaskRecord]:
+        """读取所有未结束的任务和最近的finished_limit个已结束任务（启动恢复用）"""
+        db = SessionLocal()
+        try:
+            self._migrate_legacy(db)
+            active = db.query(DownloadTaskRecord).filter(
+                DownloadTaskRecord.status.in_(ACTIVE_STATUSES)
+            ).all()
+            finished = db.query(DownloadTaskRecord).filter(
+                DownloadTaskRecord.status.notin_(ACTIVE_STATUSES)
+            ).order_by(DownloadTaskRecord.id.desc()).limit(finished_limit).all()
+            return sorted(active + finished, key=lambda record: record.id)
+        finally:
+            db.close()
+
+    @staticmethod
+    def _migrate_legacy(db: Session):
+        """旧版本的创意工坊任务记录没有task_type和payload
+
+        未结束的旧记录按workshop_item_id补上物品的workshop_id后继续执行；
+        找不到对应物品的无法下载，标记为失败。
+        """
+        legacy = db.query(DownloadTaskRecord).filter(
+            DownloadTaskRecord.task_type.is_(None),
+            DownloadTaskRecord.payload.is_(None),
+            DownloadTaskRecord.status.in_(ACTIVE_STATUSES)
+        ).all()
+        if not legacy:
+            return
+        item_ids = sorted({record.workshop_item_id for record in legacy if record.workshop_item_id is not None})
+        workshop_ids = {}
+        for i in range(0, len(item_ids), IN_QUERY_BATCH):
+            workshop_ids.update(db.query(WorkshopItem.id, WorkshopItem.workshop_id).filter(
+                WorkshopItem.id.in_(item_ids[i:i + IN_QUERY_BATCH])
+            ).all())
+        for record in legacy:
+            record.task_type = "workshop"
+            workshop_id = workshop_ids.get(record.workshop_item_id)
+            if workshop_id:
+                record.payload = json.dumps({"workshop_id": workshop_id})
+                record.description = record.description or f"下载创意工坊物品 {workshop_id}"
+            else:
+                record.status = "failed"
+                record.error_message = "旧版本创建的下载任务找不到对应的创意工坊物品，请重新下载"
+        db.commit()
+
+    def find_unflushed(self, task_key: str):
+        """查找尚未写入数据库的任务对象"""
+        with self._lock:
+            for task in self._dirty.values():
+                if task.task_id == task_key:
+                    return task
+        return None
+
+    def load(self, task_key: str) -> Optional[DownloadTaskRecord]:
+        db = SessionLocal()
+        try:
+            return db.query(DownloadTaskRecord).filter(DownloadTaskRecord.task_key == task_key).first()
+        finally:
+            db.close()
+
+    async def load_async(self, task_key: str) -> Optional[DownloadTaskRecord]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.load, task_key)
+
+    async def load_recent_async(self, finished_limit: int) -> List[DownloadTaskRecord]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.load_recent, finished_limit)
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """停止定时写入，并把剩余的变更写入数据库"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await loop.run_in_executor(None, self.flush)
+            except Exception as e:
+                print(f"保存下载任务失败: {str(e)}")
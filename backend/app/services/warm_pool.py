@@ -0,0 +1,208 @@
+import asyncio
+import secrets
+import time
+from typing import Optional, Dict, Any, List
+from app.core.config import settings
+from app.core.console import console_config
+from app.services.rcon import RconClient, RconError
+from app.services.server_manager import ServerInstance, ServerSupervisor, server_supervisor
+
+
+class WarmServerPool:
+    """预热srcds实例池
+
+    预先启动若干停在大厅地图上的空闲srcds实例。创建房间时直接认领一个，
+    通过RCON切换地图和模式，而不是冷启动进程；被认领后在后台补充。
+    """
+
+    def __init__(self, supervisor: ServerSupervisor):
+        self.supervisor = supervisor
+        self.ready: List[ServerInstance] = []
+        self.warming = 0
+        self.metrics = {"hits": 0, "misses": 0, "spawned": 0, "spawn_failures": 0}
+        self._refill_event = asyncio.Event()
+        self._refill_task: Optional[asyncio.Task] = None
+
+    @property
+    def size(self) -> int:
+        return settings.warm_pool_size
+
+    def start(self):
+        """启动后台补充循环"""
+        if self.size > 0 and self._refill_task is None:
+            self._refill_task = asyncio.create_task(self._refill_loop())
+
+    async def close(self):
+        """停止补充并关闭所有空闲实例"""
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            self._refill_task = None
+        instances, self.ready = self.ready, []
+        for instance in instances:
+            self._forget(instance)
+        await asyncio.gather(
+            *(instance.terminate() for instance in instances if instance.running),
+            return_exceptions=True
+        )
+
+    def get_metrics(self) -> Dict[str, Any]:
+        claims = self.metrics["hits"] + self.metrics["misses"]
+        return {
+            **self.metrics,
+            "hit_rate": self.metrics["hits"] / claims if claims else None,
+            "size": self.size,
+            "ready": len(self.ready),
+            "warming": self.warming
+        }
+
+    async def claim(self, server_id: int, config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """为服务器认领一个预热实例，没有可用实例时返回None（由调用方冷启动）"""
+        try:
+            config = console_config(config)
+        except ValueError as e:
+            return {
+                "success": False,
+                "message": f"房间配置无效: {str(e)}"
+            }
+
+        if self.supervisor.files_updating():
+            return {
+                "success": False,
+                "message": "服务器文件正在更新，请在更新完成后再创建"
+            }
+
+        instance = self._pop_ready(config.get("max_players", 8))
+        if instance is None:
+            self.metrics["misses"] += 1
+            return None
+
+        try:
+            rcon_password = await self._apply_config(instance, config)
+            self.supervisor.adopt(server_id, instance)
+        except (RconError, RuntimeError, ValueError):
+            self.metrics["misses"] += 1
+            self._forget(instance)
+            if instance.running:
+                await instance.terminate()
+            return None
+        finally:
+            self._refill_event.set()
+
+        self.metrics["hits"] += 1
+        return {
+            "success": True,
+            "message": "已分配预热服务器",
+            "pid": instance.process.pid,
+            "port": instance.port,
+            "rcon_password": rcon_password
+        }
+
+    def _pop_ready(self, max_players: int) -> Optional[ServerInstance]:
+        for instance in list(self.ready):
+            if not instance.running:
+                self.ready.remove(instance)
+                self._forget(instance)
+                continue
+            # maxplayers只能在启动时指定
+            if instance.config.get("max_players", 8) >= max_players:
+                self.ready.remove(instance)
+                return instance
+        return None
+
+    async def _apply_config(self, instance: ServerInstance, config: Dict[str, Any]) -> str:
+        """通过RCON把空闲实例切换为房间配置，返回最终的RCON密码"""
+        # 不信任调用方：所有拼接进命令的值在这里再校验一次
+        config = console_config(config)
+        rcon_password = config.get("rcon_password") or instance.config["rcon_password"]
+        commands = [f'mp_gamemode "{config.get("game_mode", "coop")}"']
+        if config.get("difficulty"):
+            commands.append(f'z_difficulty "{config["difficulty"]}"')
+        commands.append(f'sv_password "{config.get("password") or ""}"')
+        if rcon_password != instance.config["rcon_password"]:
+            commands.append(f'rcon_password "{rcon_password}"')
+        commands.append(f'changelevel {config.get("current_map", "c1m1_hotel")}')
+
+        client = RconClient(instance.rcon_host, instance.port, instance.config["rcon_password"])
+        try:
+            await client.execute_many(commands)
+        finally:
+            await client.close()
+
+        # 崩溃重启时使用房间配置
+        instance.config.update({
+            key: value for key, value in config.items()
+            if key not in ("port", "max_players") and value is not None
+        })
+        instance.config["rcon_password"] = rcon_password
+        return rcon_password
+
+    def _forget(self, instance: ServerInstance):
+        if instance in self.supervisor.warm_instances:
+            self.supervisor.warm_instances.remove(instance)
+
+    async def _refill_loop(self):
+        while True:
+            # 已退出的空闲实例（崩溃或因服务器更新被停止）不再计入
+            for instance in [instance for instance in self.ready if not instance.running]:
+                self.ready.remove(instance)
+                self._forget(instance)
+            missing = self.size - len(self.ready) - self.warming
+            # 服务器文件更新期间不启动新实例，更新结束后的下一次检查再补充
+            if missing > 0 and not self.supervisor.files_updating():
+                await asyncio.gather(*(self._warm_one() for _ in range(missing)))
+            self._refill_event.clear()
+            try:
+                await asyncio.wait_for(self._refill_event.wait(), timeout=settings.warm_pool_check_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _warm_one(self):
+        self.warming += 1
+        instance = ServerInstance(None, self.supervisor.server_path)
+        instance.config = {
+            "max_players": settings.warm_pool_max_players,
+            "current_map": settings.warm_pool_lobby_map,
+            "game_mode": "coop",
+            "rcon_password": secrets.token_urlsafe(16)
+        }
+        try:
+            instance.port = self.supervisor.allocate_port(None)
+            instance.desired_running = True
+            self.supervisor.warm_instances.append(instance)
+            await instance.spawn()
+            self.metrics["spawned"] += 1
+
+            if await self._wait_ready(instance) and not self.supervisor.files_updating():
+                self.ready.append(instance)
+                return
+
+            self.metrics["spawn_failures"] += 1
+            self._forget(instance)
+            if instance.running:
+                await instance.terminate()
+        except Exception:
+            self.metrics["spawn_failures"] += 1
+            self._forget(instance)
+            instance.desired_running = False
+        finally:
+            self.warming -= 1
+
+    async def _wait_ready(self, instance: ServerInstance) -> bool:
+        """地图加载完成后RCON才会响应，以此作为就绪判断"""
+        deadline = time.monotonic() + settings.warm_pool_ready_timeout
+        client = RconClient(instance.rcon_host, instance.port, instance.config["rcon_password"])
+        try:
+            # 启动期间开始了服务器文件更新时放弃该实例
+            while time.monotonic() < deadline and instance.running and not self.supervisor.files_updating():
+                try:
+                    await client.execute("status")
+                    return True
+                except RconError:
+                    await asyncio.sleep(1)
+            return False
+        finally:
+            await client.close()
+
+
+# 全局预热池实例
+warm_pool = WarmServerPool(server_supervisor)
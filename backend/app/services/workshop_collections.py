@@ -0,0 +1,172 @@
+from typing import Dict, List, Set, Iterable
+from app.services.workshop_metadata import WorkshopMetadataService
+
+
+class WorkshopGraph:
+    """展开后的下载图：物品按依赖关系分层，同一层内的物品互不依赖，可以并行下载"""
+
+    def __init__(self):
+        self.collections: List[str] = []
+        self.requires: Dict[str, List[str]] = {}
+        self.levels: List[List[str]] = []
+        # 合集嵌套环（如 A 包含 B、B 又包含 A）和必需物品之间的环
+        self.cycles: List[List[str]] = []
+
+    @property
+    def items(self) -> List[str]:
+        """拓扑序：每个物品都排在它的必需物品之后"""
+        return [workshop_id for level in self.levels for workshop_id in level]
+
+
+def _find_path(parents: Dict[str, str], start: str, target: str) -> List[str]:
+    """沿展开时记录的父合集回溯，返回 target -> ... -> start 的路径（target不是祖先时为空）"""
+    path = [start]
+    node = start
+    while node in parents:
+        node = parents[node]
+        path.append(node)
+        if node == target:
+            return list(reversed(path))
+    return []
+
+
+def _strongly_connected(nodes: List[str], edges: Dict[str, List[str]]) -> List[List[str]]:
+    """Tarjan算法（迭代实现，避免依赖链过长时递归溢出），返回包含多个物品的强连通分量，即依赖环"""
+    index: Dict[str, int] = {}
+    lowlink: Dict[str, int] = {}
+    stack: List[str] = []
+    on_stack: Set[str] = set()
+    components: List[List[str]] = []
+
+    for root in nodes:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(edges.get(root, [])))]
+        while work:
+            node, successors = work[-1]
+            for successor in successors:
+                if successor not in index:
+                    index[successor] = lowlink[successor] = len(index)
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(edges.get(successor, []))))
+                    break
+                if successor in on_stack:
+                    lowlink[node] = min(lowlink[node], index[successor])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1:
+                        components.append(sorted(component))
+    return components
+
+
+def _layer(graph: WorkshopGraph, items: Iterable[str]):
+    """Kahn算法分层
+
+    环上的物品之间无法满足依赖：只去掉每个环内部的边，环作为一个整体排在它的所有成员
+    依赖的物品之后，依赖环中任一物品的物品排在整个环之后。
+    """
+    items = list(items)
+    item_set = set(items)
+    edges = {
+        workshop_id: [required for required in graph.requires.get(workshop_id, []) if required in item_set]
+        for workshop_id in items
+    }
+
+    # 每个物品所属的分组：环上的物品合并为一组，其余物品单独一组
+    group_of = {workshop_id: workshop_id for workshop_id in items}
+    members: Dict[str, List[str]] = {workshop_id: [workshop_id] for workshop_id in items}
+    for cycle in _strongly_connected(items, edges):
+        graph.cycles.append(cycle)
+        cycle_set = set(cycle)
+        for workshop_id in cycle:
+            graph.requires[workshop_id] = [
+                required for required in graph.requires.get(workshop_id, []) if required not in cycle_set
+            ]
+            group_of[workshop_id] = cycle[0]
+            if workshop_id != cycle[0]:
+                del members[workshop_id]
+        members[cycle[0]] = [workshop_id for workshop_id in items if workshop_id in cycle_set]
+
+    remaining = {
+        group: {group_of[required] for member in group_members for required in edges[member]} - {group}
+        for group, group_members in members.items()
+    }
+    while remaining:
+        ready = [group for group, requires in remaining.items() if not requires]
+        graph.levels.append([workshop_id for group in ready for workshop_id in members[group]])
+        for group in ready:
+            del remaining[group]
+        for requires in remaining.values():
+            requires.difference_update(ready)
+
+
+async def resolve(
+    metadata: WorkshopMetadataService,
+    collection_ids: List[str],
+    workshop_ids: List[str],
+    include_required: bool = True
+) -> WorkshopGraph:
+    """递归展开合集并解析必需物品
+
+    每一轮把当前层的所有合集/物品合并成批量请求；子项查询结果有缓存，
+    重复展开同一合集不会再次请求Steam。
+    """
+    graph = WorkshopGraph()
+    items: Dict[str, None] = dict.fromkeys(workshop_ids)
+
+    # 逐层展开合集，已展开过的合集跳过（同时处理菱形引用和嵌套环）
+    expanded: Set[str] = set()
+    parents: Dict[str, str] = {}
+    frontier = list(dict.fromkeys(collection_ids))
+    while frontier:
+        expanded.update(frontier)
+        graph.collections.extend(frontier)
+        children = await metadata.get_children(frontier)
+        next_frontier = []
+        for collection_id in frontier:
+            for child in children.get(collection_id, []):
+                child_id = child["workshop_id"]
+                if not child["is_collection"]:
+                    items.setdefault(child_id)
+                elif child_id in expanded or child_id in next_frontier:
+                    cycle = _find_path(parents, collection_id, child_id)
+                    if cycle:
+                        graph.cycles.append(cycle + [child_id])
+                else:
+                    parents[child_id] = collection_id
+                    next_frontier.append(child_id)
+        frontier = next_frontier
+
+    # 逐层解析必需物品，新发现的必需物品在下一轮继续解析
+    frontier = list(items) if include_required else []
+    resolved: Set[str] = set()
+    while frontier:
+        resolved.update(frontier)
+        children = await metadata.get_children(frontier)
+        next_frontier = []
+        for workshop_id in frontier:
+            required = [child["workshop_id"] for child in children.get(workshop_id, []) if not child["is_collection"]]
+            graph.requires[workshop_id] = [required_id for required_id in required if required_id != workshop_id]
+            for required_id in graph.requires[workshop_id]:
+                items.setdefault(required_id)
+                if required_id not in resolved and required_id not in next_frontier:
+                    next_frontier.append(required_id)
+        frontier = next_frontier
+
+    _layer(graph, items)
+    return graph
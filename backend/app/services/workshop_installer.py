@@ -0,0 +1,251 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, Iterable, List, Optional, Set
+from app.services.blob_store import BlobStore
+from app.services.file_linker import place_file
+
+
+class WorkshopInstaller:
+    """创意工坊物品安装器
+
+    workshop/content/550/<id> 下的文件先存入按内容寻址的BlobStore，
+    再从blob reflink到游戏目录（不支持reflink时硬链接，见 place_file），相同内容只占一份磁盘。
+    每次安装都会记录清单（含Steam上的time_updated，用于增量同步），卸载时只删除清单中的文件；
+    多个物品安装了同一路径时，只有最后一个引用它的物品被卸载才删除该文件。
+    """
+
+    def __init__(self, game_dir: Path, manifest_dir: Path, blob_store: BlobStore):
+        self.game_dir = game_dir
+        self.addons_dir = game_dir / "addons"
+        self.manifest_dir = manifest_dir
+        self.blob_store = blob_store
+        # 路径 -> 清单中包含该路径的物品，首次使用时从清单目录建立
+        self._path_owners: Optional[Dict[str, Set[str]]] = None
+        self._owners_lock = threading.Lock()
+
+    def install(self, workshop_id: str, source_dir: Path, time_updated: Optional[int] = None) -> Dict[str, Any]:
+        """安装物品，返回安装统计；time_updated为所安装版本在Steam上的更新时间"""
+        # 写入清单之前新增的blob还没有被引用，安装期间不允许gc
+        with self.blob_store.installing():
+            return self._install(workshop_id, source_dir, time_updated)
+
+    def _install(self, workshop_id: str, source_dir: Path, time_updated: Optional[int]) -> Dict[str, Any]:
+        if not source_dir.is_dir():
+            raise FileNotFoundError(f"创意工坊目录不存在: {source_dir}")
+
+        previous = self.get_manifest(workshop_id)
+        files: List[Dict[str, Any]] = []
+        created_dirs: List[str] = []
+        methods = {"hardlink": 0, "reflink": 0, "copy": 0}
+        total_bytes = 0
+        new_blob_bytes = 0
+
+        for src in sorted(p for p in source_dir.rglob("*") if p.is_file()):
+            dest = self._target_for(src.relative_to(source_dir))
+            rel = str(dest.relative_to(self.game_dir))
+            digest, is_new = self.blob_store.add(src)
+            self._make_parents(dest.parent, created_dirs)
+            shared = self._shared_entry(workshop_id, rel, digest)
+            if shared:
+                # 其他物品已安装了内容相同的文件，直接共用
+                method = shared["method"]
+            else:
+                method = place_file(self.blob_store.blob_path(digest), dest, prefer_reflink=True)
+            st = dest.stat()
+            methods[method] += 1
+            total_bytes += st.st_size
+            if is_new:
+                new_blob_bytes += st.st_size
+            files.append({
+                "path": rel,
+                "digest": digest,
+                "inode": st.st_ino,
+                "size": st.st_size,
+                "method": method
+            })
+
+        # 重新安装时删除新版本中已不存在的旧文件
+        if previous:
+            current = {f["path"] for f in files}
+            stale = [f for f in previous["files"] if f["path"] not in current]
+            self._remove_files(workshop_id, stale)
+            created_dirs = list(dict.fromkeys(previous.get("dirs", []) + created_dirs))
+
+        self._write_manifest(workshop_id, {
+            "workshop_id": workshop_id,
+            "source": str(source_dir),
+            "installed_at": time.time(),
+            "time_updated": time_updated,
+            "files": files,
+            "dirs": created_dirs
+        })
+
+        return {
+            "files": len(files),
+            "bytes": total_bytes,
+            "new_blob_bytes": new_blob_bytes,
+            "methods": methods
+        }
+
+    def uninstall(self, workshop_id: str) -> int:
+        """按清单卸载物品，返回删除的文件数"""
+        manifest = self.get_manifest(workshop_id)
+        if not manifest:
+            return 0
+
+        removed = self._remove_files(workshop_id, manifest["files"])
+        # 只清理安装时新建且已为空的目录，从深到浅
+        for rel in sorted(manifest.get("dirs", []), key=len, reverse=True):
+            try:
+                os.rmdir(self.game_dir / rel)
+            except OSError:
+                pass
+
+        self._manifest_path(workshop_id).unlink(missing_ok=True)
+        self._set_owned_paths(workshop_id, set())
+        return removed
+
+    def missing_files(self, manifest: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """清单中已不在游戏目录里的文件（只做stat，不读文件内容）"""
+        missing = []
+        for entry in manifest["files"]:
+            try:
+                os.stat(self.game_dir / entry["path"], follow_symlinks=False)
+            except FileNotFoundError:
+                missing.append(entry)
+        return missing
+
+    def repair(self, workshop_id: str) -> int:
+        """从blob重新链接缺失的文件，不需要重新下载；返回修复的文件数
+
+        blob已被清理时抛出FileNotFoundError，需要重新下载。
+        """
+        manifest = self.get_manifest(workshop_id)
+        if not manifest:
+            raise FileNotFoundError(f"物品 {workshop_id} 没有安装清单")
+
+        missing = self.missing_files(manifest)
+        if any(not entry.get("digest") or not self.blob_store.has(entry["digest"]) for entry in missing):
+            raise FileNotFoundError(f"物品 {workshop_id} 的部分文件已不在blob存储中")
+
+        created_dirs = list(manifest.get("dirs", []))
+        for entry in missing:
+            dest = self.game_dir / entry["path"]
+            self._make_parents(dest.parent, created_dirs)
+            entry["method"] = place_file(self.blob_store.blob_path(entry["digest"]), dest, prefer_reflink=True)
+            entry["inode"] = dest.stat().st_ino
+        if missing:
+            manifest["dirs"] = list(dict.fromkeys(created_dirs))
+            self._write_manifest(workshop_id, manifest)
+        return len(missing)
+
+    def set_version(self, workshop_id: str, time_updated: int):
+        """为没有记录版本的清单补写time_updated"""
+        manifest = self.get_manifest(workshop_id)
+        if manifest and manifest.get("time_updated") is None:
+            manifest["time_updated"] = time_updated
+            self._write_manifest(workshop_id, manifest)
+
+    def get_manifest(self, workshop_id: str) -> Optional[Dict[str, Any]]:
+        """读取物品的安装清单"""
+        path = self._manifest_path(workshop_id)
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def referenced_digests(self, workshop_ids: Iterable[str]) -> Set[str]:
+        """汇总指定物品清单中引用的blob"""
+        digests = set()
+        for workshop_id in workshop_ids:
+            manifest = self.get_manifest(workshop_id)
+            if manifest:
+                digests.update(f["digest"] for f in manifest["files"] if f.get("digest"))
+        return digests
+
+    def _manifest_path(self, workshop_id: str) -> Path:
+        return self.manifest_dir / f"{workshop_id}.json"
+
+    def _write_manifest(self, workshop_id: str, manifest: Dict[str, Any]):
+        self.manifest_dir.mkdir(parents=True, exist_ok=True)
+        path = self._manifest_path(workshop_id)
+        tmp = path.with_suffix(".json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, path)
+        self._set_owned_paths(workshop_id, {f["path"] for f in manifest["files"]})
+
+    def _owners(self) -> Dict[str, Set[str]]:
+        # 调用方需持有 _owners_lock
+        if self._path_owners is None:
+            owners: Dict[str, Set[str]] = {}
+            for path in self.manifest_dir.glob("*.json"):
+                manifest = self.get_manifest(path.stem)
+                for entry in (manifest or {}).get("files", []):
+                    owners.setdefault(entry["path"], set()).add(path.stem)
+            self._path_owners = owners
+        return self._path_owners
+
+    def _other_owners(self, workshop_id: str, rel: str) -> Set[str]:
+        with self._owners_lock:
+            return self._owners().get(rel, set()) - {workshop_id}
+
+    def _set_owned_paths(self, workshop_id: str, paths: Set[str]):
+        with self._owners_lock:
+            owners = self._owners()
+            for rel in list(owners):
+                if rel not in paths and workshop_id in owners[rel]:
+                    owners[rel].discard(workshop_id)
+                    if not owners[rel]:
+                        del owners[rel]
+            for rel in paths:
+                owners.setdefault(rel, set()).add(workshop_id)
+
+    def _shared_entry(self, workshop_id: str, rel: str, digest: str) -> Optional[Dict[str, Any]]:
+        """其他物品在该路径安装的、内容相同且仍在原位的文件条目"""
+        try:
+            inode = os.stat(self.game_dir / rel, follow_symlinks=False).st_ino
+        except FileNotFoundError:
+            return None
+        for owner in self._other_owners(workshop_id, rel):
+            manifest = self.get_manifest(owner) or {"files": []}
+            for entry in manifest["files"]:
+                if entry["path"] == rel and entry.get("digest") == digest and entry["inode"] == inode:
+                    return entry
+        return None
+
+    def _target_for(self, relative: Path) -> Path:
+        # 顶层的vpk放进addons目录，其他内容（插件等）保持原有目录结构
+        if len(relative.parts) == 1 and relative.suffix.lower() == ".vpk":
+            return self.addons_dir / relative
+        return self.game_dir / relative
+
+    def _make_parents(self, directory: Path, created_dirs: List[str]):
+        missing = []
+        while not directory.exists():
+            missing.append(directory)
+            directory = directory.parent
+        for path in reversed(missing):
+            path.mkdir(exist_ok=True)
+            created_dirs.append(str(path.relative_to(self.game_dir)))
+
+    def _remove_files(self, workshop_id: str, files: List[Dict[str, Any]]) -> int:
+        removed = 0
+        for entry in files:
+            # 其他物品也安装了该路径，保留给它们
+            if self._other_owners(workshop_id, entry["path"]):
+                continue
+            path = self.game_dir / entry["path"]
+            try:
+                # inode不一致说明文件已被其他安装覆盖，不能删除
+                if os.stat(path, follow_symlinks=False).st_ino != entry["inode"]:
+                    continue
+                os.unlink(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
@@ -0,0 +1,185 @@
+import asyncio
+import time
+from typing import Dict, Any, List, Optional, Tuple
+import httpx
+from app.core.config import settings
+from sqlalchemy import select
+from app.core.database import AsyncSessionLocal
+from app.models.mod import WorkshopItem
+from app.services.task_store import IN_QUERY_BATCH
+
+# GetPublishedFileDetails单次最多查询的物品数
+DETAILS_BATCH_SIZE = 100
+
+# Steam EResult: 1 = OK
+RESULT_OK = 1
+
+# GetCollectionDetails子项的filetype：2为合集（EWorkshopFileType.Collection），其余为普通物品
+FILE_TYPE_COLLECTION = 2
+
+# 带有这些标签的物品按地图处理
+MAP_TAGS = {"Campaigns"}
+
+
+def parse_details(entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """把GetPublishedFileDetails返回的单个物品转换为WorkshopItem字段，物品不存在时返回None"""
+    if entry.get("result") != RESULT_OK:
+        return None
+    tags = {tag.get("tag") for tag in entry.get("tags", [])}
+    return {
+        "workshop_id": str(entry["publishedfileid"]),
+        "title": entry.get("title") or f"Workshop Item {entry['publishedfileid']}",
+        "description": entry.get("description"),
+        "author": entry.get("creator"),
+        "preview_url": entry.get("preview_url"),
+        # 新版API中file_size为字符串
+        "file_size": int(entry.get("file_size") or 0) or None,
+        "item_type": "map" if tags & MAP_TAGS else "mod",
+        "time_updated": entry.get("time_updated")
+    }
+
+
+class WorkshopMetadataService:
+    """创意工坊物品元数据
+
+    通过 ISteamRemoteStorage/GetPublishedFileDetails 每次最多查询100个物品，
+    结果在内存中缓存cache_ttl秒；写入数据库时以Steam的time_updated判断物品是否变化，
+    未变化的物品不重复写入。http_client和api_url可替换为本地的假API用于测试。
+    """
+
+    def __init__(
+        self,
+        http_client: Optional[httpx.AsyncClient] = None,
+        api_url: Optional[str] = None,
+        cache_ttl: Optional[float] = None,
+        max_concurrent: int = 4
+    ):
+        self.api_url = (api_url or settings.steam_web_api_url).rstrip("/")
+        self.cache_ttl = settings.workshop_metadata_ttl if cache_ttl is None else cache_ttl
+        self._client = http_client
+        self._owns_client = http_client is None
+        self._cache: Dict[str, Tuple[float, Optional[Dict[str, Any]]]] = {}
+        self._children_cache: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+        self._batch_slots = asyncio.Semaphore(max_concurrent)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=settings.workshop_metadata_timeout)
+        return self._client
+
+    async def close(self):
+        if self._client is not None and self._owns_client:
+            await self._client.aclose()
+            self._client = None
+
+    async def _post(self, path: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        async with self._batch_slots:
+            response = await self.client.post(f"{self.api_url}{path}", data=data)
+        response.raise_for_status()
+        return response.json().get("response", {})
+
+    async def _fetch_batch(self, workshop_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        data = {"itemcount": len(workshop_ids)}
+        for i, workshop_id in enumerate(workshop_ids):
+            data[f"publishedfileids[{i}]"] = workshop_id
+        response = await self._post("/ISteamRemoteStorage/GetPublishedFileDetails/v1/", data)
+
+        details = {workshop_id: None for workshop_id in workshop_ids}
+        for entry in response.get("publishedfiledetails", []):
+            details[str(entry.get("publishedfileid"))] = parse_details(entry)
+        return details
+
+    async def get_details(self, workshop_ids: List[str], refresh: bool = False) -> Dict[str, Optional[Dict[str, Any]]]:
+        """获取物品元数据（不存在的物品为None），未缓存或已过期的按100个一批并发查询"""
+        now = time.monotonic()
+        results = {}
+        to_fetch = []
+        for workshop_id in dict.fromkeys(workshop_ids):
+            cached = self._cache.get(workshop_id)
+            if cached is not None and not refresh and now - cached[0] < self.cache_ttl:
+                results[workshop_id] = cached[1]
+            else:
+                to_fetch.append(workshop_id)
+
+        batches = [to_fetch[i:i + DETAILS_BATCH_SIZE] for i in range(0, len(to_fetch), DETAILS_BATCH_SIZE)]
+        for fetched in await asyncio.gather(*(self._fetch_batch(batch) for batch in batches)):
+            for workshop_id, details in fetched.items():
+                self._cache[workshop_id] = (now, details)
+                results[workshop_id] = details
+        return results
+
+    async def _fetch_children_batch(self, workshop_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        data = {"collectioncount": len(workshop_ids)}
+        for i, workshop_id in enumerate(workshop_ids):
+            data[f"publishedfileids[{i}]"] = workshop_id
+        response = await self._post("/ISteamRemoteStorage/GetCollectionDetails/v1/", data)
+
+        children = {workshop_id: [] for workshop_id in workshop_ids}
+        for entry in response.get("collectiondetails", []):
+            if entry.get("result") != RESULT_OK:
+                continue
+            children[str(entry.get("publishedfileid"))] = [
+                {
+                    "workshop_id": str(child["publishedfileid"]),
+                    "is_collection": child.get("filetype") == FILE_TYPE_COLLECTION
+                }
+                for child in sorted(entry.get("children", []), key=lambda c: c.get("sortorder", 0))
+            ]
+        return children
+
+    async def get_children(self, workshop_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """获取子项：合集的子项为其中的物品和子合集，普通物品的子项为其"必需物品"
+
+        与元数据共用缓存有效期，重复展开同一合集不会再次请求。
+        """
+        now = time.monotonic()
+        results = {}
+        to_fetch = []
+        for workshop_id in dict.fromkeys(workshop_ids):
+            cached = self._children_cache.get(workshop_id)
+            if cached is not None and now - cached[0] < self.cache_ttl:
+                results[workshop_id] = cached[1]
+            else:
+                to_fetch.append(workshop_id)
+
+        batches = [to_fetch[i:i + DETAILS_BATCH_SIZE] for i in range(0, len(to_fetch), DETAILS_BATCH_SIZE)]
+        for fetched in await asyncio.gather(*(self._fetch_children_batch(batch) for batch in batches)):
+            for workshop_id, children in fetched.items():
+                self._children_cache[workshop_id] = (now, children)
+                results[workshop_id] = children
+        return results
+
+    async def enrich(self, workshop_ids: List[str], refresh: bool = False) -> Dict[str, int]:
+        """查询元数据并写入WorkshopItem，只更新time_updated有变化（或从未获取过）的物品"""
+        try:
+            details = await self.get_details(workshop_ids, refresh=refresh)
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"获取创意工坊元数据失败: {str(e)}")
+            return {"updated": 0, "unchanged": 0, "missing": 0}
+
+        found = {workshop_id: d for workshop_id, d in details.items() if d is not None}
+        stats = {"updated": 0, "unchanged": 0, "missing": len(details) - len(found)}
+        if not found:
+            return stats
+
+        async with AsyncSessionLocal() as db:
+            ids = list(found)
+            for i in range(0, len(ids), IN_QUERY_BATCH):
+                items = await db.scalars(select(WorkshopItem).where(
+                    WorkshopItem.workshop_id.in_(ids[i:i + IN_QUERY_BATCH])
+                ))
+                for item in items:
+                    data = found[item.workshop_id]
+                    if item.time_updated is not None and item.time_updated == data["time_updated"]:
+                        stats["unchanged"] += 1
+                        continue
+                    for field, value in data.items():
+                        setattr(item, field, value)
+                    stats["updated"] += 1
+            await db.commit()
+        return stats
+
+
+# 全局元数据服务实例
+workshop_metadata = WorkshopMetadataService()
@@ -0,0 +1,197 @@
+import asyncio
+from typing import Dict, Any, List, Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.database import SessionLocal
+from app.models.mod import WorkshopItem
+from app.services.download_manager import download_manager
+from app.services.download_queue import download_queue
+from app.services.download_service import DownloadService, download_service
+from app.services.task_store import IN_QUERY_BATCH
+from app.services.workshop_metadata import WorkshopMetadataService, workshop_metadata
+
+# 同步差异的分类（unversioned：已安装但不知道安装的是哪个版本）
+SYNC_CATEGORIES = ("unchanged", "new", "outdated", "damaged", "missing", "unversioned")
+
+
+class WorkshopSync:
+    """创意工坊增量同步
+
+    安装清单记录了已安装版本的time_updated和每个文件的哈希、大小。同步时把清单与
+    （缓存的）Steam元数据比较：只有新增或Steam上已更新的物品才重新下载；文件被误删的
+    物品直接从blob重新链接，不需要下载；其余物品不做任何磁盘或网络操作。
+    清单没有记录版本时用物品记录中的time_updated补齐；仍然未知的（包括没有清单的旧安装）
+    不重新下载，同步时以Steam上的当前版本作为已安装版本写入清单。
+    """
+
+    def __init__(self, service: DownloadService, metadata: WorkshopMetadataService):
+        self.service = service
+        self.metadata = metadata
+
+    def _local_state(self, workshop_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """读取清单中的已安装版本和缺失文件数，以及物品记录中的安装状态和版本（同步，在线程池中执行）"""
+        records = {}
+        db = SessionLocal()
+        try:
+            for i in range(0, len(workshop_ids), IN_QUERY_BATCH):
+                records.update(
+                    (row.workshop_id, row) for row in db.query(
+                        WorkshopItem.workshop_id, WorkshopItem.is_installed, WorkshopItem.time_updated
+                    ).filter(WorkshopItem.workshop_id.in_(workshop_ids[i:i + IN_QUERY_BATCH]))
+                )
+        finally:
+            db.close()
+
+        installer = self.service.installer
+        state = {}
+        for workshop_id in workshop_ids:
+            record = records.get(workshop_id)
+            manifest = installer.get_manifest(workshop_id)
+            state[workshop_id] = {
+                "is_installed": bool(record and record.is_installed),
+                "recorded_version": record.time_updated if record else None,
+                "manifest": None if manifest is None else {
+                    "time_updated": manifest.get("time_updated"),
+                    "files": len(manifest["files"]),
+                    "missing_files": len(installer.missing_files(manifest))
+                }
+            }
+        return state
+
+    async def plan(self, workshop_ids: List[str], refresh: bool = True) -> Dict[str, List[Dict[str, Any]]]:
+        """计算同步差异（不修改任何内容，可直接作为dry-run结果返回）"""
+        workshop_ids = list(dict.fromkeys(workshop_ids))
+        remote = await self.metadata.get_details(workshop_ids, refresh=refresh)
+        local = await asyncio.get_running_loop().run_in_executor(
+            self.service.executor, self._local_state, workshop_ids
+        )
+
+        diff = {category: [] for category in SYNC_CATEGORIES}
+        for workshop_id in workshop_ids:
+            details = remote.get(workshop_id)
+            state = local[workshop_id]
+            installed = state["manifest"]
+            version = installed["time_updated"] if installed else None
+            entry = {
+                "workshop_id": workshop_id,
+                "title": details["title"] if details else None,
+                "installed_version": version,
+                "remote_version": details["time_updated"] if details else None
+            }
+            if installed and version is None and state["recorded_version"] is not None:
+                # 清单中没有版本：用安装时获取的元数据补齐（apply时写回清单）
+                version = entry["installed_version"] = state["recorded_version"]
+                entry["version_backfilled"] = True
+
+            if details is None:
+                # Steam上已不存在（被删除或设为私有），保留本地安装
+                category = "missing"
+            elif installed is None:
+                # 没有清单：未安装的是新物品；旧版本安装的物品不知道版本，不重新下载
+                category = "unversioned" if state["is_installed"] else "new"
+            elif version is None:
+                if installed["missing_files"]:
+                    entry["missing_files"] = installed["missing_files"]
+                category = "unversioned"
+            elif version != details["time_updated"]:
+                category = "outdated"
+            elif installed["missing_files"]:
+                entry["missing_files"] = installed["missing_files"]
+                category = "damaged"
+            else:
+                category = "unchanged"
+            diff[category].append(entry)
+        return diff
+
+    def _set_versions(self, versions: Dict[str, int]):
+        for workshop_id, time_updated in versions.items():
+            self.service.installer.set_version(workshop_id, time_updated)
+
+    def _repair(self, workshop_ids: List[str]) -> Dict[str, List[str]]:
+        repaired, failed = [], []
+        for workshop_id in workshop_ids:
+            try:
+                self.service.installer.repair(workshop_id)
+                repaired.append(workshop_id)
+            except OSError:
+                failed.append(workshop_id)
+        return {"repaired": repaired, "failed": failed}
+
+    async def apply(
+        self,
+        diff: Dict[str, List[Dict[str, Any]]],
+        db: AsyncSession,
+        user_id: Optional[int] = None,
+        priority: int = 0
+    ) -> Dict[str, Any]:
+        """执行同步：补写清单版本、修复损坏的安装，把新增/已更新的物品加入下载队列"""
+        loop = asyncio.get_running_loop()
+        versions = {
+            entry["workshop_id"]: entry["installed_version"]
+            for entries in diff.values() for entry in entries if entry.get("version_backfilled")
+        }
+        versions.update(
+            (entry["workshop_id"], entry["remote_version"])
+            for entry in diff["unversioned"] if entry["remote_version"] is not None
+        )
+        if versions:
+            await loop.run_in_executor(self.service.executor, self._set_versions, versions)
+
+        damaged = diff["damaged"] + [entry for entry in diff["unversioned"] if entry.get("missing_files")]
+        repair = await loop.run_in_executor(
+            self.service.executor, self._repair, [entry["workshop_id"] for entry in damaged]
+        )
+
+        # blob已被清理而无法修复的物品也需要重新下载
+        to_download = diff["new"] + diff["outdated"] + [
+            entry for entry in damaged if entry["workshop_id"] in repair["failed"]
+        ]
+        if not to_download:
+            return {"repaired": repair["repaired"], "task_ids": [], "already_queued": []}
+
+        # 物品记录写入最新元数据（来自plan时的缓存，不会再次请求Steam）
+        await self.metadata.enrich([entry["workshop_id"] for entry in to_download])
+        ids = [entry["workshop_id"] for entry in to_download]
+        items = {}
+        for i in range(0, len(ids), IN_QUERY_BATCH):
+            items.update(
+                (item.workshop_id, item) for item in await db.scalars(select(WorkshopItem).where(
+                    WorkshopItem.workshop_id.in_(ids[i:i + IN_QUERY_BATCH])
+                ))
+            )
+
+        queued_tasks = download_manager.active_workshop_tasks()
+        already_queued = []
+        specs = []
+        for entry in to_download:
+            item = items.get(entry["workshop_id"])
+            if item is None:
+                continue
+            if item.id in queued_tasks:
+                already_queued.append(entry["workshop_id"])
+                continue
+            specs.append({
+                "task_id": download_manager.new_task_id("workshop"),
+                "task_type": "workshop",
+                "description": f"同步创意工坊物品 {entry['workshop_id']}",
+                "workshop_item_id": item.id,
+                "priority": priority,
+                "user_id": user_id,
+                "payload": {
+                    "workshop_id": entry["workshop_id"],
+                    "time_updated": entry["remote_version"],
+                    "file_size": item.file_size
+                }
+            })
+
+        created = await db.run_sync(lambda session: download_manager.create_tasks(specs, session))
+        download_queue.schedule()
+        return {
+            "repaired": repair["repaired"],
+            "task_ids": [task.task_id for task in created],
+            "already_queued": already_queued
+        }
+
+
+# 全局同步实例
+workshop_sync = WorkshopSync(download_service, workshop_metadata)
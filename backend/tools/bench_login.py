@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+登录吞吐量基准测试
+
+在进程内（httpx.ASGITransport）对 /api/auth/login 发起不同并发度的请求，报告：
+- 吞吐量（次/秒）、延迟p50/p95、被拒绝（503）的请求数
+- 同时每10ms请求一次 /health 的最大延迟，用于观察事件循环是否被bcrypt阻塞
+
+用法（在backend目录下）：
+    python tools/bench_login.py                       # 使用配置中的进程池
+    python tools/bench_login.py --workers 0           # 对比：在事件循环中直接计算（旧行为）
+    python tools/bench_login.py --concurrency 1 8 32 --requests 64 --rounds 10
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Login throughput benchmark")
+    parser.add_argument("--workers", type=int, default=None, help="密码哈希进程数（默认使用配置）")
+    parser.add_argument("--max-pending", type=int, default=None, help="排队上限（默认使用配置）")
+    parser.add_argument("--rounds", type=int, default=None, help="bcrypt cost（默认使用配置）")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=64, help="每个并发度的登录请求数")
+    parser.add_argument("--users", type=int, default=8)
+    return parser.parse_args()
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+async def probe(client, stop: asyncio.Event, latencies):
+    # 计入sleep的超时部分：事件循环被阻塞时，探测请求根本得不到调度
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        await client.get("/health")
+        latencies.append(time.perf_counter() - started - 0.01)
+
+
+async def run_level(client, concurrency: int, total: int, users: int):
+    latencies, statuses = [], {}
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            response = await client.post("/api/auth/login", json={
+                "email": f"bench{i % users}@example.com", "password": "bench-password"
+            })
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    probe_latencies = []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(client, stop, probe_latencies))
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe_task
+
+    ok = statuses.get(200, 0)
+    print(
+        f"{concurrency:>11} {ok / elapsed:>10.1f} {percentile(latencies, 0.5) * 1000:>9.0f} "
+        f"{percentile(latencies, 0.95) * 1000:>9.0f} {statuses.get(503, 0):>8} "
+        f"{max(probe_latencies, default=0) * 1000:>14.0f}"
+    )
+
+
+async def main(args):
+    import httpx
+    from app.main import app
+    from app.core.database import create_tables
+    from app.core.password_pool import password_hasher
+    from app.core.config import settings
+
+    create_tables()
+    password_hasher.start()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=300) as client:
+        for i in range(args.users):
+            await client.post("/api/auth/register", json={
+                "username": f"bench{i}", "email": f"bench{i}@example.com", "password": "bench-password"
+            })
+
+        print(
+            f"workers={password_hasher.workers} max_pending={password_hasher.max_pending} "
+            f"rounds={settings.bcrypt_rounds} requests/level={args.requests}"
+        )
+        print(f"{'concurrency':>11} {'logins/s':>10} {'p50(ms)':>9} {'p95(ms)':>9} {'rejected':>8} {'health max(ms)':>14}")
+        for concurrency in args.concurrency:
+            await run_level(client, concurrency, args.requests, args.users)
+    password_hasher.close()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # 配置在导入app之前通过环境变量覆盖，使用临时数据库
+    tmp = tempfile.mkdtemp(prefix="bench_login_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/bench.db"
+    if args.workers is not None:
+        os.environ["PASSWORD_HASH_WORKERS"] = str(args.workers)
+    if args.max_pending is not None:
+        os.environ["PASSWORD_HASH_MAX_PENDING"] = str(args.max_pending)
+    if args.rounds is not None:
+        os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    asyncio.run(main(args))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+离线测试用的A2S查询应答器替身
+
+- 响应 A2S_INFO / A2S_PLAYER，并要求先完成challenge握手（与当前srcds行为一致）
+- 玩家列表较长时按Source格式拆分为多个UDP包（--split-size）
+
+用法：
+    python tools/fake_a2s_server.py --port 27015 --map c2m1_highway --players 3
+"""
+
+import argparse
+import asyncio
+import os
+import struct
+from typing import Callable, Dict, Any
+
+SIMPLE_HEADER = b"\xFF\xFF\xFF\xFF"
+SPLIT_HEADER = b"\xFE\xFF\xFF\xFF"
+INFO_PAYLOAD = b"Source Engine Query\x00"
+
+
+def _string(value: str) -> bytes:
+    return value.encode("utf-8") + b"\x00"
+
+
+class FakeA2SProtocol(asyncio.DatagramProtocol):
+    """state() 返回当前状态：name, map, max_players, bots, players（名字列表）"""
+
+    def __init__(self, state: Callable[[], Dict[str, Any]], split_size: int = 1400):
+        self.state = state
+        self.split_size = split_size
+        self.challenge = os.urandom(4)
+        self.transport = None
+        self.requests = 0
+        self._next_split_id = 1
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        if not data.startswith(SIMPLE_HEADER) or len(data) < 5:
+            return
+        self.requests += 1
+        request_type = data[4]
+
+        if request_type == 0x54 and data[5:].startswith(INFO_PAYLOAD):
+            if data[5 + len(INFO_PAYLOAD):] != self.challenge:
+                self._send_challenge(addr)
+            else:
+                self._send(self._info(), addr)
+        elif request_type == 0x55:
+            if data[5:9] != self.challenge:
+                self._send_challenge(addr)
+            else:
+                self._send(self._players(), addr)
+
+    def _send_challenge(self, addr):
+        self.transport.sendto(SIMPLE_HEADER + b"\x41" + self.challenge, addr)
+
+    def _info(self) -> bytes:
+        state = self.state()
+        return (
+            b"\x49\x11"
+            + _string(state.get("name", "Fake L4D2 Server"))
+            + _string(state["map"])
+            + _string("left4dead2")
+            + _string("Left 4 Dead 2")
+            + struct.pack("<h", 550)
+            + bytes([len(state["players"]), state.get("max_players", 8), state.get("bots", 0)])
+            + b"dl\x00\x01"
+            + _string("2.2.2.0")
+        )
+
+    def _players(self) -> bytes:
+        players = self.state()["players"]
+        body = b"\x44" + bytes([len(players)])
+        for index, name in enumerate(players):
+            body += b"\x00" + _string(name) + struct.pack("<if", index, 60.0 * (index + 1))
+        return body
+
+    def _send(self, body: bytes, addr):
+        packet = SIMPLE_HEADER + body
+        if len(packet) <= self.split_size:
+            self.transport.sendto(packet, addr)
+            return
+
+        split_id = self._next_split_id
+        self._next_split_id += 1
+        chunks = [packet[i:i + self.split_size] for i in range(0, len(packet), self.split_size)]
+        # 倒序发送，验证客户端的分包重组
+        for number in reversed(range(len(chunks))):
+            header = SPLIT_HEADER + struct.pack("<iBBh", split_id, len(chunks), number, self.split_size)
+            self.transport.sendto(header + chunks[number], addr)
+
+
+async def start(state: Callable[[], Dict[str, Any]], host: str = "127.0.0.1", port: int = 0,
+                split_size: int = 1400):
+    """启动应答器，返回 (transport, protocol)；port为0时自动分配"""
+    loop = asyncio.get_running_loop()
+    return await loop.create_datagram_endpoint(
+        lambda: FakeA2SProtocol(state, split_size), local_addr=(host, port)
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Fake A2S responder")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=27015)
+    parser.add_argument("--map", default="c1m1_hotel")
+    parser.add_argument("--players", type=int, default=0)
+    parser.add_argument("--max-players", type=int, default=8)
+    parser.add_argument("--split-size", type=int, default=1400)
+    args = parser.parse_args()
+
+    state = {
+        "map": args.map,
+        "max_players": args.max_players,
+        "players": [f"Player{i + 1}" for i in range(args.players)]
+    }
+    await start(lambda: state, args.host, args.port, args.split_size)
+    print(f"Fake A2S responder listening on {args.host}:{args.port}", flush=True)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+离线测试用的Source RCON服务器替身
+
+- 实现认证、命令执行，以及超过4096字节时的多包响应
+- 对空的 RESPONSE_VALUE 包按srcds的行为原样返回，并附带一个 0x0001 包
+- 支持 changelevel / mp_gamemode / z_difficulty 等常用cvar，status 输出当前状态
+
+用法：
+    python tools/fake_rcon_server.py --port 27015 --password secret
+同一端口的UDP上同时提供A2S查询应答（见 fake_a2s_server.py）。
+也可以作为 srcds_run 替身（解析 -port 与 +rcon_password 参数）：
+    ln -s $(pwd)/tools/fake_rcon_server.py <L4D2_SERVER_PATH>/srcds_run
+"""
+
+import argparse
+import asyncio
+import struct
+import sys
+
+import fake_a2s_server
+
+SERVERDATA_AUTH = 3
+SERVERDATA_AUTH_RESPONSE = 2
+SERVERDATA_EXECCOMMAND = 2
+SERVERDATA_RESPONSE_VALUE = 0
+MAX_PACKET_BODY = 4096
+
+
+def encode(request_id: int, packet_type: int, body: bytes) -> bytes:
+    payload = body + b"\x00\x00"
+    return struct.pack("<iii", len(payload) + 8, request_id, packet_type) + payload
+
+
+class FakeRconServer:
+    """模拟srcds的RCON端"""
+
+    def __init__(self, password: str, current_map: str = "c1m1_hotel"):
+        self.password = password
+        self.cvars = {
+            "mp_gamemode": "coop",
+            "z_difficulty": "Normal",
+            "sv_password": "",
+            "hostname": "Fake L4D2 Server"
+        }
+        self.current_map = current_map
+        self.players = []
+        self.commands = []
+
+    def run_command(self, command: str) -> str:
+        self.commands.append(command)
+        parts = command.strip().split(None, 1)
+        if not parts:
+            return ""
+        name = parts[0]
+        value = parts[1].strip().strip('"') if len(parts) > 1 else None
+
+        if name == "status":
+            return (
+                f"hostname: {self.cvars['hostname']}\n"
+                f"map     : {self.current_map}\n"
+                f"players : 0 humans, 0 bots (8 max)\n"
+            )
+        if name in ("changelevel", "map"):
+            self.current_map = value or self.current_map
+            return ""
+        if name == "rcon_password":
+            self.password = value or self.password
+            return ""
+        if name == "cvarlist":
+            # 足够长的输出，用于测试多包响应
+            return "".join(f"fake_cvar_{i:05d} : 0 : , \"sv\"\n" for i in range(400))
+        if name == "echo":
+            return (value or "") + "\n"
+        if name in self.cvars:
+            if value is None:
+                return f'"{name}" = "{self.cvars[name]}"\n'
+            self.cvars[name] = value
+            return ""
+        return f"Unknown command \"{name}\"\n"
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        authed = False
+        try:
+            while True:
+                (size,) = struct.unpack("<i", await reader.readexactly(4))
+                data = await reader.readexactly(size)
+                request_id, packet_type = struct.unpack("<ii", data[:8])
+                body = data[8:-2].decode("utf-8", errors="replace")
+
+                if packet_type == SERVERDATA_AUTH:
+                    authed = body == self.password
+                    writer.write(encode(request_id, SERVERDATA_RESPONSE_VALUE, b""))
+                    writer.write(encode(request_id if authed else -1, SERVERDATA_AUTH_RESPONSE, b""))
+                elif not authed:
+                    break
+                elif packet_type == SERVERDATA_EXECCOMMAND:
+                    output = self.run_command(body).encode("utf-8")
+                    chunks = [output[i:i + MAX_PACKET_BODY] for i in range(0, len(output), MAX_PACKET_BODY)] or [b""]
+                    for chunk in chunks:
+                        writer.write(encode(request_id, SERVERDATA_RESPONSE_VALUE, chunk))
+                elif packet_type == SERVERDATA_RESPONSE_VALUE:
+                    # srcds会镜像空包，并额外发送一个正文为0x0001的包
+                    writer.write(encode(request_id, SERVERDATA_RESPONSE_VALUE, b""))
+                    writer.write(encode(request_id, SERVERDATA_RESPONSE_VALUE, b"\x00\x01\x00\x00"))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def a2s_state(self) -> dict:
+        return {
+            "name": self.cvars["hostname"],
+            "map": self.current_map,
+            "players": self.players
+        }
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> asyncio.AbstractServer:
+        """启动监听，port为0时自动分配，实际端口见 server.sockets[0]"""
+        return await asyncio.start_server(self.handle, host, port)
+
+
+def parse_args(argv):
+    # 兼容srcds_run风格的参数
+    if "-port" in argv:
+        port = int(argv[argv.index("-port") + 1])
+        password = argv[argv.index("+rcon_password") + 1] if "+rcon_password" in argv else ""
+        current_map = argv[argv.index("+map") + 1] if "+map" in argv else "c1m1_hotel"
+        return "127.0.0.1", port, password, current_map
+
+    parser = argparse.ArgumentParser(description="Fake Source RCON server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=27015)
+    parser.add_argument("--password", default="")
+    parser.add_argument("--map", default="c1m1_hotel")
+    args = parser.parse_args(argv)
+    return args.host, args.port, args.password, args.map
+
+
+async def main(argv):
+    host, port, password, current_map = parse_args(argv)
+    fake = FakeRconServer(password, current_map)
+    server = await fake.start(host, port)
+    await fake_a2s_server.start(fake.a2s_state, host, port)
+    print(f"Fake RCON server listening on {host}:{port}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(sys.argv[1:]))
+    except KeyboardInterrupt:
+        pass
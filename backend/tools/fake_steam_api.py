@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+离线测试用的Steam Web API替身
+
+- POST /ISteamRemoteStorage/GetPublishedFileDetails/v1/
+  任意数字ID都会返回确定性的元数据；--missing 中的ID返回 result=9（物品不存在）
+- POST /ISteamRemoteStorage/GetCollectionDetails/v1/
+  合集内容和物品的必需物品由 app.state.collections / app.state.required 提供
+- 每个请求的物品数记录在 app.state.batches 中，便于检查批量查询是否生效
+
+进程内使用（无需监听端口）：
+    app = build_app()
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://fake")
+    WorkshopMetadataService(http_client=client, api_url="http://fake")
+
+独立运行：
+    python tools/fake_steam_api.py --port 8090
+    STEAM_WEB_API_URL=http://127.0.0.1:8090 uvicorn app.main:app
+"""
+
+import argparse
+from typing import Dict, Any, Iterable, List, Optional
+from urllib.parse import parse_qs
+from fastapi import FastAPI, Request
+
+# Steam EResult
+RESULT_OK = 1
+RESULT_FILE_NOT_FOUND = 9
+
+# EWorkshopFileType
+FILE_TYPE_ITEM = 0
+FILE_TYPE_COLLECTION = 2
+
+
+def item_details(workshop_id: str, time_updated: int) -> Dict[str, Any]:
+    number = int(workshop_id)
+    return {
+        "publishedfileid": workshop_id,
+        "result": RESULT_OK,
+        "creator": "76561198000000000",
+        "creator_app_id": 550,
+        "consumer_app_id": 550,
+        # 与新版API一致，file_size为字符串
+        "file_size": str(1024 * 1024 * (number % 500 + 1)),
+        "preview_url": f"https://example.invalid/preview/{workshop_id}.jpg",
+        "title": f"Fake Item {workshop_id}",
+        "description": f"Fake workshop item {workshop_id}",
+        "time_created": time_updated - 86400,
+        "time_updated": time_updated,
+        "tags": [{"tag": "Campaigns"}] if number % 2 == 0 else [{"tag": "Weapons"}]
+    }
+
+
+def _read_ids(form: Dict[str, List[str]], count_field: str) -> List[str]:
+    count = int(form.get(count_field, ["0"])[0])
+    return [form[f"publishedfileids[{i}]"][0] for i in range(count)]
+
+
+def build_app(
+    missing: Optional[Iterable[str]] = None,
+    time_updated: int = 1700000000,
+    collections: Optional[Dict[str, List[str]]] = None,
+    required: Optional[Dict[str, List[str]]] = None
+) -> FastAPI:
+    """创建假API；修改 app.state.time_updated（全部物品）或
+    app.state.item_time_updated[物品ID]（单个物品）可模拟物品在Steam上更新
+
+    collections: 合集ID -> 子项ID列表（子项本身也在collections中时视为子合集）
+    required: 物品ID -> 必需物品ID列表
+    """
+    app = FastAPI()
+    app.state.missing = set(missing or ())
+    app.state.time_updated = time_updated
+    app.state.item_time_updated = {}
+    app.state.collections = collections or {}
+    app.state.required = required or {}
+    app.state.batches = []
+
+    @app.post("/ISteamRemoteStorage/GetCollectionDetails/v1/")
+    async def get_collection_details(request: Request):
+        ids = _read_ids(parse_qs((await request.body()).decode()), "collectioncount")
+        app.state.batches.append(len(ids))
+
+        details = []
+        for workshop_id in ids:
+            children = app.state.collections.get(workshop_id, app.state.required.get(workshop_id))
+            if children is None:
+                details.append({"publishedfileid": workshop_id, "result": RESULT_FILE_NOT_FOUND})
+                continue
+            details.append({
+                "publishedfileid": workshop_id,
+                "result": RESULT_OK,
+                "children": [
+                    {
+                        "publishedfileid": child_id,
+                        "sortorder": order,
+                        "filetype": FILE_TYPE_COLLECTION if child_id in app.state.collections else FILE_TYPE_ITEM
+                    }
+                    for order, child_id in enumerate(children)
+                ]
+            })
+        return {"response": {"result": RESULT_OK, "resultcount": len(details), "collectiondetails": details}}
+
+    @app.post("/ISteamRemoteStorage/GetPublishedFileDetails/v1/")
+    async def get_published_file_details(request: Request):
+        ids = _read_ids(parse_qs((await request.body()).decode()), "itemcount")
+        app.state.batches.append(len(ids))
+
+        details = []
+        for workshop_id in ids:
+            if workshop_id in app.state.missing or not workshop_id.isdigit():
+                details.append({"publishedfileid": workshop_id, "result": RESULT_FILE_NOT_FOUND})
+            else:
+                details.append(item_details(
+                    workshop_id, app.state.item_time_updated.get(workshop_id, app.state.time_updated)
+                ))
+        return {"response": {"result": RESULT_OK, "resultcount": len(details), "publishedfiledetails": details}}
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake Steam Web API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--missing", nargs="*", default=[], help="返回不存在的物品ID")
+    parser.add_argument("--time-updated", type=int, default=1700000000)
+    args = parser.parse_args()
+
+    uvicorn.run(build_app(args.missing, args.time_updated), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
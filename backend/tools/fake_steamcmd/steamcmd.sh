@@ -0,0 +1,111 @@
+#!/bin/sh
+# 离线测试用的SteamCMD替身
+#
+# 模拟真实SteamCMD的命令行 (+cmd args ...) 与交互式 (Steam> 提示符) 两种用法，
+# 以及登录、workshop_download_item 的输出格式。把 settings.steamcmd_path
+# 指向本目录即可在没有网络的情况下测试下载流程。
+#
+# 环境变量：
+#   FAKE_STEAMCMD_ROOT      下载内容根目录（默认为脚本所在目录）
+#   FAKE_STEAMCMD_DELAY     每个物品的模拟下载耗时（秒，默认0）
+#   FAKE_STEAMCMD_FAIL_IDS  空格分隔、需要模拟下载失败的物品ID
+#   FAKE_STEAMCMD_FLAKY_IDS 空格分隔、第一次下载在下载缓存中留下部分内容后
+#                           以 (Timeout) 失败、再次下载时从缓存续传的物品ID
+#   FAKE_STEAMCMD_BAD_USER  使用该用户名登录时模拟登录失败
+
+SCRIPT_DIR=$(cd "$(dirname "$0")" && pwd)
+INSTALL_DIR="${FAKE_STEAMCMD_ROOT:-$SCRIPT_DIR}"
+DELAY="${FAKE_STEAMCMD_DELAY:-0}"
+LOGGED_IN=0
+
+echo "Redirecting stderr to '$SCRIPT_DIR/logs/stderr.txt'"
+echo "Loading Steam API...OK"
+
+do_login() {
+    if [ -z "$1" ] || [ "$1" = "${FAKE_STEAMCMD_BAD_USER:-}" ]; then
+        echo "Logging in user '$1' to Steam Public...FAILED (Invalid Password)"
+        return 1
+    fi
+    if [ "$1" = "anonymous" ]; then
+        echo "Connecting anonymously to Steam Public...OK"
+    else
+        echo "Logging in user '$1' to Steam Public...OK"
+    fi
+    echo "Waiting for client config...OK"
+    echo "Waiting for user info...OK"
+    LOGGED_IN=1
+}
+
+do_workshop_download() {
+    app_id="$1"
+    item_id="$2"
+    if [ "$LOGGED_IN" != 1 ]; then
+        echo "ERROR! Download item $item_id failed (Not logged on)."
+        return 1
+    fi
+    case " ${FAKE_STEAMCMD_FAIL_IDS:-} " in
+        *" $item_id "*)
+            sleep "$DELAY"
+            echo "ERROR! Download item $item_id failed (Failure)."
+            return 1
+            ;;
+    esac
+    partial="$INSTALL_DIR/steamapps/workshop/downloads/$app_id/$item_id"
+    case " ${FAKE_STEAMCMD_FLAKY_IDS:-} " in
+        *" $item_id "*)
+            if [ ! -d "$partial" ]; then
+                mkdir -p "$partial"
+                printf 'partial %s\n' "$item_id" > "$partial/$item_id.vpk.part"
+                sleep "$DELAY"
+                echo "ERROR! Download item $item_id failed (Timeout)."
+                return 1
+            fi
+            echo "Resuming item $item_id from download cache"
+            ;;
+    esac
+    rm -rf "$partial"
+    target="$INSTALL_DIR/steamapps/workshop/content/$app_id/$item_id"
+    mkdir -p "$target"
+    printf 'fake vpk %s\n' "$item_id" > "$target/$item_id.vpk"
+    sleep "$DELAY"
+    size=$(wc -c < "$target/$item_id.vpk" | tr -d ' ')
+    echo "Downloading item $item_id ..."
+    echo "Success. Downloaded item $item_id to \"$target\" ($size bytes) "
+}
+
+run_command() {
+    # shellcheck disable=SC2086
+    set -- $1
+    [ $# -eq 0 ] && return 0
+    cmd="$1"
+    shift
+    case "$cmd" in
+        login) do_login "$@" ;;
+        force_install_dir) INSTALL_DIR="$1" ;;
+        workshop_download_item) do_workshop_download "$@" ;;
+        app_update) echo "Success! App '$1' fully installed." ;;
+        quit|exit) exit 0 ;;
+        *) echo "Command not found: $cmd" ;;
+    esac
+}
+
+# 处理命令行中的 +cmd 参数
+current=""
+for arg in "$@"; do
+    case "$arg" in
+        +*)
+            [ -n "$current" ] && run_command "$current"
+            current="${arg#+}"
+            ;;
+        *)
+            current="$current $arg"
+            ;;
+    esac
+done
+[ -n "$current" ] && run_command "$current"
+
+# 没有 +quit 时进入交互模式
+while printf "Steam>" && read -r line; do
+    run_command "$line"
+done
+echo
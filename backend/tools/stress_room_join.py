@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+房间加入/离开并发压力测试
+
+向同一个房间并发发起大量加入请求（每个用户一次，另有一部分用户重复加入），
+随后让一部分玩家并发离开、另一批用户同时加入，最后检查不变量：
+- 成功加入的人数不超过max_players，重复加入全部被拒绝
+- rooms.current_players 与 room_players 的行数一致
+- 同一用户在房间中最多一条记录
+
+默认在进程内（httpx.ASGITransport）请求，使用临时SQLite数据库；
+--url 指向已运行的服务（例如 uvicorn --workers 4）时，通过HTTP请求，此时需要与服务使用相同的DATABASE_URL。
+
+用法（在backend目录下）：
+    python tools/stress_room_join.py
+    python tools/stress_room_join.py --users 5000 --max-players 8 --concurrency 500
+    DATABASE_URL=sqlite:////tmp/l4d2.db python tools/stress_room_join.py --keep-db --url http://127.0.0.1:8000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Room join/leave stress test")
+    parser.add_argument("--users", type=int, default=2000, help="参与加入的用户数")
+    parser.add_argument("--max-players", type=int, default=8)
+    parser.add_argument("--duplicates", type=int, default=200, help="重复发送加入请求的用户数")
+    parser.add_argument("--concurrency", type=int, default=200, help="同时进行的请求数")
+    parser.add_argument("--url", default=None, help="已运行服务的地址（默认在进程内请求）")
+    parser.add_argument("--keep-db", action="store_true", help="使用环境变量DATABASE_URL而不是临时SQLite数据库")
+    return parser.parse_args()
+
+
+def seed(users: int, max_players: int):
+    """创建用户、服务器和房间，返回 (房间ID, 每个用户的访问令牌)"""
+    from sqlalchemy import insert, select
+    from app.core.auth import create_access_token
+    from app.core.database import SessionLocal
+    from app.models.room import Room
+    from app.models.server import Server
+    from app.models.user import User
+
+    db = SessionLocal()
+    try:
+        prefix = f"stress-{int(time.time())}"
+        db.execute(insert(User), [{"username": f"{prefix}-{i}"} for i in range(users)])
+        user_ids = list(db.scalars(select(User.id).where(User.username.like(f"{prefix}-%")).order_by(User.id)))
+        server = Server(name=prefix)
+        db.add(server)
+        db.flush()
+        room = Room(name=prefix, server_id=server.id, creator_id=user_ids[0], max_players=max_players)
+        db.add(room)
+        db.commit()
+        return room.id, [create_access_token({"sub": str(user_id)}) for user_id in user_ids]
+    finally:
+        db.close()
+
+
+def check_invariants(room_id: int, max_players: int) -> dict:
+    from sqlalchemy import func, select
+    from app.core.database import SessionLocal
+    from app.models.room import Room, RoomPlayer
+
+    db = SessionLocal()
+    try:
+        counter = db.scalar(select(Room.current_players).where(Room.id == room_id))
+        rows = db.scalar(select(func.count()).select_from(RoomPlayer).where(RoomPlayer.room_id == room_id))
+        distinct = db.scalar(
+            select(func.count(func.distinct(RoomPlayer.user_id))).where(RoomPlayer.room_id == room_id)
+        )
+    finally:
+        db.close()
+    return {
+        "counter": counter,
+        "rows": rows,
+        "ok": counter == rows == distinct and rows <= max_players
+    }
+
+
+async def fire(client, requests, concurrency: int):
+    """并发发送 (method, url, token, body) 请求，返回每个请求的 (状态码, success)"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(method, url, token, body):
+        async with semaphore:
+            response = await client.request(method, url, json=body, headers={"Authorization": f"Bearer {token}"})
+        if response.status_code != 200:
+            return response.status_code, False
+        return 200, response.json().get("success", True)
+
+    return await asyncio.gather(*(send(*request) for request in requests))
+
+
+def report(name: str, results, elapsed: float, invariants: dict):
+    # 离开不在其中的房间返回404，与加入失败一样计为被拒绝；其余非200状态计为错误
+    succeeded = sum(1 for status, success in results if status == 200 and success)
+    rejected = sum(1 for status, success in results if status in (200, 404) and not success)
+    errors = len(results) - succeeded - rejected
+    print(
+        f"{name:>8} {len(results):>8} {succeeded:>9} {rejected:>8} {errors:>6} {len(results) / elapsed:>8.0f} "
+        f"{invariants['counter']:>7} {invariants['rows']:>5}  {'OK' if invariants['ok'] else 'VIOLATED'}"
+    )
+    return succeeded
+
+
+async def main(args):
+    import httpx
+    from app.main import app
+    from app.core.database import create_tables, close_engines
+
+    create_tables()
+    room_id, tokens = seed(args.users, args.max_players)
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=120)
+    else:
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://stress", timeout=120)
+
+    join_url = f"/api/rooms/{room_id}/join"
+    leave_url = f"/api/rooms/{room_id}/leave"
+    join_body = {"room_id": room_id}
+    failures = []
+    print(f"room={room_id} max_players={args.max_players} users={args.users} concurrency={args.concurrency}")
+    print(f"{'phase':>8} {'requests':>8} {'succeeded':>9} {'rejected':>8} {'errors':>6} {'req/s':>8} {'counter':>7} {'rows':>5}  invariants")
+    async with client:
+        # 1. 所有用户同时加入，部分用户重复加入
+        requests = [("POST", join_url, token, join_body) for token in tokens]
+        requests += [("POST", join_url, token, join_body) for token in tokens[:args.duplicates]]
+        started = time.perf_counter()
+        results = await fire(client, requests, args.concurrency)
+        invariants = check_invariants(room_id, args.max_players)
+        joined = report("join", results, time.perf_counter() - started, invariants)
+        if joined != args.max_players:
+            failures.append(f"房间未被准确填满：成功加入 {joined} 人")
+        if not invariants["ok"]:
+            failures.append("加入后不变量被破坏")
+        if any(status not in (200, 404) for status, _ in results):
+            failures.append("加入时出现错误响应")
+
+        # 2. 所有用户同时离开（不在房间中的返回404），同时另一批用户尝试加入
+        requests = [("POST", leave_url, token, None) for token in tokens]
+        requests += [("POST", join_url, token, join_body) for token in reversed(tokens)]
+        started = time.perf_counter()
+        results = await fire(client, requests, args.concurrency)
+        invariants = check_invariants(room_id, args.max_players)
+        report("churn", results, time.perf_counter() - started, invariants)
+        if not invariants["ok"]:
+            failures.append("加入/离开交错后不变量被破坏")
+
+        # 3. 全部离开后计数归零
+        requests = [("POST", leave_url, token, None) for token in tokens]
+        started = time.perf_counter()
+        results = await fire(client, requests, args.concurrency)
+        invariants = check_invariants(room_id, args.max_players)
+        report("leave", results, time.perf_counter() - started, invariants)
+        if invariants["counter"] != 0 or invariants["rows"] != 0:
+            failures.append("全部离开后计数未归零")
+
+    await close_engines()
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return not failures
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # 配置在导入app之前通过环境变量覆盖
+    if not args.keep_db:
+        tmp = tempfile.mkdtemp(prefix="stress_room_")
+        os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/stress.db"
+    os.environ.setdefault("A2S_POLL_INTERVAL", "0")
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    sys.exit(0 if asyncio.run(main(args)) else 1)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+清理创意工坊blob存储中不再被任何WorkshopItem引用的文件
+
+用法（在backend目录下）：python tools/workshop_gc.py
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core.database import SessionLocal  # noqa: E402
+from app.models.mod import WorkshopItem  # noqa: E402
+from app.services.download_service import DownloadService  # noqa: E402
+
+
+def main():
+    db = SessionLocal()
+    try:
+        referenced_ids = [row.workshop_id for row in db.query(WorkshopItem.workshop_id).all()]
+    finally:
+        db.close()
+
+    result = asyncio.run(DownloadService().gc_blobs(referenced_ids))
+    print(f"已清理 {result['removed']} 个文件，释放 {result['freed_bytes'] / (1024*1024):.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
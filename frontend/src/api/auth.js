@@ -9,9 +9,14 @@ export const authAPI = {
 }
 
 export const downloadAPI = {
-  getTasks: () => api.get('/servers/downloads'),
+  getTasks: (params = {}) => api.get('/servers/downloads', { params }),
   getTask: (taskId) => api.get(`/servers/downloads/${taskId}`),
   cancelTask: (taskId) => api.delete(`/servers/downloads/${taskId}`),
+  pauseTask: (taskId) => api.post(`/servers/downloads/${taskId}/pause`),
+  resumeTask: (taskId) => api.post(`/servers/downloads/${taskId}/resume`),
+  getQueue: () => api.get('/servers/downloads/queue'),
+  // 任务状态推送（SSE），since为最后收到的事件序号
+  eventsURL: (since = 0) => `${api.defaults.baseURL}/servers/downloads/events?since=${since}`,
   installSteamCMD: () => api.post('/servers/install/steamcmd'),
   installServer: (credentials) => api.post('/servers/install/server', credentials),
   installPlugins: (credentials) => api.post('/servers/install/plugins', credentials),
@@ -6,7 +6,11 @@ export const useDownloadStore = defineStore('download', {
   state: () => ({
     tasks: {},
     currentTask: null,
-    loading: false
+    loading: false,
+    eventSource: null,
+    lastSeq: 0,
+    // 需要在结束时提示的任务
+    watchedTasks: {}
   }),
 
   getters: {
@@ -26,8 +30,8 @@ export const useDownloadStore = defineStore('download', {
   actions: {
     async fetchTasks() {
       try {
-        const response = await downloadAPI.getTasks()
-        this.tasks = response.data
+        const response = await downloadAPI.getTasks({ limit: 100 })
+        this.tasks = Object.fromEntries(response.data.tasks.map(task => [task.task_id, task]))
       } catch (error) {
         console.error('获取下载任务失败:', error)
         ElMessage.error('获取下载任务失败')
@@ -73,8 +77,8 @@ export const useDownloadStore = defineStore('download', {
           ElMessage.success('L4D2服务器下载已开始')
           if (response.data.task_id) {
             this.currentTask = response.data.task_id
-            // 开始轮询任务进度
-            this.startPollingTask(response.data.task_id)
+            // 订阅任务进度推送
+            this.watchTask(response.data.task_id)
           }
           await this.fetchTasks()
         } else {
@@ -96,7 +100,7 @@ export const useDownloadStore = defineStore('download', {
         if (response.data.success) {
           ElMessage.success('插件安装已开始')
           if (response.data.task_id) {
-            this.startPollingTask(response.data.task_id)
+            this.watchTask(response.data.task_id)
           }
           await this.fetchTasks()
         } else {
@@ -118,7 +122,7 @@ export const useDownloadStore = defineStore('download', {
         if (response.data.success) {
           ElMessage.success('完整安装已开始')
           if (response.data.task_id) {
-            this.startPollingTask(response.data.task_id)
+            this.watchTask(response.data.task_id)
           }
           await this.fetchTasks()
         } else {
@@ -143,30 +147,70 @@ export const useDownloadStore = defineStore('download', {
       }
     },
 
-    startPollingTask(taskId) {
-      const pollInterval = setInterval(async () => {
-        try {
-          const task = await this.fetchTask(taskId)
-
-          if (task.status === 'completed' || task.status === 'failed') {
-            clearInterval(pollInterval)
-            if (task.status === 'completed') {
-              ElMessage.success(`${task.description}完成`)
-            } else {
-              ElMessage.error(`${task.description}失败: ${task.message}`)
-            }
-          }
-        } catch (error) {
-          console.error('轮询任务状态失败:', error)
-          clearInterval(pollInterval)
+    async pauseTask(taskId) {
+      try {
+        const response = await downloadAPI.pauseTask(taskId)
+        if (response.data.success) {
+          ElMessage.success(response.data.message)
+        } else {
+          ElMessage.error(response.data.message)
         }
-      }, 2000) // 每2秒轮询一次
+      } catch (error) {
+        console.error('暂停下载任务失败:', error)
+        ElMessage.error('暂停下载任务失败')
+      }
+    },
 
-      // 5分钟后自动停止轮询
-      setTimeout(() => {
-        clearInterval(pollInterval)
-      }, 5 * 60 * 1000)
+    async resumeTask(taskId) {
+      try {
+        const response = await downloadAPI.resumeTask(taskId)
+        if (response.data.success) {
+          ElMessage.success(response.data.message)
+        } else {
+          ElMessage.error(response.data.message)
+        }
+      } catch (error) {
+        console.error('恢复下载任务失败:', error)
+        ElMessage.error('恢复下载任务失败')
+      }
+    },
+
+    connectEvents() {
+      if (this.eventSource) return
+
+      // 断线后EventSource会自动重连，并通过Last-Event-ID补齐错过的状态
+      const source = new EventSource(downloadAPI.eventsURL(this.lastSeq))
+      source.addEventListener('task', (event) => {
+        this.lastSeq = Number(event.lastEventId)
+        const task = JSON.parse(event.data)
+        this.tasks[task.task_id] = task
+        this.notifyIfFinished(task)
+      })
+      this.eventSource = source
+    },
+
+    disconnectEvents() {
+      if (this.eventSource) {
+        this.eventSource.close()
+        this.eventSource = null
+      }
+    },
+
+    watchTask(taskId) {
+      this.watchedTasks[taskId] = true
+      this.connectEvents()
+    },
+
+    notifyIfFinished(task) {
+      if (!this.watchedTasks[task.task_id]) return
+      if (task.status !== 'completed' && task.status !== 'failed') return
+
+      delete this.watchedTasks[task.task_id]
+      if (task.status === 'completed') {
+        ElMessage.success(`${task.description}完成`)
+      } else {
+        ElMessage.error(`${task.description}失败: ${task.message}`)
+      }
     }
   }
 })
-